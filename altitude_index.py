@@ -0,0 +1,134 @@
+import numpy
+
+
+class AltitudeIndex:
+    """Keeps the cells and vertices of a map sorted by altitude, so threshold questions such as "which cells are below
+    sea level" are answered with a binary search instead of a scan. Vertices are also sorted by the lowest and highest
+    altitudes of their generator cells, which lets the coastal set be moved between sea levels by only visiting the
+    vertices whose status changes.
+
+    The index must be rebuilt whenever altitudes change, such as after erosion."""
+    def __init__(self, k_map):
+        self.map = k_map
+
+        self.cell_order = None
+        self.cell_altitudes = None
+        self.vertex_order = None
+        self.vertex_altitudes = None
+
+        self.generator_low = None    # The lowest altitude among each vertex's generator cells
+        self.generator_high = None   # The highest altitude among each vertex's generator cells
+        self.low_order = None
+        self.high_order = None
+
+        self.sea_level = None
+        self.coastal = set()   # Indices of the vertices that are coastal at self.sea_level
+
+        self.rebuild()
+
+    def rebuild(self):
+        """Sorts the cells and vertices by their current altitudes and finds the coastal set at the current sea
+        level, setting is_coastal on every vertex."""
+        cells = self.map.cells
+        vertices = self.map.vertices
+
+        altitudes = numpy.array([cell.altitude for cell in cells], dtype=float)
+        self.cell_order = numpy.argsort(altitudes, kind='stable')
+        self.cell_altitudes = altitudes[self.cell_order]
+
+        altitudes = numpy.array([vertex.altitude for vertex in vertices], dtype=float)
+        self.vertex_order = numpy.argsort(altitudes, kind='stable')
+        self.vertex_altitudes = altitudes[self.vertex_order]
+
+        # Vertices without generators can never be coastal, so they sit at the far ends of both orders
+        self.generator_low = numpy.array([min((cell.altitude for cell in vertex.generators), default=numpy.inf)
+                                          for vertex in vertices])
+        self.generator_high = numpy.array([max((cell.altitude for cell in vertex.generators), default=-numpy.inf)
+                                           for vertex in vertices])
+        self.low_order = numpy.argsort(self.generator_low, kind='stable')
+        self.high_order = numpy.argsort(self.generator_high, kind='stable')
+
+        self.sea_level = self.map.settings.wtr_sea_level
+        is_coastal = self.get_coastal_mask(self.sea_level)
+        self.coastal = set(numpy.flatnonzero(is_coastal).tolist())
+        for each_vertex, coastal in zip(vertices, is_coastal):
+            each_vertex.is_coastal = bool(coastal)
+
+    def cells_above(self, height):
+        """Returns the cells with an altitude strictly above height."""
+        start = numpy.searchsorted(self.cell_altitudes, height, side='right')
+        return [self.map.cells[index] for index in self.cell_order[start:]]
+
+    def cells_below(self, height):
+        """Returns the cells with an altitude strictly below height."""
+        end = numpy.searchsorted(self.cell_altitudes, height, side='left')
+        return [self.map.cells[index] for index in self.cell_order[:end]]
+
+    def cells_between(self, low, high):
+        """Returns the cells with an altitude from low up to and including high, the cells that change sides when a
+        threshold moves from low to high."""
+        start = numpy.searchsorted(self.cell_altitudes, low, side='right')
+        end = numpy.searchsorted(self.cell_altitudes, high, side='right')
+        return [self.map.cells[index] for index in self.cell_order[start:end]]
+
+    def vertices_above(self, height):
+        """Returns the vertices with an altitude strictly above height."""
+        start = numpy.searchsorted(self.vertex_altitudes, height, side='right')
+        return [self.map.vertices[index] for index in self.vertex_order[start:]]
+
+    def vertices_below(self, height):
+        """Returns the vertices with an altitude strictly below height."""
+        end = numpy.searchsorted(self.vertex_altitudes, height, side='left')
+        return [self.map.vertices[index] for index in self.vertex_order[:end]]
+
+    def get_coastal_mask(self, height):
+        """Returns a boolean array over the vertices, True where a vertex has generators both above and below
+        height. This is the same test as Vertex.get_is_coastal, done for every vertex at once."""
+        return (self.generator_low < height) & (self.generator_high > height)
+
+    def get_crossing_vertices(self, low, high):
+        """Returns the indices of the vertices whose coastal status may differ between the heights low and high."""
+        low_sorted = self.generator_low[self.low_order]
+        high_sorted = self.generator_high[self.high_order]
+
+        crossing = set(self.low_order[numpy.searchsorted(low_sorted, low, side='left'):
+                                      numpy.searchsorted(low_sorted, high, side='right')].tolist())
+        crossing.update(self.high_order[numpy.searchsorted(high_sorted, low, side='left'):
+                                        numpy.searchsorted(high_sorted, high, side='right')].tolist())
+        return crossing
+
+    def coastal_at(self, height):
+        """Returns the set of coastal vertices at the given height, starting from the coastal set at the current sea
+        level and only visiting the vertices between the two."""
+        coastal = set(self.coastal)
+        low, high = sorted((self.sea_level, height))
+
+        for index in self.get_crossing_vertices(low, high):
+            if self.generator_low[index] < height < self.generator_high[index]:
+                coastal.add(index)
+            else:
+                coastal.discard(index)
+
+        return {self.map.vertices[index] for index in coastal}
+
+    def set_sea_level(self, height):
+        """Moves the indexed sea level to height, updating is_coastal only on the vertices that cross it.
+        Returns a list of the cells that changed between land and sea, and a list of the vertices whose coastal
+        status changed."""
+        low, high = sorted((self.sea_level, height))
+        changed_cells = self.cells_between(low, high)
+
+        changed_vertices = []
+        for index in self.get_crossing_vertices(low, high):
+            is_coastal = bool(self.generator_low[index] < height < self.generator_high[index])
+            each_vertex = self.map.vertices[index]
+            if each_vertex.is_coastal != is_coastal:
+                each_vertex.is_coastal = is_coastal
+                changed_vertices.append(each_vertex)
+            if is_coastal:
+                self.coastal.add(index)
+            else:
+                self.coastal.discard(index)
+
+        self.sea_level = height
+        return changed_cells, changed_vertices
@@ -0,0 +1,394 @@
+import multiprocessing
+import os
+
+import numpy
+
+from fields import CELL_FIELDS, VERTEX_FIELDS
+
+# The cell fields the atmosphere steps, in the order of the first rows of AtmosphereEngine.state
+STATE_FIELDS = ('wind_x', 'wind_y', 'temperature', 'pressure', 'humidity', 'watertable', 'rainfall_this_year')
+WIND_X, WIND_Y, TEMPERATURE, PRESSURE, HUMIDITY, WATERTABLE, RAINFALL = range(len(STATE_FIELDS))
+# The rest of the rows of the state are the deltas of a tick, and the water each cell drops into its lowest vertex
+TEMPERATURE_DELTA, PRESSURE_DELTA, HUMIDITY_DELTA, WATER_DROP = range(len(STATE_FIELDS), len(STATE_FIELDS) + 4)
+STATE_ROWS = len(STATE_FIELDS) + 4
+
+# The terrain the atmosphere reads, in the order of the rows of AtmosphereEngine.terrain
+ALTITUDE, DEFLECTION_X, DEFLECTION_Y, LOWEST_ALTITUDE, FROZEN = range(5)
+
+# The settings a step depends on, in the order of AtmosphereEngine.parameters
+PARAMETER_NAMES = ('season_ticks_modifier', 'far_y', 'wtr_sea_level', 'streams_x', 'streams_y', 'atmo_tropics_extent',
+                   'atmo_arctic_extent', 'wind_deflection_weight', 'wind_take_strength', 'wind_critical_angle',
+                   'wind_soft_cap', 'wind_hard_cap', 'wind_resistance', 'temps_equatorial', 'temps_freezing',
+                   'temps_lowest', 'temps_highest', 'temps_equatorial_rise', 'temps_arctic_cooling',
+                   'temps_natural_cooling', 'temps_alt_cooling_threshold', 'temps_alt_cooling', 'temps_critical_angle',
+                   'temps_heat_bias', 'baro_transfer_rate', 'baro_wind_effect', 'wtr_rainfall_mod',
+                   'wtr_baro_evap_rate', 'wtr_humid_evap_rate', 'wtr_drop_dist_mod')
+
+# The engine being stepped in parallel, worker processes inherit this when they fork
+engine_state = None
+
+
+class CellBlock:
+    """A spatially coherent block of cells stepped by a single worker. Cells are the cells the block owns, and
+    classes the owned cells of each color class of the engine. The halo is the ring of cells outside of the block
+    that border it, whose state the block reads and whose deltas it adds to while stepping its own cells."""
+    def __init__(self, cells, colors, color_count, starts, indices):
+        self.cells = cells
+        self.classes = [cells[colors[cells] == color] for color in range(color_count)]
+
+        counts = starts[cells + 1] - starts[cells]
+        run_starts = numpy.cumsum(counts) - counts
+        edges = numpy.repeat(starts[cells] - run_starts, counts) + numpy.arange(counts.sum())
+        self.halo = numpy.setdiff1d(numpy.unique(indices[edges]), cells, assume_unique=True)
+
+
+class AtmosphereEngine:
+    """Steps the atmosphere of every cell with numpy, as an alternative to the per-cell update of Cell. The update
+    is the same sequential sweep over the cells, where each cell pulls wind, pressure, humidity and heat from its
+    neighbors and later cells see what earlier ones took, but the cells are swept a color class at a time instead of
+    one at a time. No two cells of a class are within two steps of each other, so they neither share a neighbor nor
+    see each other's changes, and a whole class is stepped at once, one neighbor slot at a time. The classes follow
+    the order of the per-cell sweep, so the climate matches the per-cell engine's to rounding.
+
+    For the same reason a class can be divided between processes. With more than one worker the map is split into
+    spatial blocks, each stepped by a forked worker process over shared memory arrays. A block reads the state of
+    its halo and adds to the deltas of its halo cells, and the workers meet at a barrier after each class, which
+    exchanges the halos before the next class reads them. The result is the same for any number of workers."""
+    def __init__(self, k_map, workers=1):
+        self.map = k_map
+        self.settings = k_map.settings
+        fields = k_map.fields  # alias
+        cell_count = len(k_map.cells)
+        dtype = fields.dtype  # alias
+
+        self.rows = [CELL_FIELDS.index(field) for field in STATE_FIELDS]
+        self.water_row = VERTEX_FIELDS.index('water_volume')
+        self.lowest_vertices = numpy.zeros(cell_count, dtype=fields.index_dtype)
+
+        # The graph never changes, so the angle from each neighbor to the cell it leads into is found once
+        self.starts, self.indices = fields.adjacency['cell_neighbors'][:2]
+        self.degrees = numpy.diff(self.starts)
+        receivers = numpy.repeat(numpy.arange(cell_count), self.degrees)
+        points = fields.cell_points  # alias
+        with numpy.errstate(divide='ignore'):
+            self.angles_to_cell = numpy.arctan((points[receivers, 0] - points[self.indices, 0]) /
+                                               (points[receivers, 1] - points[self.indices, 1])).astype(dtype)
+
+        colors = get_distance_two_colors(self.starts, self.indices)
+        self.color_count = int(colors.max()) + 1
+
+        self.workers = workers
+        self.processes = []
+        if workers > 1:
+            context = multiprocessing.get_context('fork')
+            self.state = get_shared_array(context, (STATE_ROWS, cell_count), dtype)
+            self.terrain = get_shared_array(context, (5, cell_count), dtype)
+            self.parameters = get_shared_array(context, (1, len(PARAMETER_NAMES)), numpy.float64)[0]
+            self.blocks = [CellBlock(cells, colors, self.color_count, self.starts, self.indices)
+                           for cells in partition_cells(points, workers)]
+
+            # The main process meets the workers at the start and end of each tick, the workers meet after each class
+            self.tick_barrier = context.Barrier(workers + 1)
+            self.class_barrier = context.Barrier(workers)
+            self.is_closing = context.RawValue('b', 0)
+        else:
+            self.state = numpy.zeros((STATE_ROWS, cell_count), dtype=dtype)
+            self.terrain = numpy.zeros((5, cell_count), dtype=dtype)
+            self.parameters = numpy.zeros(len(PARAMETER_NAMES))
+            self.blocks = [CellBlock(numpy.arange(cell_count), colors, self.color_count, self.starts, self.indices)]
+
+        self.rebuild()
+
+        halo_cells = sum(len(block.halo) for block in self.blocks)
+        self.settings.db_print(f"Atmosphere split into {len(self.blocks)} blocks of {self.color_count} color classes, "
+                               f"with {halo_cells} halo cells.", detail=3)
+
+    def rebuild(self):
+        """Reads the terrain the atmosphere depends on from the cells, after it has been generated or eroded."""
+        fields = self.map.fields  # alias
+
+        self.terrain[ALTITUDE] = fields.get_cell_field('altitude')
+        self.terrain[DEFLECTION_X] = [cell.wind_deflection[0] for cell in self.map.cells]
+        self.terrain[DEFLECTION_Y] = [cell.wind_deflection[1] for cell in self.map.cells]
+        self.lowest_vertices[:] = [fields.vertex_numbers[cell.lowest_vertex] for cell in self.map.cells]
+        self.terrain[LOWEST_ALTITUDE] = fields.get_vertex_field('altitude')[self.lowest_vertices]
+        self.find_frozen()
+
+    def find_frozen(self):
+        """Reads which cells are frozen, see KhaosMap.freeze_converged_cells."""
+        self.terrain[FROZEN] = [cell.is_frozen for cell in self.map.cells]
+
+    def set_parameters(self):
+        """Copies the settings a step depends on into the parameters, including those that change as it runs."""
+        stg = self.settings
+        values = {'far_y': self.map.far_y, 'streams_x': stg.wind_streams_vector[0],
+                  'streams_y': stg.wind_streams_vector[1]}
+        self.parameters[:] = [values[name] if name in values else getattr(stg, name) for name in PARAMETER_NAMES]
+
+    def step(self):
+        """Advances the atmosphere of every cell by a single tick."""
+        fields = self.map.fields  # alias
+
+        self.state[:len(STATE_FIELDS)] = fields.cell_array[self.rows]
+        self.state[len(STATE_FIELDS):] = 0.0
+        self.set_parameters()
+
+        if self.workers > 1:
+            if not self.processes:
+                self.start_workers()
+            self.tick_barrier.wait()
+            self.tick_barrier.wait()
+        else:
+            step_block(self, self.blocks[0])
+
+        fields.cell_array[self.rows] = self.state[:len(STATE_FIELDS)]
+        fields.vertex_array[self.water_row] += numpy.bincount(self.lowest_vertices, self.state[WATER_DROP],
+                                                              minlength=fields.vertex_array.shape[1])
+
+    def start_workers(self):
+        """Forks a worker process for each block."""
+        global engine_state
+        engine_state = self
+
+        context = multiprocessing.get_context('fork')
+        for number in range(len(self.blocks)):
+            process = context.Process(target=run_worker, args=(number,), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def close(self):
+        """Stops the worker processes."""
+        if self.processes:
+            self.is_closing.value = 1
+            self.tick_barrier.wait()
+            for each_process in self.processes:
+                each_process.join()
+            self.processes = []
+
+
+def get_shared_array(context, shape, dtype):
+    """Returns a float array of the given shape and dtype in memory shared with the processes forked from this one."""
+    return numpy.frombuffer(context.RawArray(numpy.dtype(dtype).char, shape[0] * shape[1]), dtype=dtype).reshape(shape)
+
+
+def get_distance_two_colors(starts, indices):
+    """Colors the cells in the order of the sweep, giving each cell the color after the highest color of the earlier
+    cells within two steps of it. No two cells within two steps of each other share a color, and of any two such
+    cells the earlier one always has the lower color, so stepping the classes in order sees the same changes as the
+    per-cell sweep. Returns the color of every cell."""
+    neighbors = [indices[starts[cell]:starts[cell + 1]].tolist() for cell in range(len(starts) - 1)]
+    colors = [-1] * len(neighbors)
+    for cell, cell_neighbors in enumerate(neighbors):
+        # Later cells are still uncolored at -1
+        highest = -1
+        for each_neighbor in cell_neighbors:
+            highest = max(highest, colors[each_neighbor], *(colors[second] for second in neighbors[each_neighbor]))
+        colors[cell] = highest + 1
+
+    return numpy.array(colors)
+
+
+def partition_cells(points, count):
+    """Splits the cells into count blocks of nearly equal size by recursively halving along the longer axis of
+    each block, so every block is compact and its halo small. Returns a sorted array of cell numbers per block."""
+    blocks = [numpy.arange(len(points))]
+    while len(blocks) < count:
+        # Split the largest block in two
+        cells = blocks.pop(max(range(len(blocks)), key=lambda index: len(blocks[index])))
+        spans = points[cells].max(axis=0) - points[cells].min(axis=0)
+        order = cells[numpy.argsort(points[cells, int(numpy.argmax(spans))], kind='stable')]
+        blocks.extend([order[:len(order) // 2], order[len(order) // 2:]])
+
+    return [numpy.sort(block) for block in blocks]
+
+
+def run_worker(number):
+    """Steps a single block of the engine in engine_state every tick, until the engine is closed."""
+    engine = engine_state
+    while True:
+        engine.tick_barrier.wait()
+        if engine.is_closing.value:
+            return
+
+        try:
+            step_block(engine, engine.blocks[number], engine.class_barrier)
+        except Exception:
+            # Break the barriers so the main process and the other workers do not wait forever
+            engine.class_barrier.abort()
+            engine.tick_barrier.abort()
+            raise
+        engine.tick_barrier.wait()
+
+
+def step_block(engine, block, class_barrier=None):
+    """Steps the block's cells a class at a time, then updates them. Class_barrier is waited on after every class
+    when other workers are stepping the other blocks."""
+    prm = dict(zip(PARAMETER_NAMES, engine.parameters.tolist()))
+    is_frozen = engine.terrain[FROZEN] > 0.0
+
+    for each_class in block.classes:
+        step_class(engine, each_class[~is_frozen[each_class]], prm)
+        if class_barrier is not None:
+            class_barrier.wait()
+
+    update_cells(engine, block.cells, prm)
+
+
+def get_wind_angles(wind_x, wind_y):
+    """Returns the angles of wind vectors as Cell.calculate_atmosphere_update measures them."""
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        angles = numpy.arctan(wind_x / wind_y)
+    angles[wind_y == 0] = numpy.where(wind_x[wind_y == 0] >= 0.0, 0.0, numpy.pi)
+    return angles
+
+
+def step_class(engine, cells, prm):
+    """Pulls the atmosphere of the neighbors of a class of cells into them. Mirrors Cell.calculate_atmosphere_update
+    and the take_ methods of Cell, with the wind being its own delta as it is after the first update."""
+    state, terrain = engine.state, engine.terrain  # alias
+    if len(cells) == 0:
+        return
+    degrees = engine.degrees[cells]
+    is_frozen = terrain[FROZEN] > 0.0
+
+    # Each cell goes through its neighbors in order, so the cells are stepped together a neighbor slot at a time
+    for slot in range(int(degrees.max())):
+        receivers = cells[degrees > slot]
+        edges = engine.starts[receivers] + slot
+        givers = engine.indices[edges]
+        angles = numpy.abs(get_wind_angles(state[WIND_X, givers], state[WIND_Y, givers]) - engine.angles_to_cell[edges])
+
+        is_windward = angles < prm['wind_critical_angle']
+        if is_windward.any():
+            receiver, giver = receivers[is_windward], givers[is_windward]
+            multiplier = (1 / prm['wind_critical_angle']) * angles[is_windward]
+            giver_pressure, receiver_pressure = state[PRESSURE, giver], state[PRESSURE, receiver]
+
+            # Wind, frozen cells give wind from a copy of their vector so their own wind is untouched
+            bwe = prm['baro_wind_effect']  # alias
+            take_factor = ((giver_pressure + bwe + 1) / bwe + 1) * bwe
+            for row in (WIND_X, WIND_Y):
+                delta = state[row, giver] * multiplier * prm['wind_take_strength'] * take_factor
+                state[row, giver] -= numpy.where(is_frozen[giver], 0.0, delta)
+                state[row, receiver] += delta
+
+            # Pressure, hot air holds on to less of its pressure and cold air to more
+            temps_as_percent = (state[TEMPERATURE, giver] - prm['temps_lowest']) / \
+                               (prm['temps_equatorial'] - prm['temps_lowest'])
+            delta = (giver_pressure - receiver_pressure) * multiplier * prm['baro_transfer_rate']
+            delta *= numpy.where(temps_as_percent > 0.5,
+                                 (1 + giver_pressure) / (1 + receiver_pressure + temps_as_percent),
+                                 (1 + giver_pressure + (1 - temps_as_percent)) / (1 + receiver_pressure))
+            delta[((receiver_pressure + state[PRESSURE_DELTA, receiver] + delta >= 1.0) & (delta > 0.0)) |
+                  ((giver_pressure + state[PRESSURE_DELTA, giver] - delta <= -1.0) & (delta < 0.0))] = 0.0
+            state[PRESSURE_DELTA, giver] -= delta
+            state[PRESSURE_DELTA, receiver] += delta
+
+            # Humidity
+            state[HUMIDITY_DELTA, receiver] += (state[HUMIDITY, giver] + state[HUMIDITY_DELTA, giver]) * multiplier * \
+                                               (1 - state[HUMIDITY, receiver] + state[HUMIDITY_DELTA, receiver])
+
+        # Temperature, biased toward the spread of heat
+        is_heated = angles < prm['temps_critical_angle']
+        if is_heated.any():
+            receiver, giver = receivers[is_heated], givers[is_heated]
+            multiplier = (1 / prm['temps_critical_angle']) * angles[is_heated]
+            delta = ((state[TEMPERATURE, giver] - prm['temps_lowest'] + state[TEMPERATURE_DELTA, giver]) -
+                     (state[TEMPERATURE, receiver] - prm['temps_lowest'] + state[TEMPERATURE_DELTA, receiver])) * \
+                    multiplier
+            delta = numpy.where(delta >= 0.0, delta * prm['temps_heat_bias'], delta / prm['temps_heat_bias'])
+            state[TEMPERATURE_DELTA, giver] -= delta
+            state[TEMPERATURE_DELTA, receiver] += delta
+
+    # The equatorial jet stream and heating, and the backwards jet stream and cooling of the arctic zones
+    temperature = state[TEMPERATURE, cells]
+    latitude = numpy.abs(engine.map.fields.cell_points[cells, 1] + prm['season_ticks_modifier'])
+    is_tropical = latitude < prm['atmo_tropics_extent']
+    tropics_effect = numpy.where(is_tropical, latitude / prm['atmo_tropics_extent'], 0.0)
+    arctic_start = prm['far_y'] - prm['atmo_arctic_extent']
+    is_arctic = ~is_tropical & (latitude > arctic_start)
+    arctic_effect = numpy.where(is_arctic, (latitude - arctic_start) / prm['atmo_arctic_extent'], 0.0)
+    state[WIND_X, cells] += numpy.where(is_tropical, prm['streams_x'] * tropics_effect, 0.0)
+    state[WIND_Y, cells] += numpy.where(is_tropical, prm['streams_y'] * tropics_effect, 0.0)
+    state[WIND_X, cells] -= numpy.where(is_arctic, prm['streams_x'] * arctic_effect, 0.0)
+    state[WIND_Y, cells] -= numpy.where(is_arctic, prm['streams_y'] * arctic_effect, 0.0)
+    state[TEMPERATURE_DELTA, cells] += numpy.where(is_tropical & (temperature < prm['temps_equatorial']),
+                                                   prm['temps_equatorial_rise'] * tropics_effect, 0.0)
+    state[TEMPERATURE_DELTA, cells] -= numpy.where(is_arctic, prm['temps_arctic_cooling'] * arctic_effect, 0.0)
+    state[TEMPERATURE_DELTA, cells] -= prm['temps_natural_cooling']
+
+    # Terrain deflects the wind over land, the oceans evaporate into the air
+    is_land = terrain[ALTITUDE, cells] > prm['wtr_sea_level']
+    state[WIND_X, cells] += numpy.where(is_land, terrain[DEFLECTION_X, cells] * prm['wind_deflection_weight'], 0.0)
+    state[WIND_Y, cells] += numpy.where(is_land, terrain[DEFLECTION_Y, cells] * prm['wind_deflection_weight'], 0.0)
+    evaporation = temperature + state[TEMPERATURE_DELTA, cells] - prm['temps_freezing'] / \
+                  (prm['temps_highest'] - prm['temps_freezing'])
+    state[PRESSURE_DELTA, cells] += numpy.where(is_land, 0.0, prm['wtr_baro_evap_rate'] * evaporation)
+    state[HUMIDITY_DELTA, cells] += numpy.where(is_land, 0.0, prm['wtr_humid_evap_rate'] * evaporation)
+
+
+def update_cells(engine, cells, prm):
+    """Applies the deltas of the tick to the cells. Mirrors Cell.update_atmosphere."""
+    state, terrain = engine.state, engine.terrain  # alias
+
+    # Frozen cells discard their deltas, but keep raining from their replayed state so hydrology is still fed
+    drop_rainfall(engine, cells[terrain[FROZEN, cells] > 0.0], 0.0, prm)
+    cells = cells[terrain[FROZEN, cells] == 0.0]
+    altitude = terrain[ALTITUDE, cells]
+
+    # Wind, reduced above the soft cap and clamped to the hard cap
+    wind_x, wind_y = state[WIND_X, cells], state[WIND_Y, cells]
+    magnitude = numpy.hypot(wind_x, wind_y)
+    new_magnitude = numpy.where(magnitude > prm['wind_soft_cap'],
+                                magnitude - (magnitude - prm['wind_soft_cap']) * prm['wind_resistance'], magnitude)
+    new_magnitude = numpy.minimum(new_magnitude, prm['wind_hard_cap'])
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        scale = numpy.where(new_magnitude < magnitude, new_magnitude / magnitude, 1.0)
+    state[WIND_X, cells] = wind_x * scale
+    state[WIND_Y, cells] = wind_y * scale
+
+    # Temperature, with cooling at altitude
+    altct = prm['temps_alt_cooling_threshold']  # alias
+    temperature = state[TEMPERATURE, cells] + state[TEMPERATURE_DELTA, cells]
+    temperature -= numpy.where(altitude > altct, ((altitude - altct) / (1 - altct)) * prm['temps_alt_cooling'], 0.0)
+    temperature = numpy.clip(temperature, prm['temps_lowest'], prm['temps_highest'])
+    state[TEMPERATURE, cells] = temperature
+
+    # Rainfall, taken out of the humidity and pressure
+    rainfall = drop_rainfall(engine, cells, state[HUMIDITY_DELTA, cells], prm)
+    humidity_delta = state[HUMIDITY_DELTA, cells] - rainfall
+    pressure_delta = state[PRESSURE_DELTA, cells] - rainfall
+
+    state[HUMIDITY, cells] = numpy.clip(state[HUMIDITY, cells] + humidity_delta, 0.0, 1.0)
+    pressure = state[PRESSURE, cells] + pressure_delta
+    pressure[pressure >= 1.0] = 0.999
+    pressure[pressure <= -1.0] = -0.999
+    state[PRESSURE, cells] = pressure
+
+
+def drop_rainfall(engine, cells, humidity_delta, prm):
+    """Finds the rainfall of the cells from their humidity, altitude and temperature, adds it to their rainfall and to
+    their watertable above sea level, then drops part of the watertable toward their lowest vertex. Returns the
+    rainfall. Mirrors Cell.drop_rainfall."""
+    state, terrain = engine.state, engine.terrain  # alias
+    altitude = terrain[ALTITUDE, cells]
+
+    # Rainfall, based on the altitude and temperature, feeding the watertable above sea level
+    temps_mod = numpy.abs((state[TEMPERATURE, cells] - prm['temps_freezing']) - prm['temps_highest']) / \
+                (prm['temps_highest'] - prm['temps_freezing'])
+    rainfall = (state[HUMIDITY, cells] + humidity_delta) * (2 * altitude) * temps_mod
+    state[RAINFALL, cells] += rainfall * prm['wtr_rainfall_mod']
+    watertable = state[WATERTABLE, cells] + numpy.where(altitude > prm['wtr_sea_level'],
+                                                        rainfall * prm['wtr_rainfall_mod'], 0.0)
+
+    # The watertable drops toward the lowest vertex of the cell, see Cell.find_watertable_drop
+    water_drop = (watertable - watertable * altitude) * \
+                 ((altitude - terrain[LOWEST_ALTITUDE, cells]) / (altitude + 0.0001)) * prm['wtr_drop_dist_mod']
+    state[WATERTABLE, cells] = watertable - water_drop
+    state[WATER_DROP, cells] = water_drop
+    return rainfall
+
+
+def get_worker_count(workers):
+    """Returns the number of workers to use for a setting of workers, where 0 uses one per core."""
+    return workers or os.cpu_count() or 1
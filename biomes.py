@@ -178,13 +178,13 @@ class Biome:
         # Determine if the biome is landlocked or coastal
         landlocked = True
         if 'aquatic' not in tag_cloud:
-            for cell_neighbor in self.cell.neighbors.keys():
+            for cell_neighbor in self.cell.neighbors:
                 if cell_neighbor.altitude < self.cell.settings.wtr_sea_level:
                     tag_cloud.append('coastal')
                     landlocked = False
                     break
         else:
-            for cell_neighbor in self.cell.neighbors.keys():
+            for cell_neighbor in self.cell.neighbors:
                 if cell_neighbor.altitude > self.cell.settings.wtr_sea_level:
                     tag_cloud.append('coastal')
             landlocked = False
@@ -0,0 +1,51 @@
+import copy
+import sys
+
+from khaos_map import KhaosMap
+from precision import get_map_drift
+from settings import Settings
+
+
+def measure_cache_match(ticks=45, settings=None):
+    """Builds the same map without the generation cache and restored from it, simulates both for a number of ticks
+    and returns the drift of every field of the restored map against the uncached one, see get_map_drift. A restored
+    map should carry on exactly as the map that was cached, so every drift should be 0."""
+    if settings is None:
+        settings = Settings()
+
+    maps = []
+    for cache_enable in (False, True, True):
+        map_settings = copy.copy(settings)
+        map_settings.cache_enable = cache_enable
+        maps.append(KhaosMap(map_settings))
+
+    # The first cached map may have run the stages to fill the cache, the second is always restored from it
+    reference_map, restored_map = maps[0], maps[2]
+    for tick in range(ticks):
+        reference_map.update_atmosphere()
+        restored_map.update_atmosphere()
+    return get_map_drift(reference_map, restored_map)
+
+
+def write_match_report(drift):
+    """Returns the results of measure_cache_match as printable lines, listing only the fields that differ."""
+    lines = []
+    for name, field_drift in drift.items():
+        if field_drift['max'] > 0.0:
+            lines.append(f"  {name:<26}{field_drift['rms']:>12.4g}{field_drift['max']:>12.4g}")
+
+    if not lines:
+        return ["The restored map matches the uncached map."]
+    return ["The restored map differs from the uncached map (RMS, largest):"] + lines
+
+
+if __name__ == "__main__":
+    # Usage: python cache_check.py [ticks] [presim ticks] [total_cells]
+    check_settings = Settings()
+    check_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 45
+    if len(sys.argv) > 2:
+        check_settings.wind_presim = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        check_settings.total_cells = int(sys.argv[3])
+
+    print('\n'.join(write_match_report(measure_cache_match(check_ticks, check_settings))))
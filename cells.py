@@ -1,32 +1,50 @@
 import math
 
-import pygame.draw
-
 from render import *
 from biomes import *
+from fields import CELL_FIELDS, VERTEX_FIELDS, StoredField, get_detached_views
 
 
 class Cell(Renderable):
     """Stores information about a single cell, which has a generator point treated as a pseudo-center and a region
-    formed of shared edge vertices with its neighbor cells."""
+    formed of shared edge vertices with its neighbor cells. The region and neighbors are tuples of the objects, the
+    distances to them are kept in the map's FieldStore adjacency."""
+    __slots__ = ('settings', 'field_views', 'field_number', 'x', 'y', 'ss_x', 'ss_y', 'region', 'neighbors',
+                 'lowest_vertex', 'wind_deflection', 'biome', 'last_spring', 'last_summer', 'last_autumn',
+                 'last_winter', 'temperature_delta', 'pressure_delta', 'humidity_delta', 'is_frozen', 'polygon',
+                 'cell_color', 'is_focus')
+
+    # Fields kept in the map's FieldStore, see fields.py
+    altitude = StoredField(CELL_FIELDS.index('altitude'))
+    temperature = StoredField(CELL_FIELDS.index('temperature'))
+    pressure = StoredField(CELL_FIELDS.index('pressure'))
+    humidity = StoredField(CELL_FIELDS.index('humidity'))
+    watertable = StoredField(CELL_FIELDS.index('watertable'))
+    rainfall_this_year = StoredField(CELL_FIELDS.index('rainfall_this_year'))
+    rainfall_last_year = StoredField(CELL_FIELDS.index('rainfall_last_year'))
+    wind_x = StoredField(CELL_FIELDS.index('wind_x'))
+    wind_y = StoredField(CELL_FIELDS.index('wind_y'))
 
     def __init__(self, point, settings):
         super().__init__()
 
         self.settings = settings
+        self.field_views = get_detached_views(CELL_FIELDS)
+        self.field_number = 0
 
         # Cell data
         self.x, self.y = point
         self.ss_x = None
         self.ss_y = None
-        self.region = {}
-        self.neighbors = {}
+        self.region = ()
+        self.neighbors = ()
 
         # Associated Terrain data
         self.altitude = 0.0
         self.lowest_vertex = None
         self.wind_deflection = None
-        self.wind_vector = pygame.math.Vector2(0, 0)
+        self.wind_x = 0.0
+        self.wind_y = 0.0
         self.temperature = (settings.temps_equatorial + settings.temps_lowest) / 2
         self.humidity = 0.0
 
@@ -50,12 +68,14 @@ class Cell(Renderable):
         else:
             self.pressure = 0.01
 
-        # The delta values for atmosphere calculation
-        self.wind_vector_delta = pygame.math.Vector2(0, 0)
+        # The delta values for atmosphere calculation, the wind is changed in place as the cells are swept
         self.temperature_delta = 0
         self.pressure_delta = 0
         self.humidity_delta = 0.0
 
+        # Frozen cells have converged and only replay their seasonal state, see KhaosMap.update_frozen_cells
+        self.is_frozen = False
+
         # Rendering Settings
         self.polygon = None
         self.cell_color = (0, 64, 0)
@@ -65,7 +85,7 @@ class Cell(Renderable):
         """Finds the average altitude of the vertices and makes it the total altitude of the cell"""
         self.altitude = 0.0
 
-        for each_vertex in self.region.keys():
+        for each_vertex in self.region:
             self.altitude += each_vertex.altitude
 
         self.altitude /= len(self.region)
@@ -106,54 +126,75 @@ class Cell(Renderable):
 
         self.cell_color = colors
 
+    def get_draw_color(self):
+        """Returns the color the cell is drawn in, which depends on the biome, the sea level and the rainfall
+        overlay."""
+        if self.biome:
+            return self.cell_color
+
+        if self.altitude <= self.settings.wtr_sea_level:
+            return self.settings.clr['ocean']
+
+        # If render rainfall is on, mix the colors with the rainfall colors
+        if self.settings.do_render_rainfall:
+            if self.rainfall_last_year == 0:
+                rainfall_mod = self.rainfall_this_year / 1000
+            else:
+                rainfall_mod = self.rainfall_last_year / 1000
+            if rainfall_mod > 1:
+                rainfall_mod = 1
+            rainfall_mod *= 255
+            return ((self.cell_color[0] + rainfall_mod / 2) / 2,
+                    (self.cell_color[1] + rainfall_mod / 2) / 2,
+                    (self.cell_color[2] + rainfall_mod) / 2)
+
+        return self.cell_color
+
     def find_screen_space(self):
         """Finds the x and y of the cell on the screen."""
         self.ss_x, self.ss_y = self.settings.project_to_screen(self.x, self.y)
 
     def find_wind_deflection(self):
-        """Finds the wind deflection vector for the cell."""
-        self.wind_deflection = None
+        """Finds the wind deflection vector for the cell, as an (x, y) tuple."""
+        deflection_x, deflection_y = 0.0, 0.0
 
-        # Creates the vector objects and makes a linear interpolation of them, scaling based on the total to crea
-        for each_vector in self.region.keys():
+        # Each vertex pushes the wind away from it, scaled by its altitude, and the pushes are summed
+        for each_vector in self.region:
             x_diff = each_vector.x - self.x
             y_diff = each_vector.y - self.y
-            deflector = pygame.math.Vector2(x_diff, y_diff)
-            if each_vector.altitude == 0.0:
-                deflector.scale_to_length(0.0)
-            else:
-                deflector.scale_to_length(-each_vector.altitude * 0.1)
-            if self.wind_deflection is None:
-                self.wind_deflection = deflector
-            else:
-                self.wind_deflection += deflector
+            scale = -each_vector.altitude * 0.1 / math.hypot(x_diff, y_diff)
+            deflection_x += x_diff * scale
+            deflection_y += y_diff * scale
+
+        self.wind_deflection = (deflection_x, deflection_y)
 
     def find_region(self, index, vor, vertices):
-        """Finds the region for the cell, which are stored as a dictionary of the vertex objects
-        that make up that region : the distance to that vertex."""
-        self.region.clear()
+        """Finds the region for the cell, which is stored as a tuple of the vertex objects that make up that region.
+        The cell is added to the generators of each of them."""
+        region = []
 
         for vertex_index in vor.regions[vor.point_region[index]]:
             if vertex_index != -1:
                 vert = vertices[vertex_index]
-                dist = math.sqrt(abs(self.x - vert.x) + abs(self.y - vert.y))
+                if vert not in region:
+                    region.append(vert)
+                if self not in vert.generators:
+                    vert.generators += (self,)
 
-                self.region[vert] = dist
-                vert.generators[self] = dist
+        self.region = tuple(region)
 
     def find_neighbors(self, index, vor, cells):
-        """Finds the neighboring cells by looking them up in the voronoi diagram, then builds a dictionary where
-        Cell Object: Distance Between Cells."""
-        self.neighbors.clear()
+        """Finds the neighboring cells by looking them up in the voronoi diagram, and stores them as a tuple of the
+        Cell objects."""
+        neighbors = {}
 
         for index_a, index_b in vor.ridge_points:
             if index == index_a and index_b != -1 and index_b < len(cells):
-                cell = cells[index_b]
+                neighbors[cells[index_b]] = None
             elif index == index_b and index_a != -1 and index_a < len(cells):
-                cell = cells[index_a]
-            else:
-                continue
-            self.neighbors[cell] = math.sqrt(abs(self.x - cell.x) + abs(self.y - cell.y))
+                neighbors[cells[index_a]] = None
+
+        self.neighbors = tuple(neighbors)
 
     def find_lowest_vertex(self):
         """Finds the neighboring vertex with the lowest altitude, and stores it in self.lowest_vertex."""
@@ -224,17 +265,20 @@ class Cell(Renderable):
         return delta
 
     def take_wind(self, wind_multiplier):
-        """Given a wind_multiplier between 1 and 0, returns a segment of its vector,
-        automatically reducing its own delta by the same amount."""
-
-        delta = self.wind_vector * wind_multiplier * self.settings.wind_take_strength
+        """Given a wind_multiplier between 1 and 0, returns a segment of its wind as an (x, y) tuple,
+        automatically reducing its own wind by the same amount. Frozen cells keep their wind."""
+        scale = wind_multiplier * self.settings.wind_take_strength
 
         # Local pressure affects the transfer rate of the wind
-        delta *= ((self.pressure + self.settings.baro_wind_effect + 1) / self.settings.baro_wind_effect + 1) * self.settings.baro_wind_effect
+        baro_wind_effect = self.settings.baro_wind_effect  # alias
+        scale *= ((self.pressure + baro_wind_effect + 1) / baro_wind_effect + 1) * baro_wind_effect
 
-        self.wind_vector_delta -= delta
+        delta_x, delta_y = self.wind_x * scale, self.wind_y * scale
+        if not self.is_frozen:
+            self.wind_x -= delta_x
+            self.wind_y -= delta_y
 
-        return delta
+        return delta_x, delta_y
 
     def take_humidity(self, humidity_multiplier, source):
         """Given a humidity_multiplier between 1 and 0, returns a number to be added to the source,
@@ -264,29 +308,32 @@ class Cell(Renderable):
         """Calculates updates to the local atmosphere based on wind speed, direction, temp and current pressure.
         Sends delta calls to neighbors, and sets internal deltas."""
         stg = self.settings
+        wind_x, wind_y = self.wind_x, self.wind_y
 
         # Cells poll their neighbors for valid wind angles, and call their delta functions
-        for each_neighbor in self.neighbors.keys():
+        for each_neighbor in self.neighbors:
 
             x_adjust = self.x - each_neighbor.x
             y_adjust = self.y - each_neighbor.y
             angle_to_self = math.atan(x_adjust / y_adjust)
 
             # Prevent a divide by 0 error in angle calcs
-            if each_neighbor.wind_vector.y == 0:
-                if each_neighbor.wind_vector.x >= 0.0:
+            if each_neighbor.wind_y == 0:
+                if each_neighbor.wind_x >= 0.0:
                     neighbor_wind_angle = 0
                 else:
                     neighbor_wind_angle = math.pi
             else:
-                neighbor_wind_angle = math.atan(each_neighbor.wind_vector.x /
-                                                each_neighbor.wind_vector.y)
+                neighbor_wind_angle = math.atan(each_neighbor.wind_x /
+                                                each_neighbor.wind_y)
             neighbor_wind_angle = abs(neighbor_wind_angle - angle_to_self)
 
             # Check wind angle, create a multiplier and pass it to the individual atmosphere calcs in the cell
             if neighbor_wind_angle < stg.wind_critical_angle:
                 wind_multiplier = (1 / stg.wind_critical_angle) * neighbor_wind_angle
-                self.wind_vector_delta += each_neighbor.take_wind(wind_multiplier)
+                delta_x, delta_y = each_neighbor.take_wind(wind_multiplier)
+                wind_x += delta_x
+                wind_y += delta_y
                 self.pressure_delta += each_neighbor.take_baro(wind_multiplier, self)
                 self.humidity_delta += each_neighbor.take_humidity(wind_multiplier, self)
 
@@ -297,8 +344,9 @@ class Cell(Renderable):
 
         # Adds the equatorial jet stream and heating
         if abs(self.y + stg.season_ticks_modifier) < stg.atmo_tropics_extent:
-            self.wind_vector_delta += stg.wind_streams_vector * \
-                                      (abs(self.y + stg.season_ticks_modifier) / stg.atmo_tropics_extent)
+            tropics_effect = abs(self.y + stg.season_ticks_modifier) / stg.atmo_tropics_extent
+            wind_x += stg.wind_streams_vector[0] * tropics_effect
+            wind_y += stg.wind_streams_vector[1] * tropics_effect
 
             # Only heat if below the target temp for the equator
             if self.temperature < self.settings.temps_equatorial:
@@ -307,8 +355,10 @@ class Cell(Renderable):
 
         # Same process but inverted for the arctic zones, jetstreams run backwards here
         elif abs(self.y + stg.season_ticks_modifier) > k_map.far_y - stg.atmo_arctic_extent:
-            self.wind_vector_delta -= stg.wind_streams_vector * \
-                                      ((abs(self.y + stg.season_ticks_modifier) - (k_map.far_y - stg.atmo_arctic_extent)) / stg.atmo_arctic_extent)
+            arctic_effect = (abs(self.y + stg.season_ticks_modifier) - (k_map.far_y - stg.atmo_arctic_extent)) / \
+                            stg.atmo_arctic_extent
+            wind_x -= stg.wind_streams_vector[0] * arctic_effect
+            wind_y -= stg.wind_streams_vector[1] * arctic_effect
             self.temperature_delta -= stg.temps_arctic_cooling * \
                                       ((abs(self.y + stg.season_ticks_modifier) - (k_map.far_y - stg.atmo_arctic_extent)) / stg.atmo_arctic_extent)
 
@@ -317,7 +367,8 @@ class Cell(Renderable):
 
         # Apply the terrain deflection value generated by the cell, if it is above sea level
         if self.altitude > stg.wtr_sea_level:
-            self.wind_vector_delta += self.wind_deflection * stg.wind_deflection_weight
+            wind_x += self.wind_deflection[0] * stg.wind_deflection_weight
+            wind_y += self.wind_deflection[1] * stg.wind_deflection_weight
 
         # Add rising water vapor over the oceans to both the humidity and pressure of the cell
         else:
@@ -327,6 +378,8 @@ class Cell(Renderable):
             self.pressure_delta += stg.wtr_baro_evap_rate * temps_multiplier
             self.humidity_delta += stg.wtr_humid_evap_rate * temps_multiplier
 
+        self.wind_x, self.wind_y = wind_x, wind_y
+
     def record_season(self, current_season):
         """Take record of current weather data in a SeasonData object.
         Assign it to the proper self.last_season variable."""
@@ -341,20 +394,29 @@ class Cell(Renderable):
 
     def update_atmosphere(self):
         """Using the previously calculated data, update the atmosphere to reflect those changes."""
-
-        # Wind
-        self.wind_vector = self.wind_vector_delta
-        self.wind_vector_delta = self.wind_vector
+        # Frozen cells discard anything their active neighbors took from them, but keep raining from their replayed
+        # state so the watertable and the vertices below are still fed
+        if self.is_frozen:
+            self.temperature_delta = 0
+            self.pressure_delta = 0.0
+            self.humidity_delta = 0.0
+            self.drop_rainfall()
+            self.pressure_delta = 0.0
+            self.humidity_delta = 0.0
+            return
 
         # if the wind is stronger than the soft cap, it is reduced by wind_res * (wind speed - the soft cap)
-        if self.wind_vector.magnitude() > self.settings.wind_soft_cap:
-            modifier = self.wind_vector.magnitude() - self.settings.wind_soft_cap
-            modifier *= self.settings.wind_resistance
-            self.wind_vector.scale_to_length(self.wind_vector.magnitude() - modifier)
+        magnitude = math.hypot(self.wind_x, self.wind_y)
+        new_magnitude = magnitude
+        if new_magnitude > self.settings.wind_soft_cap:
+            new_magnitude -= (new_magnitude - self.settings.wind_soft_cap) * self.settings.wind_resistance
 
         # If still stronger than the hard cap, clamp it
-        if self.wind_vector.magnitude() > self.settings.wind_hard_cap:
-            self.wind_vector.scale_to_length(self.settings.wind_hard_cap)
+        if new_magnitude > self.settings.wind_hard_cap:
+            new_magnitude = self.settings.wind_hard_cap
+        if new_magnitude < magnitude:
+            self.wind_x *= new_magnitude / magnitude
+            self.wind_y *= new_magnitude / magnitude
 
         # Temps
         self.temperature += self.temperature_delta
@@ -371,22 +433,7 @@ class Cell(Renderable):
         elif self.temperature > self.settings.temps_highest:
             self.temperature = self.settings.temps_highest
 
-        # Drop a percentage of moisture based on current altitude and temperature
-        temps_mod = abs((self.temperature - self.settings.temps_freezing) - self.settings.temps_highest) / \
-                    (self.settings.temps_highest - self.settings.temps_freezing)
-        rainfall = (self.humidity + self.humidity_delta) * (2 * self.altitude) * temps_mod
-        self.humidity_delta -= rainfall
-        self.pressure_delta -= rainfall
-        self.rainfall_this_year += rainfall * self.settings.wtr_rainfall_mod
-
-        # Add rainfall to the watertable above sea level
-        if self.altitude > self.settings.wtr_sea_level:
-            self.watertable += rainfall * self.settings.wtr_rainfall_mod
-
-        # Adjust the watertable relative to altitude
-        watertable_delta = self.find_watertable_drop()
-        self.watertable -= watertable_delta
-        self.lowest_vertex.water_volume += watertable_delta
+        self.drop_rainfall()
 
         # Moisture
         self.humidity += self.humidity_delta
@@ -406,13 +453,34 @@ class Cell(Renderable):
         elif self.pressure <= -1.0:
             self.pressure = -0.999
 
+    def drop_rainfall(self):
+        """Drops a percentage of moisture as rain based on the current altitude and temperature, taking it out of the
+        humidity and pressure deltas and adding it to the watertable, then drains the watertable toward the lowest
+        vertex."""
+        # Drop a percentage of moisture based on current altitude and temperature
+        temps_mod = abs((self.temperature - self.settings.temps_freezing) - self.settings.temps_highest) / \
+                    (self.settings.temps_highest - self.settings.temps_freezing)
+        rainfall = (self.humidity + self.humidity_delta) * (2 * self.altitude) * temps_mod
+        self.humidity_delta -= rainfall
+        self.pressure_delta -= rainfall
+        self.rainfall_this_year += rainfall * self.settings.wtr_rainfall_mod
+
+        # Add rainfall to the watertable above sea level
+        if self.altitude > self.settings.wtr_sea_level:
+            self.watertable += rainfall * self.settings.wtr_rainfall_mod
+
+        # Adjust the watertable relative to altitude
+        watertable_delta = self.find_watertable_drop()
+        self.watertable -= watertable_delta
+        self.lowest_vertex.water_volume += watertable_delta
+
     def write(self):
         """Method returns a string containing all the info about the cell for output into a textbox."""
         output = f"This cell is at {round(self.x, 3)}, {round(self.y, 3)}. * * "
         output += f"Local Altitude: {round(self.altitude, 3)} * Temperature: {round(self.temperature, 1)} * "
         output += f"Humidity {round(self.humidity, 2)} * Pressure: {round(self.pressure, 3)} * "
-        output += f"Wind Angle: {round(math.atan(self.wind_vector.x / self.wind_vector.y), 3)}, "
-        output += f"Magnitude: {round(self.wind_vector.magnitude(), 2)} * * "
+        output += f"Wind Angle: {round(math.atan(self.wind_x / self.wind_y), 3)}, "
+        output += f"Magnitude: {round(math.hypot(self.wind_x, self.wind_y), 2)} * * "
 
         output += f"Rainfall this year: {round(self.rainfall_this_year, 2)} * "
         output += f"Rainfall last year: {round(self.rainfall_last_year, 2)} * * "
@@ -430,6 +498,8 @@ class Cell(Renderable):
 
     def update(self, renderer):
         """The update function of the Cell as a Renderable object. Calls to pygame to draw the cell."""
+        import pygame.draw
+
         # If the polygon is None, then this item has never run before, calculate the polygon
         if self.polygon is None:
             project = self.settings.project_to_screen
@@ -438,7 +508,7 @@ class Cell(Renderable):
             self.polygon = []
 
             # Takes each vertex and projects it to fit the screen size
-            for each_vertex in self.region.keys():
+            for each_vertex in self.region:
                 self.polygon.append(project(each_vertex.x, each_vertex.y))
 
             # Calculate the color
@@ -446,48 +516,7 @@ class Cell(Renderable):
 
         # Now we can render the shape if we are in the CellQ
         if renderer.label == 'cell':
-            if self.biome:
-                pygame.draw.polygon(renderer.screen, self.cell_color, self.polygon, 0)
-            else:
-                if self.altitude > self.settings.wtr_sea_level:
-                    # If render rainfall is on, mix the colors with the rainfall colors
-                    if self.settings.do_render_rainfall:
-                        if self.rainfall_last_year == 0:
-                            rainfall_mod = self.rainfall_this_year / 1000
-                        else:
-                            rainfall_mod = self.rainfall_last_year / 1000
-                        if rainfall_mod > 1:
-                            rainfall_mod = 1
-                        rainfall_mod *= 255
-                        pygame.draw.polygon(renderer.screen, ((self.cell_color[0] + rainfall_mod / 2) / 2,
-                                                                      (self.cell_color[1] + rainfall_mod / 2) / 2,
-                                                                      (self.cell_color[2] + rainfall_mod) / 2), self.polygon, 0)
-                    else:
-                        pygame.draw.polygon(renderer.screen, self.cell_color, self.polygon, 0)
-                else:
-                    pygame.draw.polygon(renderer.screen, renderer.settings.clr['ocean'], self.polygon, 0)
-
-        # Render the wind vector if we are in the AtmosphereQ
-        elif renderer.label == 'atmosphere':
-
-            # Actual atmosphere rendering begins here
-            temp_as_percent = (self.temperature - self.settings.temps_freezing) \
-                              / abs(self.settings.temps_equatorial - self.settings.temps_freezing)
-            if temp_as_percent > 1.0:
-                temp_as_percent = 1.0
-            if temp_as_percent < 0.0:
-                temp_as_percent = 0.0
-
-            pygame.draw.line(renderer.screen, (200 * temp_as_percent,
-                                                       128 - abs(128 - 14 ** (1 + temp_as_percent)),
-                                                       255 - 200 * temp_as_percent),
-                             (self.ss_x, self.ss_y),
-                             (self.ss_x + self.wind_vector.x * (self.settings.screen_size[0] / 35),
-                              self.ss_y + self.wind_vector.y * (self.settings.screen_size[1] / 35)), 1)
-
-            pressure_color = 32 + 111 * (self.pressure + 1)
-            pygame.draw.circle(renderer.screen, (pressure_color, pressure_color, pressure_color),
-                               (self.ss_x, self.ss_y), 3)
+            pygame.draw.polygon(renderer.screen, self.get_draw_color(), self.polygon, 0)
 
         # Render the border in the guiQ if self is the focus cell
         elif renderer.label == 'gui' and self.is_focus:
@@ -496,15 +525,26 @@ class Cell(Renderable):
 
 class Vertex(Renderable):
     """A single vertex defining a number of the voronoi ridges. Offers a point sample of the map where much of the
-    terrain data is stored and maintained. Vertices along with the generator point are the constituents of a Cell."""
+    terrain data is stored and maintained. Vertices along with the generator point are the constituents of a Cell.
+    The neighbors and generators are tuples of the neighboring vertices and of the cells whose regions hold this one."""
+    __slots__ = ('field_views', 'field_number', 'x', 'y', 'neighbors', 'generators', 'lowest_neighbor', 'is_peak',
+                 'is_coastal', 'water_flow_ticks', 'water_flow_ticks_since_save', 'water_flow_season_total',
+                 'water_flow_season_count', 'color', 'ss_x', 'ss_y')
+
+    # Fields kept in the map's FieldStore, see fields.py
+    altitude = StoredField(VERTEX_FIELDS.index('altitude'))
+    water_volume = StoredField(VERTEX_FIELDS.index('water_volume'))
+    water_flow_rate = StoredField(VERTEX_FIELDS.index('water_flow_rate'))
 
     def __init__(self, point):
         super().__init__()
+        self.field_views = get_detached_views(VERTEX_FIELDS)
+        self.field_number = 0
 
         # Vertex data
         self.x, self.y = point
-        self.neighbors = {}
-        self.generators = {}
+        self.neighbors = ()
+        self.generators = ()
 
         # Associated Terrain data
         self.altitude = 0.0
@@ -516,7 +556,8 @@ class Vertex(Renderable):
         self.water_volume = 0
         self.water_flow_ticks = []
         self.water_flow_ticks_since_save = 0
-        self.water_flow_this_season = []
+        self.water_flow_season_total = 0    # The sum and count of the flowrates saved this season, used by erode
+        self.water_flow_season_count = 0
         self.water_flow_rate = 0
 
         # Rendering data
@@ -532,7 +573,7 @@ class Vertex(Renderable):
             return self.altitude
         else:
             total_altitude = 0.0
-            for each_neighbor in self.neighbors.keys():
+            for each_neighbor in self.neighbors:
                 total_altitude += each_neighbor.get_average_altitude(resolution - 1)
             total_altitude /= len(self.neighbors)
             return total_altitude
@@ -543,7 +584,7 @@ class Vertex(Renderable):
         is_above = False
         is_below = False
 
-        for parent_cell in self.generators.keys():
+        for parent_cell in self.generators:
             if parent_cell.altitude > parent_cell.settings.wtr_sea_level:
                 is_above = True
             if parent_cell.altitude < parent_cell.settings.wtr_sea_level:
@@ -557,8 +598,8 @@ class Vertex(Renderable):
 
     def erode(self, settings):
         """Uses the local flowrate to calculate an erosion factor for this cell."""
-        erosion_factor = (sum(self.water_flow_this_season) + self.water_flow_rate) \
-                         / (len(self.water_flow_this_season) + 1)
+        erosion_factor = (self.water_flow_season_total + self.water_flow_rate) \
+                         / (self.water_flow_season_count + 1)
         erosion_factor *= settings.erode_mod
 
         # Account for flowrate having a different order of magnitude than altitude
@@ -569,18 +610,16 @@ class Vertex(Renderable):
             self.altitude = 0.0
 
     def find_neighbors(self, index, vor, vertices):
-        """Finds the neighboring vertices by looking them up in the voronoi diagram, then builds a dictionary where
-        Vertex Object: Distance Between Vertices."""
-        self.neighbors.clear()
+        """Finds the neighboring vertices by looking them up in the voronoi diagram, and stores them as a tuple of the
+        Vertex objects."""
+        neighbors = {}
         for index_a, index_b in vor.ridge_vertices:
             if index == index_a and index_b != -1:
-                vertex = vertices[index_b]
+                neighbors[vertices[index_b]] = None
             elif index == index_b and index_a != -1:
-                vertex = vertices[index_a]
-            else:
-                continue
-            distance = get_distance(self, vertex)
-            self.neighbors[vertex] = distance
+                neighbors[vertices[index_a]] = None
+
+        self.neighbors = tuple(neighbors)
 
     def find_lowest_neighbor(self):
         """Finds the neighboring vertex with the lowest altitude among neighbors and self, and stores it in
@@ -589,7 +628,7 @@ class Vertex(Renderable):
         lowest_neighbor = None
         lowest_alt_found = 2.0
 
-        for neighbor in self.neighbors.keys():
+        for neighbor in self.neighbors:
             if neighbor.altitude < lowest_alt_found:
                 lowest_neighbor = neighbor
                 lowest_alt_found = neighbor.altitude
@@ -601,12 +640,24 @@ class Vertex(Renderable):
 
         return lowest_neighbor
 
-    def update_hydrology(self, settings):
-        """Updates this vertex's hydrology."""
+    def get_river_width(self, settings):
+        """Returns the width in pixels of the river flowing out of this vertex, 0 if it is too small to render."""
+        if self.water_flow_rate > settings.wtr_min_flow_to_render:
+            river_width = 1 + round(self.water_flow_rate / settings.wtr_river_flow_as_width)
+        else:
+            river_width = 0
+        if river_width > settings.wtr_max_river_render_width:
+            river_width = settings.wtr_max_river_render_width
+
+        return river_width
+
+    def update_hydrology(self, settings, elapsed_ticks=1):
+        """Updates this vertex's hydrology. Elapsed_ticks is the number of atmosphere ticks of water that have built
+        up since the last update, the flowrate is kept per tick by averaging the flow over them."""
         tot_water_volume_delta = 0
 
         # If a generator has a lower watertable than this has water volume, add some of the volume to the generator
-        for cell in self.generators.keys():
+        for cell in self.generators:
             if cell.watertable < self.water_volume and self.water_volume > cell.altitude * 1000:
                 water_volume_delta = (self.water_volume - cell.watertable) * settings.wtr_reabsorption
                 cell.watertable += water_volume_delta
@@ -616,7 +667,7 @@ class Vertex(Renderable):
         # Check if there is a lower neighbor than self
         if self.lowest_neighbor:
             # Dump all water if you've encountered a sea cell
-            for cell in self.generators.keys():
+            for cell in self.generators:
                 if cell.altitude < settings.wtr_sea_level:
                     tot_water_volume_delta += self.water_volume
                     self.water_volume = 0
@@ -642,19 +693,20 @@ class Vertex(Renderable):
 
         # If above sea level
         if self.altitude > settings.wtr_sea_level:
-            # Set flowrate variables
-            self.water_flow_ticks.append(tot_water_volume_delta)
-            if len(self.water_flow_ticks) > settings.wtr_flow_ticks_to_ave:
+            # Set flowrate variables, each entry stands for elapsed_ticks worth of flow
+            self.water_flow_ticks.append(tot_water_volume_delta / elapsed_ticks)
+            if len(self.water_flow_ticks) > max(1, settings.wtr_flow_ticks_to_ave // elapsed_ticks):
                 self.water_flow_ticks.pop(0)
             if sum(self.water_flow_ticks) > 0 and len(self.water_flow_ticks) > 0:
                 self.water_flow_rate = round(sum(self.water_flow_ticks)/(len(self.water_flow_ticks)))
             else:
                 self.water_flow_rate = 0
             # Retain old flowrate info
-            self.water_flow_ticks_since_save += 1
+            self.water_flow_ticks_since_save += elapsed_ticks
             if self.water_flow_ticks_since_save > settings.wtr_flow_ticks_to_ave:
                 self.water_flow_ticks_since_save = 0
-                self.water_flow_this_season.append(self.water_flow_rate)
+                self.water_flow_season_total += self.water_flow_rate
+                self.water_flow_season_count += 1
 
         # Below sea level
         else:
@@ -665,6 +717,8 @@ class Vertex(Renderable):
 
     def update(self, renderer):
         """Update call for the Vertex."""
+        import pygame.draw
+
         # Initialize the Vertex if it has never run before
         if self.ss_x is None:
             self.ss_x, self.ss_y = renderer.settings.project_to_screen(self.x, self.y)
@@ -673,34 +727,16 @@ class Vertex(Renderable):
         if self.altitude > renderer.settings.wtr_sea_level and renderer.settings.do_render_altitudes:
             pygame.draw.circle(renderer.screen, self.color, (self.ss_x, self.ss_y), 3)
 
-        # Render coastlines
-        if renderer.settings.do_render_coastlines and self.is_coastal:
-            for each_neighbor in self.neighbors.keys():
-                if each_neighbor.is_coastal and each_neighbor.y < self.y and each_neighbor.ss_x:
-                    pygame.draw.line(renderer.screen, renderer.settings.clr['black'],
-                                     (self.ss_x, self.ss_y), (each_neighbor.ss_x, each_neighbor.ss_y),
-                                     3)
-
-        # Render rivers
-        if self.lowest_neighbor and renderer.settings.do_render_rivers:
-            if self.lowest_neighbor.ss_x:
-                if self.water_flow_rate > renderer.settings.wtr_min_flow_to_render:
-                    river_width = 1 + round(self.water_flow_rate / renderer.settings.wtr_river_flow_as_width)
-                else:
-                    river_width = 0
-                if river_width > renderer.settings.wtr_max_river_render_width:
-                    river_width = renderer.settings.wtr_max_river_render_width
-                pygame.draw.line(renderer.screen, renderer.settings.clr['river'],
-                                 (self.ss_x, self.ss_y), (self.lowest_neighbor.ss_x, self.lowest_neighbor.ss_y),
-                                 river_width)
-
 
 class SeasonData:
     """A data type for seasonal weather readings from a cell, used to set biomes."""
+    __slots__ = ('season_title', 'altitude', 'wind_magnitude', 'temperature', 'humidity', 'pressure', 'watertable',
+                 'rainfall_this_year', 'rainfall_this_season', 'average_flow')
+
     def __init__(self, current_season_title, parent_cell, last_season):
         self.season_title = current_season_title
         self.altitude = parent_cell.altitude
-        self.wind_magnitude = parent_cell.wind_vector.magnitude()
+        self.wind_magnitude = math.hypot(parent_cell.wind_x, parent_cell.wind_y)
         self.temperature = parent_cell.temperature
         self.humidity = parent_cell.humidity
         self.pressure = parent_cell.pressure
@@ -723,13 +759,14 @@ class SeasonData:
 
         # Riverflow data
         self.average_flow = 0
-        for each_vertex in parent_cell.region.keys():
+        for each_vertex in parent_cell.region:
             self.average_flow += each_vertex.water_flow_rate
         self.average_flow /= len(parent_cell.region)
 
 
 class Path:
     """Paths contains a list of a line of Vertices and or Cells. This is used for many functions of the generator."""
+    __slots__ = ('path', 'total_distance', 'depth', 'open')
 
     def __init__(self, starting_position):
         # Path variables
@@ -752,14 +789,14 @@ class Path:
         while best_vertex != endpoint and self.total_distance < limit:
             shortest_dist = 100.0
 
-            for each_vertex in self.path[-1].neighbors.keys():
+            for each_vertex in self.path[-1].neighbors:
                 this_distance = get_distance(each_vertex, endpoint)
                 if this_distance < shortest_dist:
                     shortest_dist = this_distance
                     best_vertex = each_vertex
                 else:
                     continue
-            if len(self.path) > 2 and best_vertex == self.path[-2].neighbors.keys():
+            if len(self.path) > 2 and best_vertex == self.path[-2].neighbors:
                 break
             self.add_next(best_vertex)
 
@@ -0,0 +1,195 @@
+import math
+
+import numpy
+
+from render import Renderable
+
+
+class Landmass:
+    """A connected group of land cells. Area is the sum of the areas of its cells and perimeter the length of its
+    coastlines, both in map units."""
+    def __init__(self, number, cells):
+        self.number = number
+        self.cells = cells
+        self.area = sum(get_polygon_area(list(cell.region)) for cell in cells)
+        self.perimeter = 0.0
+        self.coastlines = []   # Indices into Coastlines.lines
+
+
+class Coastline:
+    """An ordered run of coastal vertices with land on one side and sea on the other. Closed coastlines return to
+    their first vertex, open ones end where the coast runs off the edge of the diagram."""
+    def __init__(self, vertices, is_closed, landmass):
+        self.vertices = vertices
+        self.is_closed = is_closed
+        self.landmass = landmass
+
+        xs = [vertex.x for vertex in vertices]
+        ys = [vertex.y for vertex in vertices]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+        points = vertices + [vertices[0]] if is_closed else vertices
+        self.length = sum(math.dist((a.x, a.y), (b.x, b.y)) for a, b in zip(points, points[1:]))
+
+
+class Coastlines(Renderable):
+    """The coastlines and landmasses of the map at the current sea level. Coastline edges are the ridges between
+    coastal vertices (see Vertex.get_is_coastal) that separate a land cell from a sea cell, and they are chained into
+    ordered polylines so each coastline is drawn with a single call. Rebuilt when erosion or the sea level changes
+    the shape of the land, the projected points are kept until the view changes."""
+    def __init__(self, k_map):
+        super().__init__()
+
+        self.map = k_map
+        self.settings = k_map.settings
+
+        self.landmasses = []
+        self.landmass_of = {}   # Land cell : the number of its landmass
+        self.lines = []
+        self.version = 0
+
+        self.projected = []   # Screen space points of each coastline, in the same order as self.lines
+        self.projection_state = None
+
+        self.rebuild()
+
+    def rebuild(self):
+        """Finds the landmasses and the coastlines around them from the current altitudes and sea level."""
+        self.find_landmasses()
+        self.find_lines()
+        self.version += 1
+
+        self.settings.db_print(f"Coastlines rebuilt, {len(self.lines)} coastlines around "
+                               f"{len(self.landmasses)} landmasses.", detail=3)
+
+    def is_land(self, cell):
+        """Returns True if the cell is above sea level."""
+        return cell.altitude > self.settings.wtr_sea_level
+
+    def find_landmasses(self):
+        """Groups the land cells into landmasses by flooding across their neighbors."""
+        self.landmasses = []
+        self.landmass_of = {}
+
+        for each_cell in self.map.cells:
+            if each_cell in self.landmass_of or not self.is_land(each_cell):
+                continue
+
+            number = len(self.landmasses)
+            self.landmass_of[each_cell] = number
+            cells = []
+            to_visit = [each_cell]
+            while to_visit:
+                cell = to_visit.pop()
+                cells.append(cell)
+                for each_neighbor in cell.neighbors:
+                    if each_neighbor not in self.landmass_of and self.is_land(each_neighbor):
+                        self.landmass_of[each_neighbor] = number
+                        to_visit.append(each_neighbor)
+
+            self.landmasses.append(Landmass(number, cells))
+
+    def get_edge_land(self, vertex_a, vertex_b):
+        """Returns the land cell of the ridge between two vertices if it separates land from sea, otherwise None."""
+        ridge_cells = [cell for cell in vertex_a.generators if cell in vertex_b.generators]
+        if len(ridge_cells) != 2:
+            return None
+
+        cell_a, cell_b = ridge_cells
+        if self.is_land(cell_a) != self.is_land(cell_b):
+            return cell_a if self.is_land(cell_a) else cell_b
+        return None
+
+    def find_lines(self):
+        """Finds every coastline edge, then chains the edges into polylines by walking from vertex to vertex."""
+        edges = {}   # Coastal vertex : list of the coastal vertices it shares a coastline edge with
+        edge_land = {}   # Edge as a frozenset of its two vertices : the land cell on its side
+        for each_vertex in self.map.vertices:
+            if not each_vertex.is_coastal:
+                continue
+            for each_neighbor in each_vertex.neighbors:
+                edge = frozenset((each_vertex, each_neighbor))
+                if not each_neighbor.is_coastal or edge in edge_land:
+                    continue
+                land = self.get_edge_land(each_vertex, each_neighbor)
+                if land is not None:
+                    edges.setdefault(each_vertex, []).append(each_neighbor)
+                    edges.setdefault(each_neighbor, []).append(each_vertex)
+                    edge_land[edge] = land
+
+        # Start open coastlines from their ends first, so they are not walked from the middle
+        starts = sorted(edges.keys(), key=lambda vertex: len(edges[vertex]) != 1)
+
+        self.lines = []
+        used = set()
+        for each_start in starts:
+            for each_next in edges[each_start]:
+                if frozenset((each_start, each_next)) in used:
+                    continue
+
+                land = edge_land[frozenset((each_start, each_next))]
+                vertices = [each_start]
+                previous, current = each_start, each_next
+                used.add(frozenset((previous, current)))
+                while current is not each_start:
+                    vertices.append(current)
+                    unused = [vertex for vertex in edges[current] if frozenset((current, vertex)) not in used]
+                    if not unused:
+                        break
+                    previous, current = current, unused[0]
+                    used.add(frozenset((previous, current)))
+
+                landmass = self.landmass_of[land]
+                self.lines.append(Coastline(vertices, current is each_start, landmass))
+
+        for index, each_line in enumerate(self.lines):
+            self.landmasses[each_line.landmass].coastlines.append(index)
+            self.landmasses[each_line.landmass].perimeter += each_line.length
+
+    def get_lines_in(self, bbox):
+        """Returns the indices of the coastlines whose bounding boxes overlap the bounding box."""
+        left, top, right, bottom = bbox
+        return [index for index, line in enumerate(self.lines) if line.bbox[0] <= right and line.bbox[2] >= left
+                and line.bbox[1] <= bottom and line.bbox[3] >= top]
+
+    def project(self):
+        """Projects the points of every coastline to the screen in one batch."""
+        xs = numpy.array([vertex.x for line in self.lines for vertex in line.vertices])
+        ys = numpy.array([vertex.y for line in self.lines for vertex in line.vertices])
+        ss_xs, ss_ys = self.settings.project_to_screen(xs, ys)
+        points = list(zip(ss_xs.tolist(), ss_ys.tolist()))
+
+        self.projected = []
+        start = 0
+        for each_line in self.lines:
+            self.projected.append(points[start:start + len(each_line.vertices)])
+            start += len(each_line.vertices)
+
+    def update(self, renderer):
+        """Draws the coastlines on screen, projecting them again first if the view or the coastlines have changed."""
+        import pygame.draw
+
+        if not self.settings.do_render_coastlines:
+            return
+
+        projection_state = (self.version, self.settings.view_center, self.settings.view_zoom)
+        if projection_state != self.projection_state:
+            self.projection_state = projection_state
+            self.project()
+
+        left, top = self.settings.project_from_screen(0, 0)
+        right, bottom = self.settings.project_from_screen(*self.settings.screen_size)
+        for index in self.get_lines_in((left, top, right, bottom)):
+            if len(self.projected[index]) > 1:
+                pygame.draw.lines(renderer.screen, self.settings.clr['black'], self.lines[index].is_closed,
+                                  self.projected[index], 3)
+
+
+def get_polygon_area(points):
+    """Returns the area of the polygon formed by a list of objects with .x and .y set up, using the shoelace
+    formula."""
+    area = 0.0
+    for index, point in enumerate(points):
+        next_point = points[(index + 1) % len(points)]
+        area += point.x * next_point.y - next_point.x * point.y
+    return abs(area) / 2
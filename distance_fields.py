@@ -0,0 +1,110 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy
+import scipy.sparse
+import scipy.sparse.csgraph
+
+
+class DistanceFields:
+    """Answers "how far is it to the nearest ..." for every cell or vertex of a map at once. Get_field runs a
+    multi-source Dijkstra search over the cell or vertex graph from a mask of sources, and returns the distance along
+    the graph from every member to the nearest source. The edges are weighted by the adjacency weights of the map's
+    FieldStore, so the distances use the same measure of distance as the rest of the map.
+
+    Fields are cached per source mask, the least recently used are dropped past settings.dist_cache_fields. The map
+    clears the cache whenever the terrain changes, as the masks that the named fields are built from change with it."""
+    def __init__(self, k_map):
+        self.map = k_map
+        self.settings = k_map.settings
+
+        self.graphs = {}        # Kind : sparse graph of the cells or the vertices, built the first time it is searched
+        self.cache = OrderedDict()   # (kind, digest of the source mask) : field, from least to most recently used
+
+    def get_graph(self, kind):
+        """Returns the graph of the cells or the vertices as a sparse matrix of edge weights."""
+        if kind not in self.graphs:
+            fields = self.map.fields  # alias
+            if kind == 'cells':
+                starts, indices, weights = fields.adjacency['cell_neighbors']
+            elif kind == 'vertices':
+                starts, indices, weights = fields.adjacency['vertex_neighbors']
+            else:
+                raise ValueError(f"Unknown kind '{kind}', expected 'cells' or 'vertices'.")
+
+            count = len(starts) - 1
+            self.graphs[kind] = scipy.sparse.csr_matrix((weights.astype(numpy.float64), indices, starts),
+                                                        shape=(count, count))
+        return self.graphs[kind]
+
+    def get_field(self, sources, kind='cells'):
+        """Returns a read-only array of the distance from every cell or vertex to the nearest source, in the order of
+        k_map.cells or k_map.vertices. Sources is a boolean mask or an array of cell or vertex numbers. Members that
+        cannot reach a source, or every member if there are no sources, are at infinity."""
+        graph = self.get_graph(kind)
+        mask = numpy.zeros(graph.shape[0], dtype=bool)
+        mask[sources] = True
+
+        key = (kind, hashlib.sha1(numpy.packbits(mask).tobytes()).hexdigest())
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        if mask.any():
+            field = scipy.sparse.csgraph.dijkstra(graph, directed=False, indices=numpy.flatnonzero(mask),
+                                                  min_only=True)
+        else:
+            field = numpy.full(graph.shape[0], numpy.inf)
+        field.flags.writeable = False
+
+        self.cache[key] = field
+        while len(self.cache) > self.settings.dist_cache_fields:
+            self.cache.popitem(last=False)
+        self.settings.db_print(f"Found the distance field of {int(mask.sum())} {kind}.", detail=4)
+        return field
+
+    def get_distance_to_sea(self, kind='cells'):
+        """Returns the distance from every cell or vertex to the nearest one at or below sea level."""
+        if kind == 'cells':
+            altitudes = self.map.fields.get_cell_field('altitude')
+        else:
+            altitudes = self.map.fields.get_vertex_field('altitude')
+        return self.get_field(altitudes <= self.settings.wtr_sea_level, kind)
+
+    def get_continentality(self):
+        """Returns how far inland every cell lies, as its distance to the sea over the distance of the most inland
+        cell, so 0 at the coast and in the sea and 1 at the heart of the largest continent."""
+        distances = self.get_distance_to_sea('cells')
+        inland = distances[numpy.isfinite(distances)]
+        if len(inland) == 0 or inland.max() == 0.0:
+            return numpy.zeros(len(distances))
+        return numpy.minimum(distances / inland.max(), 1.0)
+
+    def get_distance_to_rivers(self, kind='cells'):
+        """Returns the distance from every cell or vertex to the nearest river, a vertex flowing faster than
+        settings.wtr_min_flow_to_render. A cell is on a river if any vertex of its region is."""
+        is_river = self.map.fields.get_vertex_field('water_flow_rate') > self.settings.wtr_min_flow_to_render
+        if kind == 'vertices':
+            return self.get_field(is_river, 'vertices')
+        return self.get_field(self.get_cell_mask(is_river), 'cells')
+
+    def get_distance_to_mountains(self, kind='cells'):
+        """Returns the distance from every cell or vertex to the nearest one above settings.biome_alpine_line."""
+        if kind == 'cells':
+            altitudes = self.map.fields.get_cell_field('altitude')
+        else:
+            altitudes = self.map.fields.get_vertex_field('altitude')
+        return self.get_field(altitudes > self.settings.biome_alpine_line, kind)
+
+    def get_cell_mask(self, vertex_mask):
+        """Returns a boolean mask over the cells, True where any vertex of the cell's region is in the vertex mask."""
+        starts, indices = self.map.fields.adjacency['cell_regions'][:2]
+        cell_mask = numpy.zeros(len(starts) - 1, dtype=bool)
+        has_region = starts[1:] > starts[:-1]
+        if has_region.any():
+            cell_mask[has_region] = numpy.logical_or.reduceat(vertex_mask[indices], starts[:-1][has_region])
+        return cell_mask
+
+    def clear(self):
+        """Drops every cached field, called when the terrain changes."""
+        self.cache.clear()
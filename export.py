@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import struct
+import sys
+import zlib
+
+import pygame
+
+from lod import draw_map_area
+from overlays import Overlays
+from spatial import GridIndex, get_bounding_box
+
+# The map being exported and what the tile renderers need from it, worker processes inherit this when they fork
+export_state = None
+
+
+class PngWriter:
+    """Writes an RGB PNG a band of rows at a time, compressing the rows as they arrive so the whole image is never
+    held in memory. Rows must be written top to bottom and close must be called once every row has been written."""
+    def __init__(self, path, width, height, compress_level=6, chunk_bytes=1 << 20):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.chunk_bytes = chunk_bytes
+
+        self.file = open(path, 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits per channel, color type 2 (RGB), default compression and filtering, no interlacing
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+        self.compressor = zlib.compressobj(compress_level)
+        self.pending = []
+        self.pending_bytes = 0
+
+    def write_chunk(self, chunk_type, data):
+        """Writes a single PNG chunk with its length and checksum."""
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+    def write_rows(self, data):
+        """Writes rows of raw RGB pixel data, the length of data must be a whole number of rows."""
+        row_bytes = self.width * 3
+        for start in range(0, len(data), row_bytes):
+            # Each row starts with its filter type, 0 for no filtering
+            self.add_compressed(self.compressor.compress(b'\x00' + data[start:start + row_bytes]))
+            self.rows_written += 1
+
+    def add_compressed(self, data):
+        """Queues compressed data, writing it out as an IDAT chunk once enough has built up."""
+        if data:
+            self.pending.append(data)
+            self.pending_bytes += len(data)
+        if self.pending_bytes >= self.chunk_bytes:
+            self.flush_pending()
+
+    def flush_pending(self):
+        """Writes the queued compressed data as one IDAT chunk."""
+        if self.pending:
+            self.write_chunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pending_bytes = 0
+
+    def close(self):
+        """Finishes the compressed stream and the file."""
+        if self.rows_written != self.height:
+            raise ValueError(f"Only {self.rows_written} of the PNG's {self.height} rows were written.")
+
+        self.pending.append(self.compressor.flush())
+        self.flush_pending()
+        self.write_chunk(b'IEND', b'')
+        self.file.close()
+
+
+def get_export_bbox(settings):
+    """Returns the bounding box of the map coordinates shown by the unzoomed view, which exports also cover."""
+    scale_x, scale_y = settings.get_screen_scale()
+    half_width = (settings.screen_size[0] / 2) / (scale_x / settings.view_zoom)
+    half_height = (settings.screen_size[1] / 2) / (scale_y / settings.view_zoom)
+    return -half_width, -half_height, half_width, half_height
+
+
+def render_export_tile(tile):
+    """Renders a single tile of the export, returning its size and raw RGB pixels. Tile is (left, top, width,
+    height) in output pixels."""
+    k_map, color_table, cell_index, size, line_scale = export_state
+    left, top, width, height = tile
+    map_left, map_top, map_right, map_bottom = get_export_bbox(k_map.settings)
+    pixel_width = (map_right - map_left) / size[0]
+    pixel_height = (map_bottom - map_top) / size[1]
+
+    bbox = (map_left + left * pixel_width, map_top + top * pixel_height,
+            map_left + (left + width) * pixel_width, map_top + (top + height) * pixel_height)
+    surface = pygame.Surface((width, height))
+    draw_map_area(surface, k_map, color_table, cell_index, bbox, line_scale)
+    return width, pygame.image.tostring(surface, 'RGB')
+
+
+def export_image(k_map, path, size=None, tile_size=None, workers=None):
+    """Renders the map to a PNG of any size, a band of tiles at a time, so memory use depends on the tile size and
+    the width of the image rather than its area. The tiles of each band are rendered in parallel by forked worker
+    processes where the platform allows it. The cells are colored with the current overlay, and lines are
+    thickened along with the resolution so the export looks like the screen."""
+    global export_state
+    stg = k_map.settings
+    if size is None:
+        size = stg.export_size
+    if tile_size is None:
+        tile_size = stg.export_tile_size
+    if workers is None:
+        workers = stg.export_workers or os.cpu_count() or 1
+    width, height = size
+
+    cell_boxes = [get_bounding_box(cell.region) for cell in k_map.cells]
+    cell_index = GridIndex(get_export_bbox(stg), int(len(k_map.cells) ** 0.5))
+    for number, box in enumerate(cell_boxes):
+        cell_index.insert(number, box)
+
+    line_scale = width / stg.screen_size[0]
+    export_state = (k_map, Overlays(k_map).get_color_table(), cell_index, size, line_scale)
+
+    pool = None
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context('fork').Pool(workers)
+
+    stg.db_print(f"Exporting a {width}x{height} image to {path}...", detail=1)
+    writer = PngWriter(path, width, height)
+    try:
+        for band_top in range(0, height, tile_size):
+            band_height = min(tile_size, height - band_top)
+            tiles = [(left, band_top, min(tile_size, width - left), band_height) for left in range(0, width, tile_size)]
+            if pool is not None:
+                rendered = pool.map(render_export_tile, tiles)
+            else:
+                rendered = [render_export_tile(tile) for tile in tiles]
+
+            # Stitch the rows of the band's tiles together and hand them to the writer
+            for row in range(band_height):
+                writer.write_rows(b''.join(pixels[row * tile_width * 3:(row + 1) * tile_width * 3]
+                                           for tile_width, pixels in rendered))
+            stg.db_print(f"Exported rows {band_top} to {band_top + band_height} of {height}.", detail=3)
+        writer.close()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        export_state = None
+
+    stg.db_print(f"Export saved to {path}.", detail=1)
+
+
+if __name__ == "__main__":
+    from khaos_map import KhaosMap
+
+    # Usage: python export.py [path] [width] [height]
+    output_path = sys.argv[1] if len(sys.argv) > 1 else 'khaos_map.png'
+    khaos_map = KhaosMap()
+    if len(sys.argv) > 3:
+        export_image(khaos_map, output_path, (int(sys.argv[2]), int(sys.argv[3])))
+    else:
+        export_image(khaos_map, output_path)
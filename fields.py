@@ -0,0 +1,160 @@
+import numpy
+
+# The per-cell and per-vertex fields kept in the map's FieldStore, in the order of the rows of its arrays
+CELL_FIELDS = ('altitude', 'temperature', 'pressure', 'humidity', 'watertable', 'rainfall_this_year',
+               'rainfall_last_year', 'wind_x', 'wind_y')
+VERTEX_FIELDS = ('altitude', 'water_volume', 'water_flow_rate')
+
+
+class StoredField:
+    """An attribute of a Cell or Vertex that lives in a row of its map's FieldStore rather than on the object.
+    The object reaches the row through field_views, a list of one view per field, and its field_number.
+    Before a store is attached the views are single element lists, so the objects work on their own."""
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.field_views[self.index][instance.field_number]
+
+    def __set__(self, instance, value):
+        try:
+            instance.field_views[self.index][instance.field_number] = value
+        except TypeError:
+            # Memoryviews of floats only take floats, ints are converted on the way in
+            instance.field_views[self.index][instance.field_number] = float(value)
+
+
+def get_detached_views(field_names):
+    """Returns the views an object uses before it is attached to a FieldStore, with every field at 0.0."""
+    return [[0.0] for each_name in field_names]
+
+
+class FieldStore:
+    """Holds every stored field of a map's cells and vertices in one contiguous array per kind, with one row per field
+    and one column per cell or vertex. The Cell and Vertex objects read and write their fields straight from these
+    arrays, so the read-only views handed out here are always current and cost nothing to make.
+
+    The store also keeps the adjacency of the map in compressed sparse row form, each as a (starts, indices, weights)
+    tuple where the neighbors of item n are indices[starts[n]:starts[n + 1]].
+
+    With settings.field_precision set to 'float32' the fields and adjacency weights are stored as float32 and the
+    adjacency indices as int32, halving their memory. The objects still compute in Python floats, each field is
+    rounded to float32 as it is stored."""
+    def __init__(self, k_map):
+        self.map = k_map
+        if k_map.settings.field_precision == 'float32':
+            self.dtype, self.index_dtype = numpy.float32, numpy.int32
+        elif k_map.settings.field_precision == 'float64':
+            self.dtype, self.index_dtype = numpy.float64, numpy.int64
+        else:
+            raise ValueError(f"Unknown field precision '{k_map.settings.field_precision}', "
+                             f"expected 'float32' or 'float64'.")
+
+        self.vertex_numbers = {vertex: index for index, vertex in enumerate(k_map.vertices)}
+        self.cell_numbers = {cell: index for index, cell in enumerate(k_map.cells)}
+
+        self.cell_array = self.attach(k_map.cells, CELL_FIELDS)
+        self.vertex_array = self.attach(k_map.vertices, VERTEX_FIELDS)
+
+        self.cell_points = numpy.array([(cell.x, cell.y) for cell in k_map.cells], dtype=float)
+        self.vertex_points = numpy.array([(vertex.x, vertex.y) for vertex in k_map.vertices], dtype=float)
+        self.adjacency = {'cell_neighbors': self.get_csr(k_map.cells, 'neighbors', self.cell_numbers,
+                                                         self.cell_points, self.cell_points),
+                          'vertex_neighbors': self.get_csr(k_map.vertices, 'neighbors', self.vertex_numbers,
+                                                           self.vertex_points, self.vertex_points),
+                          'cell_regions': self.get_csr(k_map.cells, 'region', self.vertex_numbers,
+                                                       self.cell_points, self.vertex_points)}
+
+    def attach(self, items, field_names, array=None):
+        """Copies the current value of every field of the items into an array and points the items at it. If array is
+        given it is used instead of a new one, it must have a row for each field and a column for each item."""
+        if array is None:
+            array = numpy.empty((len(field_names), len(items)), dtype=self.dtype)
+        for row, each_name in enumerate(field_names):
+            array[row] = [getattr(item, each_name) for item in items]
+
+        # Memoryviews index to plain Python floats, which keeps the per-object code as quick as it can be, and round
+        # what is stored in them to the precision of the array
+        views = [memoryview(array[row]) for row in range(len(field_names))]
+        for number, item in enumerate(items):
+            item.field_views = views
+            item.field_number = number
+
+        return array
+
+    def get_csr(self, items, attribute, numbers, item_points, other_points):
+        """Returns the (starts, indices, weights) of a tuple attribute of each item, such as cell.neighbors, whose
+        members are numbered by numbers. The weights are the distances between the points of the items and of their
+        members, measured as cells.get_distance does."""
+        starts = numpy.zeros(len(items) + 1, dtype=self.index_dtype)
+        starts[1:] = numpy.cumsum([len(getattr(item, attribute)) for item in items])
+        indices = numpy.fromiter((numbers[other] for item in items for other in getattr(item, attribute)),
+                                 dtype=self.index_dtype, count=starts[-1])
+
+        owners = numpy.repeat(numpy.arange(len(items)), numpy.diff(starts))
+        difference = numpy.abs(item_points[owners] - other_points[indices])
+        weights = numpy.sqrt(difference[:, 0] + difference[:, 1]).astype(self.dtype)
+        return starts, indices, weights
+
+    def get_memory_report(self):
+        """Returns a dictionary of the bytes used by the cell fields, the vertex fields and the adjacency arrays."""
+        return {'cell fields': self.cell_array.nbytes, 'vertex fields': self.vertex_array.nbytes,
+                'adjacency': sum(array.nbytes for arrays in self.adjacency.values() for array in arrays)}
+
+    @staticmethod
+    def get_view(array):
+        """Returns a read-only view of an array."""
+        view = array.view()
+        view.flags.writeable = False
+        return view
+
+    def get_cell_field(self, name):
+        """Returns a read-only array of the named field for every cell, in the order of k_map.cells."""
+        return self.get_view(self.cell_array[CELL_FIELDS.index(name)])
+
+    def get_vertex_field(self, name):
+        """Returns a read-only array of the named field for every vertex, in the order of k_map.vertices."""
+        return self.get_view(self.vertex_array[VERTEX_FIELDS.index(name)])
+
+    def get_adjacency(self, name):
+        """Returns read-only (starts, indices, weights) arrays of the named adjacency, one of cell_neighbors,
+        vertex_neighbors or cell_regions."""
+        return tuple(self.get_view(array) for array in self.adjacency[name])
+
+    def get_columns(self, kind='cells'):
+        """Returns a dictionary of column name : read-only array for every field of the cells or the vertices,
+        including their positions."""
+        if kind == 'cells':
+            columns = {'x': self.get_view(self.cell_points[:, 0]), 'y': self.get_view(self.cell_points[:, 1])}
+            columns.update({name: self.get_cell_field(name) for name in CELL_FIELDS})
+        elif kind == 'vertices':
+            columns = {'x': self.get_view(self.vertex_points[:, 0]), 'y': self.get_view(self.vertex_points[:, 1])}
+            columns.update({name: self.get_vertex_field(name) for name in VERTEX_FIELDS})
+        else:
+            raise ValueError(f"Unknown kind '{kind}', expected 'cells' or 'vertices'.")
+        return columns
+
+    def to_dataframe(self, kind='cells'):
+        """Returns the fields of the cells or the vertices as a pandas DataFrame, one row per cell or vertex.
+        The DataFrame holds a copy, so it does not change as the simulation runs. Requires pandas."""
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError("to_dataframe requires pandas, install it with 'pip install pandas'.")
+
+        return pandas.DataFrame({name: numpy.array(column) for name, column in self.get_columns(kind).items()})
+
+    def export_columns(self, path):
+        """Saves every field and adjacency array to a .npz file, one named array per column, which numpy.load reads
+        back lazily one column at a time. Cell columns are prefixed with cell_, vertex columns with vertex_."""
+        arrays = {f"cell_{name}": column for name, column in self.get_columns('cells').items()}
+        arrays.update({f"vertex_{name}": column for name, column in self.get_columns('vertices').items()})
+        for name, (starts, indices, weights) in self.adjacency.items():
+            arrays[f"{name}_starts"] = starts
+            arrays[f"{name}_indices"] = indices
+            arrays[f"{name}_weights"] = weights
+
+        numpy.savez(path, **arrays)
+        self.map.settings.db_print(f"Exported the map's columns to {path}.", detail=2)
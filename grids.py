@@ -0,0 +1,124 @@
+import json
+import os
+
+import numpy
+import numpy.lib.format
+import scipy.interpolate as intrp
+import scipy.spatial as sptl
+
+from export import get_export_bbox
+
+
+class GridLayer:
+    """A single layer of a gridded export. Linear layers interpolate their values barycentrically over the Delaunay
+    triangulation of their points, nearest layers take the value of the nearest cell."""
+    def __init__(self, name, kind, dtype, get_points, get_values):
+        self.name = name
+        self.kind = kind
+        self.dtype = dtype
+        self.get_points = get_points
+        self.get_values = get_values
+
+
+class GridSampler:
+    """Samples a single layer at batches of grid points. The triangulation and search tree are built once and
+    reused for every chunk of the grid."""
+    def __init__(self, layer, k_map, cell_tree):
+        self.layer = layer
+        self.values = numpy.asarray(layer.get_values(k_map))
+        self.cell_tree = cell_tree
+
+        if layer.kind == 'linear':
+            points = numpy.asarray(layer.get_points(k_map))
+            triangulation = sptl.Delaunay(points)
+            self.linear = intrp.LinearNDInterpolator(triangulation, self.values)
+            self.nearest = intrp.NearestNDInterpolator(points, self.values)
+
+    def sample(self, points):
+        """Returns the layer's values at an array of (x, y) points."""
+        if self.layer.kind == 'nearest':
+            distances, nearest_cells = self.cell_tree.query(points)
+            return self.values[nearest_cells]
+
+        # Points outside of the triangulation take the value of the nearest point
+        values = self.linear(points)
+        outside = numpy.isnan(values)
+        if outside.any():
+            values[outside] = self.nearest(points[outside])
+        return values
+
+
+def get_biome_names(settings):
+    """Returns the biome titles in the order their numbers are written to the biome layer."""
+    return sorted(settings.biome_colors.keys())
+
+
+def get_cell_biomes(k_map):
+    """Returns the biome number of every cell, -1 for cells without a biome."""
+    numbers = {name: number for number, name in enumerate(get_biome_names(k_map.settings))}
+    return [numbers[cell.biome.biome_title] if cell.biome else -1 for cell in k_map.cells]
+
+
+def get_cell_rainfall(k_map):
+    """Returns the rainfall of last year, or of this year for cells that have not had a full year yet."""
+    return [cell.rainfall_last_year or cell.rainfall_this_year for cell in k_map.cells]
+
+
+def get_cell_points(k_map):
+    """Returns the generator point of every cell."""
+    return [(cell.x, cell.y) for cell in k_map.cells]
+
+
+GRID_LAYERS = {layer.name: layer for layer in (
+    GridLayer('altitude', 'linear', numpy.float32,
+              lambda k_map: [(vertex.x, vertex.y) for vertex in k_map.vertices],
+              lambda k_map: [vertex.altitude for vertex in k_map.vertices]),
+    GridLayer('temperature', 'linear', numpy.float32, get_cell_points,
+              lambda k_map: [cell.temperature for cell in k_map.cells]),
+    GridLayer('rainfall', 'linear', numpy.float32, get_cell_points, get_cell_rainfall),
+    GridLayer('biome', 'nearest', numpy.int16, None, get_cell_biomes),
+    GridLayer('cell', 'nearest', numpy.int32, None, lambda k_map: numpy.arange(len(k_map.cells))))}
+
+
+def export_grids(k_map, directory, size=None, layers=None, chunk_rows=None):
+    """Resamples the map's fields onto a regular grid covering the same area as the image export, writing each layer
+    to directory/<layer>.npy as a memory mapped array of shape (height, width). The grid is sampled and written a
+    chunk of rows at a time, so memory use depends on the width and chunk_rows rather than the size of the grid.
+    The names of the biome numbers are written to directory/biomes.json."""
+    stg = k_map.settings
+    if size is None:
+        size = stg.export_grid_size
+    if layers is None:
+        layers = tuple(GRID_LAYERS.keys())
+    if chunk_rows is None:
+        chunk_rows = stg.export_grid_rows
+    width, height = size
+    os.makedirs(directory, exist_ok=True)
+
+    cell_tree = sptl.cKDTree(get_cell_points(k_map))
+    samplers = [GridSampler(GRID_LAYERS[name], k_map, cell_tree) for name in layers]
+    outputs = [numpy.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+',
+                                            dtype=GRID_LAYERS[name].dtype, shape=(height, width)) for name in layers]
+
+    # Sample at the center of each grid square
+    left, top, right, bottom = get_export_bbox(stg)
+    xs = left + (numpy.arange(width) + 0.5) * (right - left) / width
+    stg.db_print(f"Exporting {width}x{height} grids of {', '.join(layers)} to {directory}...", detail=1)
+    for first_row in range(0, height, chunk_rows):
+        last_row = min(first_row + chunk_rows, height)
+        ys = top + (numpy.arange(first_row, last_row) + 0.5) * (bottom - top) / height
+        grid_x, grid_y = numpy.meshgrid(xs, ys)
+        points = numpy.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+        for sampler, output in zip(samplers, outputs):
+            output[first_row:last_row] = sampler.sample(points).reshape(last_row - first_row, width)
+        stg.db_print(f"Exported grid rows {first_row} to {last_row} of {height}.", detail=3)
+
+    for output in outputs:
+        output.flush()
+    del outputs
+
+    with open(os.path.join(directory, 'biomes.json'), 'w') as file:
+        json.dump(get_biome_names(stg), file, indent=1)
+
+    stg.db_print(f"Grids saved to {directory}.", detail=1)
@@ -1,36 +1,149 @@
+import copy
+
 import numpy
 import scipy.spatial as sptl
 
+from altitude_index import AltitudeIndex
+from atmosphere import STATE_FIELDS, AtmosphereEngine, get_worker_count
 from cells import *
+from coastlines import Coastlines
+from distance_fields import DistanceFields
+from fields import CELL_FIELDS, VERTEX_FIELDS, FieldStore
+from oceans import OceanCirculation
+from pipeline import Pipeline, Stage, StageCache
+from ridges import RidgeEngine
+from rivers import RiverNetwork
+from routes import RoutePlanner
+from scheduler import Scheduler
+from settlements import SettlementEngine
+from shared_state import SharedState
 from settings import *
 
+# The stage cache is shared by every map made in this process, see get_stage_cache
+shared_stage_cache = None
+
+# The per-cell and per-vertex attributes that make up the simulated state of a map, see get_simulation_state
+CELL_STATE_FIELDS = ('temperature', 'pressure', 'humidity', 'watertable', 'rainfall_this_year', 'rainfall_last_year',
+                     'last_spring', 'last_summer', 'last_autumn', 'last_winter')
+VERTEX_STATE_FIELDS = ('altitude', 'water_volume', 'water_flow_rate', 'water_flow_ticks_since_save',
+                       'water_flow_season_total', 'water_flow_season_count')
+
 
 class KhaosMap:
-    """This map contains a set of objects describing a voronoi diagram produced from scipy.spatial.Voronoi."""
-    def __init__(self):
+    """This map contains a set of objects describing a voronoi diagram produced from scipy.spatial.Voronoi.
+    Given a coarse_map the new map is refined from it, taking its terrain and climate from the coarse solution instead
+    of generating its own. See gen_coarse_to_fine."""
+    def __init__(self, settings=None, coarse_map=None):
         # Instantiates a settings object
-        self.settings = Settings()
+        if settings is None:
+            settings = Settings()
+        self.settings = settings
         self.settings.map = self
         self.display_text = None
         self.season_text = None
         self.has_biomes = False
         self.current_season = ''
 
-        dbprint = self.settings.db_print  # alias
-
-        # Generates the initial voronoi object and runs the lloyds relaxation to regularize the cell sizes.
-        dbprint("Generating voronoi diagram...")
+        # Equilibrium tracking, the residuals are the scaled RMS change of each atmosphere field over the last tick
+        self.residuals = {'wind': 0.0, 'temperature': 0.0, 'pressure': 0.0, 'humidity': 0.0}
+        self.season_residuals = {}   # Season title : the largest residual against that season of the last year
+        self.season_snapshots = {}   # Season title : the atmosphere state recorded at the end of that season
+        self.last_atmosphere_state = None
+
+        # The scheduler runs each subsystem of the simulation at its own rate
+        self.scheduler = Scheduler()
+        self.scheduler.add('atmosphere', 1, self.step_atmosphere)
+        self.scheduler.add('hydrology', self.settings.sched_hydrology_rate, self.update_hydrology)
+        self.scheduler.add('seasons', self.settings.sched_season_rate, self.update_seasons)
+        self.scheduler.add('erosion', self.settings.sched_erosion_rate, self.erode)
+        self.scheduler.add('oceans', self.settings.sched_ocean_rate, self.update_oceans)
+        if self.settings.shm_enable:
+            self.scheduler.add('publish', self.settings.shm_publish_rate, self.publish_state)
+
+        self.voronoi = None
+        self.cells = []
+        self.vertices = []
+        self.fields = None
+        self.shared_state = None
+        self.focus_cell = None
+        self.far_x, self.far_y = 0.0, 0.0
+        self.altitude_index = None
+        self.rivers = None
+        self.coastlines = None
+        self.distances = None
+        self.oceans = None
+        self.routes = None       # The route planner, made the first time a route is asked for
+        self.settlements = None  # The settlement engine, made the first time settlements are placed
+        self.atmosphere = None   # The arrays engine, made the first time the atmosphere is stepped with it
+        self.color_version = 0   # Counts changes to how cells are drawn, so cached images know when they are stale
+        # Field name : count of the changes to the cell or vertex field, bumped by the subsystem that writes it
+        self.field_versions = dict.fromkeys(CELL_FIELDS + VERTEX_FIELDS, 0)
+
+        # Generation runs as a pipeline of stages, so stages whose inputs have not changed are restored from the cache
+        self.pipeline = self.build_pipeline(coarse_map)
+        self.pipeline.run(self)
+
+    def build_pipeline(self, coarse_map=None):
+        """Builds the pipeline of generation stages. With a coarse_map the terrain and climate stages are replaced by
+        interpolation from the coarse map, which is never cached."""
+        pipeline = Pipeline(get_stage_cache(self.settings))
+        get_altitudes = KhaosMap.get_vertex_altitudes  # alias
+        set_altitudes = KhaosMap.set_vertex_altitudes  # alias
+
+        pipeline.add(Stage('voronoi', KhaosMap.stage_voronoi,
+                           capture=lambda k_map: k_map.voronoi.points,
+                           restore=lambda k_map, points: setattr(k_map, 'voronoi', sptl.Voronoi(points)),
+                           settings_read=('seed', 'total_cells', 'relax_passes', 'point_sampler', 'point_sampler_')))
+        pipeline.add(Stage('objects', KhaosMap.stage_objects, depends_on=('voronoi',), cache=False))
+
+        if coarse_map is not None:
+            pipeline.add(Stage('interpolation', lambda k_map: k_map.stage_interpolation(coarse_map),
+                               depends_on=('objects',), cache=False))
+            pipeline.add(Stage('extrapolation', KhaosMap.stage_extrapolation,
+                               depends_on=('interpolation',), cache=False))
+            pipeline.add(Stage('settling', lambda k_map: k_map.stage_settling(coarse_map),
+                               depends_on=('extrapolation',), cache=False))
+            return pipeline
+
+        pipeline.add(Stage('plates', KhaosMap.stage_plates, get_altitudes, set_altitudes, depends_on=('objects',),
+                           settings_read=('tect_plates_min', 'tect_plates_max', 'tect_min_dist',
+                                          'tect_attempt_to_place', 'tect_final_alt_mod', 'field_precision')))
+        pipeline.add(Stage('smoothing', KhaosMap.stage_smoothing, get_altitudes, set_altitudes, depends_on=('plates',),
+                           settings_read=('tect_smoothing_resolution', 'tect_smoothing_repetitions',
+                                          'field_precision')))
+        pipeline.add(Stage('ridges', KhaosMap.stage_ridges, get_altitudes, set_altitudes, depends_on=('smoothing',),
+                           settings_read=('mtn_', 'field_precision')))
+        pipeline.add(Stage('extrapolation', KhaosMap.stage_extrapolation, depends_on=('ridges',), cache=False))
+        pipeline.add(Stage('presim', KhaosMap.stage_presim, KhaosMap.get_simulation_state,
+                           KhaosMap.set_simulation_state, depends_on=('extrapolation',),
+                           settings_read=('atmo_', 'wind_', 'temps_', 'baro_', 'season_ticks_per_year',
+                                          'season_incline', 'wtr_', 'erode_', 'sched_', 'ocean_',
+                                          'field_precision')))
+
+        return pipeline
+
+    def stage_voronoi(self):
+        """Generates the initial voronoi object and runs the lloyds relaxation to regularize the cell sizes."""
+        self.settings.db_print("Generating voronoi diagram...")
         self.voronoi = self.gen_vor()
 
-        # Uses the voronoi diagram to produce the Cell and Vertex objects for the map.
-        dbprint("Creating map objects...")
+    def stage_objects(self):
+        """Uses the voronoi diagram to produce the Cell and Vertex objects for the map."""
+        self.settings.db_print("Creating map objects...")
         self.cells, self.vertices = self.gen_map_objs(self.voronoi)
-        self.focus_cell = None
+
+        # Move the fields of the new objects into arrays, where they can be read in bulk
+        self.fields = FieldStore(self)
+        if self.settings.shm_enable:
+            self.shared_state = SharedState(self, self.settings.shm_name)
 
         # Find the furthest x and y coordinates in the voronoi at this point, store them for later.
         self.far_x, self.far_y = self.get_furthest_members()
 
-        # Generate the altitudes for the vertices and the cells
+    def stage_plates(self):
+        """Generates the altitudes for the vertices from the tectonic plates."""
+        dbprint = self.settings.db_print  # alias
+
         dbprint("Beginning altitude generation...")
         dbprint("Locating tectonic plates...", detail=2)
         plate_centers = self.get_plate_centers()   # Finds the plates used for altitude generation
@@ -39,34 +152,71 @@ class KhaosMap:
         dbprint("Deriving altitudes...", detail=2)
         self.set_altitudes(plate_centers, slopes)
 
-        dbprint("Smoothing vertex altitudes...", detail=3)
+    def stage_smoothing(self):
+        """Smooths the plate altitudes."""
+        self.settings.db_print("Smoothing vertex altitudes...", detail=3)
         for iteration in range(0, self.settings.tect_smoothing_repetitions):
             self.smooth_altitudes(self.settings.tect_smoothing_resolution)
 
-        dbprint("Pathing mountain ranges...", detail=2)
+    def stage_ridges(self):
+        """Raises mountain ridges from the peaks of the smoothed altitudes."""
+        self.settings.db_print("Pathing mountain ranges...", detail=2)
         number_of_ridges = random.randint(self.settings.mtn_ridges_min, self.settings.mtn_ridges_max)
-        peaks = self.get_peaks()
-        for iteration in range(0, number_of_ridges):
-            self.gen_single_ridge(peaks)
+        RidgeEngine(self).grow(number_of_ridges)
 
-        dbprint("Extrapolating altitudes to cells...", detail=3)
+    def stage_interpolation(self, coarse_map):
+        """Takes the vertex altitudes from the coarse map."""
+        self.settings.db_print("Interpolating altitudes from the coarse map...")
+        self.interpolate_altitudes(coarse_map)
+
+    def stage_extrapolation(self):
+        """Extrapolates the vertex altitudes to the cells, and finds the terrain data that depends on them."""
+        self.settings.db_print("Extrapolating altitudes to cells...", detail=3)
         for each_cell in self.cells:
             each_cell.find_screen_space()
             each_cell.find_altitude()
             each_cell.find_wind_deflection()
             each_cell.find_lowest_vertex()
+            each_cell.find_color()
 
         for each_vertex in self.vertices:
             each_vertex.find_lowest_neighbor()
 
+        self.altitude_index = AltitudeIndex(self)
+        self.rivers = RiverNetwork(self)
+        self.coastlines = Coastlines(self)
+        self.distances = DistanceFields(self)
+        self.oceans = OceanCirculation(self)
+
+    def stage_presim(self):
+        """Presimulates the atmosphere, either for a set number of ticks or until it is steady."""
+        dbprint = self.settings.db_print  # alias
+
         dbprint("Getting windy...", detail=3)
-        for iteration in range(0, self.settings.wind_presim):
+        if self.settings.wind_presim_until_steady:
+            ticks = self.run_until_steady()
+            dbprint(f"Atmosphere settled after {ticks} ticks.", detail=2)
+        else:
+            for iteration in range(0, self.settings.wind_presim):
+                self.update_atmosphere()
+
+    def stage_settling(self, coarse_map):
+        """The climate is warm started from the coarse map, so it only needs a short settling run."""
+        self.settings.db_print("Getting windy...", detail=3)
+        self.interpolate_climate(coarse_map)
+        for iteration in range(0, self.settings.refine_settle_ticks):
             self.update_atmosphere()
 
     def gen_vor(self):
         """Generates a voronoi diagram and passes it through several relax iterations as decided in the settings."""
         # Initial generation, produces the random list, then adds 8 distant points to bound the cells properly
-        points = numpy.random.uniform(-1.0, 1.0, (self.settings.total_cells, 2))
+        if self.settings.point_sampler == 'poisson':
+            points = get_poisson_disk_points(self.settings.total_cells, self.settings.point_sampler_attempts)
+        elif self.settings.point_sampler == 'uniform':
+            points = numpy.random.uniform(-1.0, 1.0, (self.settings.total_cells, 2))
+        else:
+            raise ValueError(f"Unknown point sampler '{self.settings.point_sampler}', expected 'uniform' or "
+                             f"'poisson'.")
         distant_points = [[2.0, 0.0], [0.0, 2.0],
                           [-2.0, 0.0], [0.0, -2.0],
                           [2.0, 2.0], [-2.0, -2.0],
@@ -112,53 +262,6 @@ class KhaosMap:
 
         return cells, vertices
 
-    def gen_single_ridge(self, peaks):
-        """Creates a high forking mountain ridge on the altitude map."""
-        dbprint = self.settings.db_print
-
-        # Gets a random peak to start with, sets its altitude to the maximum, minus a factor
-        random_peak = peaks[random.randrange(0, len(peaks))]
-        new_alt = 1.0 - random.random() * self.settings.mtn_peak_reduction_factor
-
-        # Make sure not to accidentally reduce the height
-        if random_peak.altitude < new_alt:
-            random_peak.altitude = new_alt
-
-        dbprint(f"Adding peak at {random_peak.x}, {random_peak.y}, ALT: {random_peak.altitude}", detail=4)
-
-        # Create lists for pathing
-        total_nodes = 0
-        opened = [random_peak]
-        closed = []
-
-        # Begin looping through the path lists
-        while opened and total_nodes < self.settings.mtn_max_node_chain:
-
-            for each_vertex in opened:
-
-                # Ready the current vertex for closing before the next pass starts
-                closed.append(each_vertex)
-
-                # Decide if the ridge will fork
-                if random.random() < self.settings.mtn_fork_chance:
-                    dbprint(f"Forking at {each_vertex.x}, {each_vertex.y}", detail=4)
-                    self.get_next_ridge(each_vertex, opened, closed)
-                    self.get_next_ridge(each_vertex, opened, closed)
-                    total_nodes += 2
-                else:
-                    self.get_next_ridge(each_vertex, opened, closed)
-                    total_nodes += 1
-
-                if total_nodes > self.settings.mtn_max_node_chain:
-                    break
-
-            # Remove closed vertices from open
-            for each_vertex in closed:
-                if each_vertex in opened:
-                    opened.remove(each_vertex)
-
-        return closed
-
     def get_furthest_members(self):
         """Used to obtain the most distant members of the voronoi diagram.
         After relaxation, these can be quite far past 1.0."""
@@ -173,38 +276,9 @@ class KhaosMap:
 
         return furthest_x, furthest_y
 
-    def get_next_ridge(self, vertex, opened, closed):
-        """Finds the tallest neighbor of a vertex for the mountain range builder's pathfinder."""
-        # Find next tallest neighbor to form the next portion of the ridge
-        tallest_neighbor_alt = -0.1
-        tallest_neighbor = None
-        for each_neighbor in vertex.neighbors.keys():
-            # Ignore vertices already found by the ridge builder
-            if each_neighbor not in closed and each_neighbor not in opened:
-                if each_neighbor.altitude > tallest_neighbor_alt:
-                    tallest_neighbor_alt = each_neighbor.altitude
-                    tallest_neighbor = each_neighbor
-
-        # If something is found, average its current altitude with the peak's altitude, add it to open
-        if tallest_neighbor:
-            tallest_neighbor.altitude = vertex.altitude * self.settings.mtn_peak_weight + \
-                                        tallest_neighbor.altitude * abs(self.settings.mtn_peak_weight - 1.0)
-            opened.append(tallest_neighbor)
-
-    def get_peaks(self):
-        """Finds the vertices that have higher altitudes than all of their neighbors,
-        sets is_peak internally and records them in a list."""
-        peaks = []
-        for each_vertex in self.vertices:
-            each_vertex.is_peak = True
-            for each_neighbor in each_vertex.neighbors:
-                if each_neighbor.altitude > each_vertex.altitude:
-                    each_vertex.is_peak = False
-                    break
-            if each_vertex.is_peak:
-                peaks.append(each_vertex)
-
-        return peaks
+    def get_vertex_altitudes(self):
+        """Returns the altitude of every vertex as a numpy array, in the same order as self.vertices."""
+        return numpy.array([vertex.altitude for vertex in self.vertices])
 
     def get_plate_centers(self):
         """Used to find the central vertices of the tectonic plates used by the altitude/mountain generator."""
@@ -253,6 +327,69 @@ class KhaosMap:
 
         return slopes
 
+    def erode(self, elapsed_ticks):
+        """Takes the cumulative average flowrate for all vertices and applies them to the erosion functions of that
+        vertex. Then adjusts cells relative to their vertices."""
+        if not self.settings.erode_enable:
+            return
+
+        for each_vertex in self.vertices:
+            each_vertex.erode(self.settings)
+
+        for each_cell in self.cells:
+            each_cell.find_altitude()
+            each_cell.find_lowest_vertex()
+
+        for each_vertex in self.vertices:
+            each_vertex.find_lowest_neighbor()
+
+        # Re-sort the altitudes, which also refreshes every vertex's is_coastal
+        self.altitude_index.rebuild()
+        self.rivers.rebuild()
+        self.coastlines.rebuild()
+        self.distances.clear()
+        self.oceans.rebuild()
+        if self.atmosphere is not None:
+            self.atmosphere.rebuild()
+        self.color_version += 1
+        self.touch_fields('altitude')
+
+    def get_atmosphere_state(self):
+        """Returns the atmosphere of every cell as a dictionary of numpy arrays, in the same order as self.cells."""
+        get_field = self.fields.get_cell_field  # alias
+        return {'wind': numpy.column_stack((get_field('wind_x'), get_field('wind_y'))),
+                'temperature': numpy.array(get_field('temperature')),
+                'pressure': numpy.array(get_field('pressure')),
+                'humidity': numpy.array(get_field('humidity'))}
+
+    def get_atmosphere_change(self, old_state, new_state):
+        """Compares two atmosphere states and returns a dictionary of the per-cell change in each field. Changes are
+        scaled by the range of their field, so that wind, temperature, pressure and humidity can share a tolerance."""
+        stg = self.settings
+        wind_change = old_state['wind'] - new_state['wind']
+
+        return {'wind': numpy.hypot(wind_change[:, 0], wind_change[:, 1]) / stg.wind_hard_cap,
+                'temperature': numpy.abs(old_state['temperature'] - new_state['temperature'])
+                / (stg.temps_highest - stg.temps_lowest),
+                'pressure': numpy.abs(old_state['pressure'] - new_state['pressure']) / 2.0,
+                'humidity': numpy.abs(old_state['humidity'] - new_state['humidity'])}
+
+    def get_simulation_state(self):
+        """Returns everything the simulation has changed since the terrain was generated as plain data,
+        so that it can be cached and restored with set_simulation_state."""
+        return {'cells': [[getattr(cell, field) for field in CELL_STATE_FIELDS] +
+                          [(cell.wind_x, cell.wind_y)] for cell in self.cells],
+                'vertices': [[getattr(vertex, field) for field in VERTEX_STATE_FIELDS] +
+                             [list(vertex.water_flow_ticks)]
+                             for vertex in self.vertices],
+                'season_ticks_this_year': self.settings.season_ticks_this_year,
+                'current_season': self.current_season,
+                'season_snapshots': self.season_snapshots,
+                'season_residuals': self.season_residuals,
+                'frozen': [cell.is_frozen for cell in self.cells],
+                'oceans': self.oceans.get_state(),
+                'scheduler': self.scheduler.get_state()}
+
     def get_season(self):
         """Returns the current season as a string."""
         year_ratio = self.settings.season_ticks_this_year / self.settings.season_ticks_per_year
@@ -266,36 +403,99 @@ class KhaosMap:
             return 'winter'
 
     def end_season(self):
-        """Ends the season by taking the cumulative average flowrate for all vertices and applying them to the erosion
-        functions of that vertex. Then adjusts cells relative to their vertices."""
-
-        if self.settings.erode_enable:
-            for each_vertex in self.vertices:
-                each_vertex.erode(self.settings)
-
-            for each_cell in self.cells:
-                each_cell.find_altitude()
-                each_cell.find_lowest_vertex()
-                each_cell.record_season(self.current_season)
-                each_cell.find_color()
+        """Ends the season by recording the season's weather data in each cell and updating their colors."""
+        for each_cell in self.cells:
+            each_cell.record_season(self.current_season)
+            each_cell.find_color()
+        self.color_version += 1
+        self.rivers.rebuild()
 
-            for each_vertex in self.vertices:
-                each_vertex.find_lowest_neighbor()
-                each_vertex.get_is_coastal()
+        if self.current_season:
+            self.record_season_snapshot(self.current_season)
 
-        # If erode is not enabled we still need season data
-        else:
-            for each_cell in self.cells:
-                each_cell.record_season(self.current_season)
-                each_cell.find_color()
+        if self.settlements is not None:
+            self.settlements.grow()
 
     def end_year(self):
         """Ends the year by resetting all rainfall trackers in cells and setting a few flags."""
-        self.settings.season_ticks_this_year = 0
+        # Carry over any ticks that passed the end of the year before the seasons were last checked
+        self.settings.season_ticks_this_year -= self.settings.season_ticks_per_year + 1
 
         for each_cell in self.cells:
             each_cell.rainfall_last_year = each_cell.rainfall_this_year
             each_cell.rainfall_this_year = 0
+        self.touch_fields('rainfall_last_year', 'rainfall_this_year')
+
+    def set_sea_level(self, height):
+        """Moves the sea level to height, only updating the cells and vertices that cross it.
+        Returns the list of cells that changed between land and sea."""
+        changed_cells, changed_vertices = self.altitude_index.set_sea_level(height)
+        self.settings.wtr_sea_level = height
+        self.color_version += 1
+        self.rivers.rebuild()
+        self.coastlines.rebuild()
+        self.distances.clear()
+        self.oceans.rebuild()
+
+        # Biomes depend on the sea, and coastal biomes on the sea around their neighbors
+        if self.has_biomes:
+            affected_cells = set(changed_cells)
+            for each_cell in changed_cells:
+                affected_cells.update(each_cell.neighbors)
+            for each_cell in affected_cells:
+                each_cell.find_biome()
+                each_cell.find_color()
+
+        self.settings.db_print(f"Sea level set to {round(height, 3)}, {len(changed_cells)} cells and "
+                               f"{len(changed_vertices)} vertices changed.", detail=3)
+        return changed_cells
+
+    def set_simulation_state(self, state):
+        """Restores a state produced by get_simulation_state, then refreshes the terrain data that depends on it."""
+        for each_cell, cell_state in zip(self.cells, state['cells']):
+            for field, value in zip(CELL_STATE_FIELDS, cell_state):
+                setattr(each_cell, field, value)
+            each_cell.wind_x, each_cell.wind_y = cell_state[-1]
+
+        # The atmosphere engine reads the frozen cells again when it is rebuilt below
+        for each_cell, is_frozen in zip(self.cells, state['frozen']):
+            each_cell.is_frozen = is_frozen
+
+        for each_vertex, vertex_state in zip(self.vertices, state['vertices']):
+            for field, value in zip(VERTEX_STATE_FIELDS, vertex_state):
+                setattr(each_vertex, field, value)
+            each_vertex.water_flow_ticks = vertex_state[-1]
+
+        self.settings.season_ticks_this_year = state['season_ticks_this_year']
+        self.current_season = state['current_season']
+        self.season_snapshots = state['season_snapshots']
+        self.season_residuals = state['season_residuals']
+        self.last_atmosphere_state = None
+        self.scheduler.set_state(state['scheduler'])
+
+        # Erosion during the simulation may have moved the terrain
+        for each_cell in self.cells:
+            each_cell.find_altitude()
+            each_cell.find_lowest_vertex()
+            each_cell.find_color()
+
+        for each_vertex in self.vertices:
+            each_vertex.find_lowest_neighbor()
+
+        # Re-sort the altitudes, which also refreshes every vertex's is_coastal
+        self.altitude_index.rebuild()
+        self.rivers.rebuild()
+        self.coastlines.rebuild()
+        self.distances.clear()
+        self.oceans.set_state(state['oceans'])
+        if self.atmosphere is not None:
+            self.atmosphere.rebuild()
+        self.color_version += 1
+
+    def set_vertex_altitudes(self, altitudes):
+        """Sets the altitude of every vertex from a sequence in the same order as self.vertices."""
+        for each_vertex, altitude in zip(self.vertices, altitudes):
+            each_vertex.altitude = float(altitude)
 
     def smooth_altitudes(self, resolution):
         """Smooths out the altitudes on the map by finding an average of the surrounding vertices to a sample distance
@@ -309,6 +509,102 @@ class KhaosMap:
         for iteration in range(0, len(self.vertices)):
             self.vertices[iteration].altitude = smoothed_altitudes[iteration]
 
+    def interpolate_altitudes(self, coarse_map):
+        """Sets the altitude of each vertex by interpolating between the vertices of the coarse map."""
+        coarse_points = numpy.array([(vertex.x, vertex.y) for vertex in coarse_map.vertices])
+        coarse_altitudes = numpy.array([vertex.altitude for vertex in coarse_map.vertices])
+        points = numpy.array([(vertex.x, vertex.y) for vertex in self.vertices])
+
+        altitudes = interpolate_field(coarse_points, coarse_altitudes, points)
+        for index, each_vertex in enumerate(self.vertices):
+            each_vertex.altitude = min(max(float(altitudes[index]), 0.0), 1.0)
+
+    def interpolate_climate(self, coarse_map):
+        """Warm starts the climate of each cell by interpolating between the cells of the coarse map, and picks up the
+        coarse map's place in the year. Seasonal records are not carried over, they refill as the seasons pass."""
+        coarse_points = numpy.array([(cell.x, cell.y) for cell in coarse_map.cells])
+        points = numpy.array([(cell.x, cell.y) for cell in self.cells])
+
+        fields = {}
+        for field in ('temperature', 'pressure', 'humidity', 'watertable', 'rainfall_this_year', 'rainfall_last_year'):
+            coarse_values = numpy.array([getattr(cell, field) for cell in coarse_map.cells])
+            fields[field] = interpolate_field(coarse_points, coarse_values, points)
+        wind_x = interpolate_field(coarse_points, coarse_map.fields.get_cell_field('wind_x'), points)
+        wind_y = interpolate_field(coarse_points, coarse_map.fields.get_cell_field('wind_y'), points)
+
+        for index, each_cell in enumerate(self.cells):
+            for field, values in fields.items():
+                setattr(each_cell, field, float(values[index]))
+            each_cell.wind_x, each_cell.wind_y = float(wind_x[index]), float(wind_y[index])
+
+        self.settings.season_ticks_this_year = coarse_map.settings.season_ticks_this_year
+        self.current_season = coarse_map.current_season
+
+    def is_steady(self, tol=None):
+        """Returns True once every season of the last year has matched the same season of the year before it to
+        within tol, meaning the seasonal cycle has converged."""
+        if tol is None:
+            tol = self.settings.atmo_steady_tol
+
+        if len(self.season_residuals) < 4:
+            return False
+        return max(self.season_residuals.values()) < tol
+
+    def record_season_snapshot(self, season):
+        """Stores the atmosphere at the end of a season, measures it against the same season of last year and, if
+        enabled, freezes the regions that have converged."""
+        new_state = self.get_atmosphere_state()
+        old_state = self.season_snapshots.get(season)
+        self.season_snapshots[season] = new_state
+
+        if old_state is None:
+            return
+
+        change = self.get_atmosphere_change(old_state, new_state)
+        self.season_residuals[season] = max(float(numpy.sqrt(numpy.mean(cell_change ** 2)))
+                                            for cell_change in change.values())
+
+        if self.settings.atmo_freeze_converged:
+            cell_change = numpy.max(numpy.array(list(change.values())), axis=0)
+            self.freeze_converged_cells(cell_change)
+
+    def freeze_converged_cells(self, cell_change):
+        """Freezes every cell that has converged along with all of its neighbors, and thaws frozen cells that border
+        an unconverged cell so the active region can spread back into them."""
+        converged = {}
+        for index, each_cell in enumerate(self.cells):
+            converged[each_cell] = each_cell.is_frozen or cell_change[index] < self.settings.atmo_freeze_tol
+
+        frozen_count = 0
+        for each_cell in self.cells:
+            each_cell.is_frozen = converged[each_cell] and all(converged[each_neighbor]
+                                                               for each_neighbor in each_cell.neighbors)
+            if each_cell.is_frozen:
+                frozen_count += 1
+
+        if self.atmosphere is not None:
+            self.atmosphere.find_frozen()
+
+        self.settings.db_print(f"{frozen_count} of {len(self.cells)} cells frozen.", detail=3)
+
+    def run_until_steady(self, tol=None, max_ticks=None):
+        """Runs the atmosphere until the seasonal cycle converges or max_ticks have passed, then thaws any frozen
+        cells. Returns the number of ticks that were run."""
+        if tol is None:
+            tol = self.settings.atmo_steady_tol
+        if max_ticks is None:
+            max_ticks = self.settings.atmo_steady_max_ticks
+
+        self.season_residuals.clear()
+
+        ticks = 0
+        while ticks < max_ticks and not self.is_steady(tol):
+            self.update_atmosphere()
+            ticks += 1
+
+        self.thaw_cells()
+        return ticks
+
     def set_altitudes(self, plates, slopes):
         """Uses the tectonic plates to assign altitudes to each vertex.
         For each vertex assigns an altitude based on its plate and slope."""
@@ -347,22 +643,76 @@ class KhaosMap:
             if each_vertex.altitude < 0.0:
                 each_vertex.altitude = 0.0
 
-    def update_atmosphere(self):
+    def step_atmosphere(self, elapsed_ticks):
         """Updates the map-wide airflow by a single tick."""
         # Set the current season modifier
         self.settings.find_season_multi(self.settings.season_ticks_this_year/self.settings.season_ticks_per_year)
 
-        for each_cell in self.cells:
-            each_cell.calculate_atmosphere_update(self)
+        if self.settings.atmo_engine == 'arrays':
+            self.get_atmosphere_engine().step()
+        else:
+            for each_cell in self.cells:
+                if not each_cell.is_frozen:
+                    each_cell.calculate_atmosphere_update(self)
 
-        for each_cell in self.cells:
-            each_cell.update_atmosphere()
+            for each_cell in self.cells:
+                each_cell.update_atmosphere()
 
-        for each_vertex in self.vertices:
-            each_vertex.update_hydrology(self.settings)
+        if self.settings.atmo_track_residuals:
+            self.update_residuals()
 
-        # Update the season ticks, reset the season tick counter if necessary
+        self.touch_fields('water_volume', *STATE_FIELDS)
+
+        # Keep counting the ticks of the year, the seasons subsystem handles their turnover
         self.settings.season_ticks_this_year += 1
+
+    def get_atmosphere_engine(self):
+        """Returns the arrays engine, making it again if the number of workers has changed."""
+        workers = get_worker_count(self.settings.atmo_workers)
+        if self.atmosphere is not None and self.atmosphere.workers != workers:
+            self.atmosphere.close()
+            self.atmosphere = None
+
+        if self.atmosphere is None:
+            self.atmosphere = AtmosphereEngine(self, workers)
+            self.settings.db_print(f"Stepping the atmosphere as arrays in {workers} blocks.", detail=3)
+        return self.atmosphere
+
+    def get_route_planner(self):
+        """Returns the route planner, see routes.py."""
+        if self.routes is None:
+            self.routes = RoutePlanner(self)
+        return self.routes
+
+    def get_settlement_engine(self):
+        """Returns the settlement engine, see settlements.py."""
+        if self.settlements is None:
+            self.settlements = SettlementEngine(self)
+        return self.settlements
+
+    def update_atmosphere(self):
+        """Advances the whole simulation by a single tick, running every subsystem that is due on the scheduler."""
+        self.scheduler.tick()
+
+    def publish_state(self, elapsed_ticks):
+        """Publishes the current fields to the shared memory block, see SharedState."""
+        if self.shared_state is not None:
+            self.shared_state.publish()
+
+    def update_hydrology(self, elapsed_ticks):
+        """Flows the water that has accumulated in the vertices since the last hydrology update."""
+        for each_vertex in self.vertices:
+            each_vertex.update_hydrology(self.settings, elapsed_ticks)
+        self.touch_fields('watertable', 'water_volume', 'water_flow_rate')
+
+    def update_oceans(self, elapsed_ticks):
+        """Steps the ocean currents over the ticks since the last update, see oceans.py."""
+        if self.settings.ocean_enable:
+            self.oceans.update(elapsed_ticks)
+            self.touch_fields('temperature')
+
+    def update_seasons(self, elapsed_ticks):
+        """Ends the year and the season when their ticks have run out."""
         if self.settings.season_ticks_this_year > self.settings.season_ticks_per_year:
             self.end_year()
 
@@ -370,6 +720,46 @@ class KhaosMap:
         if self.current_season != self.get_season():
             self.end_season()
             self.current_season = self.get_season()
+            self.update_frozen_cells()
+
+    def update_frozen_cells(self):
+        """Frozen cells replay the converged seasonal cycle, taking on the state they held at the end of the coming
+        season last year."""
+        snapshot = self.season_snapshots.get(self.current_season)
+        if snapshot is None:
+            return
+
+        for index, each_cell in enumerate(self.cells):
+            if each_cell.is_frozen:
+                each_cell.wind_x, each_cell.wind_y = snapshot['wind'][index]
+                each_cell.temperature = snapshot['temperature'][index]
+                each_cell.pressure = snapshot['pressure'][index]
+                each_cell.humidity = snapshot['humidity'][index]
+        self.touch_fields('wind_x', 'wind_y', 'temperature', 'pressure', 'humidity')
+
+    def touch_fields(self, *names):
+        """Counts a change to each of the named cell or vertex fields, see field_versions."""
+        for name in names:
+            self.field_versions[name] += 1
+
+    def update_residuals(self):
+        """Records the scaled RMS change of each atmosphere field since the last tick in self.residuals."""
+        new_state = self.get_atmosphere_state()
+
+        if self.last_atmosphere_state is not None:
+            change = self.get_atmosphere_change(self.last_atmosphere_state, new_state)
+            for field, cell_change in change.items():
+                self.residuals[field] = float(numpy.sqrt(numpy.mean(cell_change ** 2)))
+
+        self.last_atmosphere_state = new_state
+
+    def thaw_cells(self):
+        """Returns every frozen cell to the active simulation."""
+        for each_cell in self.cells:
+            each_cell.is_frozen = False
+
+        if self.atmosphere is not None:
+            self.atmosphere.find_frozen()
 
     def update_textbox(self):
         """Updates the textbox to reflect the current focus cell of the map."""
@@ -379,6 +769,125 @@ class KhaosMap:
         self.season_text.write(self.current_season.title())
 
 
+def gen_coarse_to_fine(settings=None):
+    """Generates a map by first simulating a coarse map of settings.refine_coarse_share of settings.total_cells until
+    its climate is steady, then refining it to settings.total_cells. Returns the refined KhaosMap."""
+    if settings is None:
+        settings = Settings()
+
+    # A coarse map at least as large as the fine one would only make the refined map slower to generate
+    if not 0.0 < settings.refine_coarse_share < 1.0:
+        raise ValueError(f"refine_coarse_share must be between 0 and 1, not {settings.refine_coarse_share}")
+
+    coarse_settings = copy.copy(settings)
+    coarse_settings.total_cells = int(settings.total_cells * settings.refine_coarse_share)
+    coarse_settings.wind_presim = 0
+    coarse_settings.wind_presim_until_steady = False
+
+    coarse_map = KhaosMap(coarse_settings)
+    settings.db_print("Simulating the coarse map...")
+    coarse_map.run_until_steady()
+
+    return KhaosMap(settings, coarse_map)
+
+
+def get_stage_cache(settings):
+    """Returns the stage cache shared by every map in this process, creating it on first use.
+    Returns None if caching is disabled."""
+    global shared_stage_cache
+
+    if not settings.cache_enable:
+        return None
+
+    if shared_stage_cache is None:
+        shared_stage_cache = StageCache(settings.cache_memory_mb * 1024 * 1024, settings.cache_dir,
+                                        settings.cache_disk_mb * 1024 * 1024)
+    return shared_stage_cache
+
+
+def interpolate_field(known_points, known_values, points):
+    """Linearly interpolates the values known at known_points onto points. Points that fall outside of the known
+    points' convex hull take the value of the nearest known point."""
+    # Only refined maps interpolate, and scipy.interpolate is slow to import, so it waits until one is made
+    import scipy.interpolate as intrp
+
+    values = intrp.LinearNDInterpolator(known_points, known_values)(points)
+
+    outside = numpy.isnan(values)
+    if outside.any():
+        values[outside] = intrp.NearestNDInterpolator(known_points, known_values)(points[outside])
+
+    return values
+
+
+def get_poisson_disk_points(count, attempts=30):
+    """Returns an array of count points between -1 and 1 that are no closer to each other than a minimum distance,
+    spread evenly over the square like blue noise. The distance is chosen so the sampler makes a few more points than
+    asked for, and is shrunk and sampled again on the rare run that falls short. The surplus is then dropped at
+    random."""
+    # Bridson's sampler fills an area A with about 0.62 * A / radius ** 2 points
+    radius = math.sqrt(0.6 * 4.0 / count)
+    points = sample_poisson_disk(radius, attempts)
+    while len(points) < count:
+        radius *= 0.97
+        points = sample_poisson_disk(radius, attempts)
+
+    kept = numpy.sort(numpy.random.choice(len(points), count, replace=False))
+    return points[kept]
+
+
+def sample_poisson_disk(radius, attempts):
+    """Fills the square between -1 and 1 with points at least radius apart using Bridson's algorithm. New points are
+    tried in the ring between radius and twice radius around a random active point, which is retired after attempts
+    failures. A grid with one point per cell at most finds the points that could be too close in constant time."""
+    cell_size = radius / math.sqrt(2)
+    columns = int(math.ceil(2.0 / cell_size))
+    grid = [None] * (columns * columns)   # Column * columns + row : the point in that grid cell
+    min_squared = radius * radius
+    points = []
+    active = []   # The indices of the points that new points are still tried around
+
+    def place(x, y):
+        grid[int((x + 1.0) / cell_size) * columns + int((y + 1.0) / cell_size)] = (x, y)
+        active.append(len(points))
+        points.append((x, y))
+
+    place(*numpy.random.uniform(-1.0, 1.0, 2).tolist())
+    while active:
+        slot = numpy.random.randint(len(active))
+        origin_x, origin_y = points[active[slot]]
+
+        # Candidates are drawn uniformly over the area of the ring
+        angles = numpy.random.uniform(0.0, 2 * math.pi, attempts)
+        distances = numpy.sqrt(numpy.random.uniform(min_squared, 4 * min_squared, attempts))
+        candidates_x = (origin_x + numpy.cos(angles) * distances).tolist()
+        candidates_y = (origin_y + numpy.sin(angles) * distances).tolist()
+
+        for x, y in zip(candidates_x, candidates_y):
+            if not (-1.0 <= x < 1.0 and -1.0 <= y < 1.0):
+                continue
+            column, row = int((x + 1.0) / cell_size), int((y + 1.0) / cell_size)
+            if is_disk_clear(grid, columns, column, row, x, y, min_squared):
+                place(x, y)
+                break
+        else:
+            # Every attempt failed, so this point is surrounded and is retired
+            active[slot] = active[-1]
+            active.pop()
+
+    return numpy.array(points)
+
+
+def is_disk_clear(grid, columns, column, row, x, y, min_squared):
+    """Returns True if no point in the grid cells around column, row lies within the minimum distance of x, y."""
+    for near_column in range(max(column - 2, 0), min(column + 3, columns)):
+        for near_row in range(max(row - 2, 0), min(row + 3, columns)):
+            near = grid[near_column * columns + near_row]
+            if near is not None and (near[0] - x) ** 2 + (near[1] - y) ** 2 < min_squared:
+                return False
+    return True
+
+
 def lloyds_relax(vor):
     """Applies Lloyd's algorithm to the given voronoi diagram, finding the centroid of each region and then passing
     those to scipy to re-create a relaxed diagram."""
@@ -0,0 +1,149 @@
+import math
+from collections import OrderedDict
+
+import pygame
+
+from render import Renderable
+
+
+class LodPyramid(Renderable):
+    """A level of detail pyramid of pre-rasterized map tiles, used in place of the cell polygons when the view holds
+    more cells than it has pixels to show them. Level 0 covers the whole map at the resolution of the unzoomed screen
+    and each level after it doubles the resolution. The coarsest level that still has a pixel for every screen pixel is
+    drawn, so the number of draw calls depends on the size of the screen rather than the size of the world.
+
+    Tiles are rendered when first needed and kept until the color table from Overlays changes. Rivers and coastlines are
+    baked into the tiles from the map's RiverNetwork and Coastlines."""
+    def __init__(self, k_map, viewport, overlays):
+        super().__init__()
+
+        self.map = k_map
+        self.viewport = viewport
+        self.overlays = overlays
+        self.settings = k_map.settings
+        self.tile_size = self.settings.lod_tile_size
+
+        # Level 0 matches the unzoomed projection, find its scale and the map coordinates of its top left corner
+        scale_x, scale_y = self.settings.get_screen_scale()
+        self.scale_x = scale_x / self.settings.view_zoom
+        self.scale_y = scale_y / self.settings.view_zoom
+        self.origin_x = -(self.settings.screen_size[0] / 2) / self.scale_x
+        self.origin_y = -(self.settings.screen_size[1] / 2) / self.scale_y
+
+        self.tiles = OrderedDict()   # (level, column, row) : rendered tile, from least to most recently used
+        self.scaled_tiles = {}       # (level, column, row) : tile scaled for the current view
+        self.scaled_version = None
+        self.tile_state = None
+
+    def get_level(self):
+        """Returns the coarsest level with at least as many pixels as the screen at the current zoom."""
+        level = math.ceil(math.log2(max(self.settings.view_zoom, 1.0)) - 1e-9)
+        return min(max(level, 0), self.settings.lod_max_level)
+
+    def get_tile_bbox(self, level, column, row):
+        """Returns the map coordinate bounding box covered by a tile."""
+        width = self.tile_size / (self.scale_x * 2 ** level)
+        height = self.tile_size / (self.scale_y * 2 ** level)
+        left = self.origin_x + column * width
+        top = self.origin_y + row * height
+        return left, top, left + width, top + height
+
+    def get_tile(self, level, column, row):
+        """Returns the rendered tile, rendering it if it is not already in memory."""
+        key = (level, column, row)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        tile = self.render_tile(level, column, row)
+        self.tiles[key] = tile
+        while len(self.tiles) > self.settings.lod_max_tiles:
+            self.tiles.popitem(last=False)
+
+        return tile
+
+    def render_tile(self, level, column, row):
+        """Rasterizes the cells, coastlines and rivers that fall on a tile into a new surface."""
+        tile = pygame.Surface((self.tile_size, self.tile_size))
+        draw_map_area(tile, self.map, self.overlays.get_color_table(), self.viewport.cell_index,
+                      self.get_tile_bbox(level, column, row))
+        return tile
+
+    def check_tile_state(self):
+        """Drops every rendered tile if anything that is baked into them has changed."""
+        self.overlays.get_color_table()
+        tile_state = (self.overlays.version, self.map.rivers.version, self.map.coastlines.version,
+                      self.settings.do_render_coastlines, self.settings.do_render_rivers)
+        if tile_state != self.tile_state:
+            self.tile_state = tile_state
+            self.tiles.clear()
+            self.scaled_tiles.clear()
+
+    def update(self, renderer):
+        """Draws the visible tiles of the chosen level, scaled to the current zoom."""
+        self.check_tile_state()
+
+        # Scaled tiles are only good for the view they were scaled for
+        if self.scaled_version != self.viewport.version:
+            self.scaled_version = self.viewport.version
+            self.scaled_tiles.clear()
+
+        level = self.get_level()
+        left, top, right, bottom = self.viewport.get_visible_bbox()
+        tile_width = self.tile_size / (self.scale_x * 2 ** level)
+        tile_height = self.tile_size / (self.scale_y * 2 ** level)
+        first_column = math.floor((left - self.origin_x) / tile_width)
+        last_column = math.floor((right - self.origin_x) / tile_width)
+        first_row = math.floor((top - self.origin_y) / tile_height)
+        last_row = math.floor((bottom - self.origin_y) / tile_height)
+
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                key = (level, column, row)
+
+                # Round both corners of the tile so neighboring tiles meet without seams
+                tile_left, tile_top, tile_right, tile_bottom = self.get_tile_bbox(level, column, row)
+                ss_left, ss_top = self.settings.project_to_screen(tile_left, tile_top)
+                ss_right, ss_bottom = self.settings.project_to_screen(tile_right, tile_bottom)
+                ss_left, ss_top = round(ss_left), round(ss_top)
+                size = (round(ss_right) - ss_left, round(ss_bottom) - ss_top)
+
+                if key not in self.scaled_tiles:
+                    tile = self.get_tile(level, column, row)
+                    if size == tile.get_size():
+                        self.scaled_tiles[key] = tile
+                    else:
+                        self.scaled_tiles[key] = pygame.transform.smoothscale(tile, size)
+
+                renderer.screen.blit(self.scaled_tiles[key], (ss_left, ss_top))
+
+
+def draw_map_area(surface, k_map, color_table, cell_index, bbox, line_scale=1.0):
+    """Draws the cells, coastlines and rivers that fall within a bounding box of map coordinates so that the box fills
+    the whole surface. Cells are colored from a color table from Overlays, cell_index is a GridIndex of the cell
+    numbers and line_scale multiplies the widths of the lines."""
+    stg = k_map.settings
+    left, top, right, bottom = bbox
+    scale_x = surface.get_width() / (right - left)
+    scale_y = surface.get_height() / (bottom - top)
+
+    def to_surface(point):
+        return (point.x - left) * scale_x, (point.y - top) * scale_y
+
+    surface.fill(stg.clr['ocean'])
+    for number in sorted(cell_index.query(bbox)):
+        each_cell = k_map.cells[number]
+        pygame.draw.polygon(surface, color_table[number + 1], [to_surface(vertex) for vertex in each_cell.region], 0)
+
+    if stg.do_render_coastlines:
+        for index in k_map.coastlines.get_lines_in(bbox):
+            each_line = k_map.coastlines.lines[index]
+            if len(each_line.vertices) > 1:
+                points = [to_surface(vertex) for vertex in each_line.vertices]
+                pygame.draw.lines(surface, stg.clr['black'], each_line.is_closed, points, round(3 * line_scale))
+
+    if stg.do_render_rivers:
+        for index in k_map.rivers.get_rivers_in(bbox):
+            each_river = k_map.rivers.rivers[index]
+            points = [to_surface(vertex) for vertex in each_river.vertices]
+            pygame.draw.lines(surface, stg.clr['river'], False, points, max(1, round(each_river.width * line_scale)))
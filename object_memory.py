@@ -0,0 +1,75 @@
+import sys
+
+from khaos_map import KhaosMap
+from settings import Settings
+
+# Values of these types belong to the object that holds them, anything else is another object of the map or is shared
+OWNED_TYPES = (int, float, str, tuple, list, dict)
+
+
+def get_owned_size(value, seen):
+    """Returns the bytes used by a value and by the owned values inside it, skipping any value already in seen."""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        contents = list(value.keys()) + list(value.values())
+    elif isinstance(value, (tuple, list)):
+        contents = value
+    else:
+        return size
+    return size + sum(get_owned_size(each, seen) for each in contents if isinstance(each, OWNED_TYPES))
+
+
+def get_object_size(item, seen):
+    """Returns the bytes used by an object, its __dict__ or slots and the owned values of its attributes."""
+    size = sys.getsizeof(item)
+    if hasattr(item, '__dict__'):
+        size += get_owned_size(item.__dict__, seen)
+
+    for each_class in type(item).__mro__:
+        for name in getattr(each_class, '__slots__', ()):
+            value = getattr(item, name, None)
+            if isinstance(value, OWNED_TYPES):
+                size += get_owned_size(value, seen)
+    return size
+
+
+def get_object_memory(k_map):
+    """Returns a dictionary of the bytes used by the map's cells, vertices and the season data of the cells, then by
+    the arrays of its FieldStore, see FieldStore.get_memory_report."""
+    seen = set()
+    season_data = [season for cell in k_map.cells
+                   for season in (cell.last_spring, cell.last_summer, cell.last_autumn, cell.last_winter) if season]
+
+    memory = {'cells': sum(get_object_size(cell, seen) for cell in k_map.cells),
+              'vertices': sum(get_object_size(vertex, seen) for vertex in k_map.vertices),
+              'season data': sum(get_object_size(season, seen) for season in season_data)}
+    memory.update(k_map.fields.get_memory_report())
+    return memory
+
+
+def write_memory_report(memory, cell_count):
+    """Returns the results of get_object_memory as printable lines, scaled to 100k cells."""
+    lines = ["Memory per 100k cells:"]
+    for name, size in memory.items():
+        lines.append(f"  {name:<16}{size * 100000 / cell_count / 2 ** 20:>10.1f}MB")
+    lines.append(f"  {'total':<16}{sum(memory.values()) * 100000 / cell_count / 2 ** 20:>10.1f}MB")
+    return lines
+
+
+if __name__ == "__main__":
+    # Usage: python object_memory.py [years] [total_cells], the years are simulated first so the seasons are recorded
+    memory_settings = Settings()
+    memory_years = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    if len(sys.argv) > 2:
+        memory_settings.total_cells = int(sys.argv[2])
+
+    memory_map = KhaosMap(memory_settings)
+    for tick in range(memory_years * memory_settings.season_ticks_per_year):
+        memory_map.update_atmosphere()
+
+    report = get_object_memory(memory_map)
+    print('\n'.join(write_memory_report(report, len(memory_map.cells))))
@@ -0,0 +1,154 @@
+import numpy
+
+from fields import CELL_FIELDS
+
+
+class OceanCirculation:
+    """Moves the water of the cells at or below sea level, and the heat it carries. Each ocean cell has a current and
+    a sea temperature. The surface wind drags the currents along against friction, the turning of the world bends
+    them to either side of the equator and viscosity evens them out with their neighbors. Where an ocean cell borders
+    land the part of its current flowing into the coast is taken away, so the shape of each basin steers the water
+    along its shores and around into gyres.
+
+    The sea temperature is carried by the currents, each cell pulling heat from the neighbors upstream of it, and is
+    exchanged with the air above, which warms or cools the air of the ocean cells and of the land cells on their
+    coasts. Everything is stepped as arrays over the ocean cells and their ocean to ocean edges, and an update may
+    cover any number of ticks, so the oceans run on the scheduler at a slower rate than the atmosphere."""
+    def __init__(self, k_map):
+        self.map = k_map
+        self.settings = k_map.settings
+        self.temperature_row = CELL_FIELDS.index('temperature')
+        self.wind_rows = [CELL_FIELDS.index('wind_x'), CELL_FIELDS.index('wind_y')]
+
+        # State of the ocean cells, in the order of self.cells
+        self.cells = numpy.zeros(0, dtype=k_map.fields.index_dtype)   # The numbers of the cells at or below sea level
+        self.currents = numpy.zeros((2, 0), dtype=k_map.fields.dtype)
+        self.sea_temperature = numpy.zeros(0, dtype=k_map.fields.dtype)
+        self.rebuild()
+
+    def rebuild(self):
+        """Finds the ocean cells and the edges between them again, after the terrain or the sea level has changed.
+        Cells that stay in the ocean keep their state, new ocean cells start still and as warm as the air above."""
+        fields = self.map.fields  # alias
+        starts, indices = fields.adjacency['cell_neighbors'][:2]
+        cell_count = len(starts) - 1
+        is_ocean = fields.get_cell_field('altitude') <= self.settings.wtr_sea_level
+
+        currents = numpy.zeros((2, cell_count), dtype=fields.dtype)
+        sea_temperature = fields.cell_array[self.temperature_row].copy()
+        currents[:, self.cells] = self.currents
+        sea_temperature[self.cells] = self.sea_temperature
+
+        self.cells = numpy.flatnonzero(is_ocean).astype(fields.index_dtype)
+        self.currents = currents[:, self.cells]
+        self.sea_temperature = sea_temperature[self.cells]
+        local = numpy.full(cell_count, -1, dtype=fields.index_dtype)
+        local[self.cells] = numpy.arange(len(self.cells))
+
+        # The unit vector of every edge, pointing from the neighbor into the cell
+        owners = numpy.repeat(numpy.arange(cell_count), numpy.diff(starts))
+        directions = fields.cell_points[owners] - fields.cell_points[indices]
+        directions /= numpy.maximum(numpy.hypot(*directions.T), 1e-9)[:, None]
+
+        # Edges between two ocean cells carry the water and its heat, in local numbers
+        is_water = is_ocean[owners] & is_ocean[indices]
+        self.receivers = local[owners[is_water]]
+        self.givers = local[indices[is_water]]
+        self.directions = directions[is_water].T.astype(fields.dtype)
+        self.degrees = numpy.bincount(self.receivers, minlength=len(self.cells))
+
+        # The coast normal of an ocean cell points from it toward the land around it
+        is_shore = is_ocean[owners] & ~is_ocean[indices]
+        normals = numpy.array([numpy.bincount(local[owners[is_shore]], -directions[is_shore, axis],
+                                              minlength=len(self.cells)) for axis in range(2)])
+        lengths = numpy.hypot(*normals)
+        self.coast = numpy.flatnonzero(lengths > 0.0)
+        self.normals = (normals[:, self.coast] / lengths[self.coast]).astype(fields.dtype)
+
+        # Land cells with an ocean neighbor take on some of the sea temperature
+        is_landward = ~is_ocean[owners] & is_ocean[indices]
+        self.shore_cells, self.shore_receivers = numpy.unique(owners[is_landward], return_inverse=True)
+        self.shore_givers = local[indices[is_landward]]
+        self.shore_degrees = numpy.bincount(self.shore_receivers, minlength=len(self.shore_cells))
+
+        self.settings.db_print(f"Found {len(self.cells)} ocean cells with {len(self.coast)} on the coast.", detail=4)
+
+    def update(self, elapsed_ticks):
+        """Steps the currents and the sea temperature over the ticks since the last update, then exchanges heat with
+        the air of the ocean cells and of their coasts."""
+        if len(self.cells) == 0:
+            return
+        stg = self.settings  # alias
+        fields = self.map.fields  # alias
+        cell_count = len(self.cells)
+        currents = self.currents  # alias
+
+        # The wind drags the water along, against the friction of the water
+        wind = fields.cell_array[numpy.ix_(self.wind_rows, self.cells)]
+        currents += wind * (stg.ocean_wind_drag * elapsed_ticks)
+        currents *= (1.0 - stg.ocean_friction) ** elapsed_ticks
+
+        # The turning of the world bends the currents, the further from the equator the harder and opposite either side
+        angles = stg.ocean_coriolis * elapsed_ticks * fields.cell_points[self.cells, 1]
+        cosines, sines = numpy.cos(angles), numpy.sin(angles)
+        currents[:] = cosines * currents[0] - sines * currents[1], sines * currents[0] + cosines * currents[1]
+
+        # Viscosity evens each current out toward the average of its ocean neighbors
+        has_neighbors = self.degrees > 0
+        mixing = 1.0 - (1.0 - stg.ocean_viscosity) ** elapsed_ticks
+        for axis in range(2):
+            neighbor_sum = numpy.bincount(self.receivers, currents[axis, self.givers], minlength=cell_count)
+            currents[axis, has_neighbors] += mixing * (neighbor_sum[has_neighbors] / self.degrees[has_neighbors] -
+                                                       currents[axis, has_neighbors])
+
+        # Water cannot flow into the coast, only along it
+        into_coast = numpy.maximum((currents[:, self.coast] * self.normals).sum(axis=0), 0.0)
+        currents[:, self.coast] -= into_coast * self.normals
+
+        speeds = numpy.hypot(*currents)
+        currents *= numpy.minimum(1.0, stg.ocean_max_current / numpy.maximum(speeds, 1e-9))
+
+        # Each cell pulls heat from the neighbors whose water flows into it, at most ocean_max_pull of it per update
+        along = (currents[:, self.receivers] * self.directions).sum(axis=0)
+        pulls = numpy.maximum(along, 0.0) * (stg.ocean_heat_transport * elapsed_ticks)
+        totals = numpy.bincount(self.receivers, pulls, minlength=cell_count)
+        pulls *= numpy.minimum(1.0, stg.ocean_max_pull / numpy.maximum(totals, 1e-9))[self.receivers]
+        sea_temperature = self.sea_temperature  # alias
+        sea_temperature += numpy.bincount(self.receivers, pulls * (sea_temperature[self.givers] -
+                                                                   sea_temperature[self.receivers]),
+                                          minlength=cell_count)
+
+        # The sea and the air above it move toward each other's temperature
+        air_temperature = fields.cell_array[self.temperature_row]  # alias
+        ocean_air = air_temperature[self.cells]
+        to_sea = 1.0 - (1.0 - stg.ocean_air_exchange) ** elapsed_ticks
+        to_air = 1.0 - (1.0 - stg.ocean_heat_feedback) ** elapsed_ticks
+        air_temperature[self.cells] = ocean_air + to_air * (sea_temperature - ocean_air)
+        sea_temperature += to_sea * (ocean_air - sea_temperature)
+
+        # Coastal land moves toward the average sea temperature of its ocean neighbors
+        if len(self.shore_cells):
+            shore_sea = numpy.bincount(self.shore_receivers, sea_temperature[self.shore_givers],
+                                       minlength=len(self.shore_cells)) / self.shore_degrees
+            to_shore = 1.0 - (1.0 - stg.ocean_coastal_feedback) ** elapsed_ticks
+            air_temperature[self.shore_cells] += to_shore * (shore_sea - air_temperature[self.shore_cells])
+
+    def get_current(self, cell_number):
+        """Returns the (x, y) current of a cell, (0, 0) on land."""
+        position = numpy.searchsorted(self.cells, cell_number)
+        if position < len(self.cells) and self.cells[position] == cell_number:
+            return float(self.currents[0, position]), float(self.currents[1, position])
+        return 0.0, 0.0
+
+    def get_state(self):
+        """Returns the state of the oceans as plain data, see KhaosMap.get_simulation_state."""
+        return {'cells': self.cells.tolist(), 'currents': self.currents.tolist(),
+                'sea_temperature': self.sea_temperature.tolist()}
+
+    def set_state(self, state):
+        """Restores a state produced by get_state, keeping it for the cells that are still in the ocean."""
+        fields = self.map.fields  # alias
+        self.cells = numpy.array(state['cells'], dtype=fields.index_dtype)
+        self.currents = numpy.array(state['currents'], dtype=fields.dtype).reshape(2, len(self.cells))
+        self.sea_temperature = numpy.array(state['sea_temperature'], dtype=fields.dtype)
+        self.rebuild()
@@ -0,0 +1,145 @@
+import numpy
+
+from fields import CELL_FIELDS, VERTEX_FIELDS
+
+
+class OverlayLayer:
+    """A heatmap of a single field of the map. Get_values returns the field for every cell as an array, which is
+    scaled between low and high and colored along a gradient of (position, color) stops running from 0 to 1.
+    Fields names the cell and vertex fields get_values reads, the layer's colors are kept until one of them changes.
+    Layers with show_ocean set to False leave the cells below sea level in the ocean color."""
+    def __init__(self, name, get_values, fields, low, high, gradient, show_ocean=True):
+        self.name = name
+        self.get_values = get_values
+        self.fields = fields
+        self.low = low
+        self.high = high
+        self.gradient = gradient
+        self.show_ocean = show_ocean
+
+    def get_colors(self, k_map, overlays):
+        """Returns an array of the colors of every cell on this layer, computed in one batch."""
+        values = numpy.asarray(self.get_values(k_map, overlays), dtype=float)
+        scaled = numpy.clip((values - self.low) / (self.high - self.low), 0.0, 1.0)
+
+        positions = [stop[0] for stop in self.gradient]
+        colors = numpy.empty((len(values), 3))
+        for channel in range(3):
+            colors[:, channel] = numpy.interp(scaled, positions, [stop[1][channel] for stop in self.gradient])
+
+        if not self.show_ocean:
+            colors[overlays.get_cell_field('altitude') <= k_map.settings.wtr_sea_level] = k_map.settings.clr['ocean']
+
+        return colors.astype(numpy.uint8)
+
+
+class Overlays:
+    """Builds the table of cell colors used by the label map and the LOD pyramid, indexed by label, so row 0 is the
+    area outside of every cell and cell n of the map is row n + 1. The table holds the terrain colors, or the colors of
+    settings.render_overlay when it names a layer.
+
+    Tables are cached until the map's color_version changes or one of the fields they are colored from does, which
+    the map counts in its field_versions as each subsystem writes them. Switching between layers that are still fresh
+    only swaps tables."""
+    def __init__(self, k_map):
+        self.map = k_map
+        self.settings = k_map.settings
+
+        self.layers = {}
+        for each_layer in get_default_layers(self.settings):
+            self.layers[each_layer.name] = each_layer
+
+        # Every cell's vertices as one flat array of vertex numbers, with the start of each cell's run of vertices
+        vertex_numbers = {vertex: index for index, vertex in enumerate(k_map.vertices)}
+        self.region_vertices = numpy.array([vertex_numbers[vertex] for cell in k_map.cells for vertex in cell.region],
+                                           dtype=int)
+        self.region_starts = numpy.cumsum([0] + [len(cell.region) for cell in k_map.cells[:-1]])
+
+        self.tables = {}        # Layer name, or None for the terrain : color table
+        self.table_states = {}  # Layer name, or None for the terrain : the state the table was built in
+        self.version = 0        # Counts changes to the active table, so cached images know when they are stale
+        self.active_state = None
+
+    def get_cell_field(self, field):
+        """Returns an array of the value of the given attribute for every cell."""
+        if field in CELL_FIELDS:
+            return self.map.fields.get_cell_field(field)
+        return numpy.fromiter((getattr(cell, field) for cell in self.map.cells), dtype=float, count=len(self.map.cells))
+
+    def get_vertex_field(self, field):
+        """Returns an array of the value of the given attribute for every vertex."""
+        if field in VERTEX_FIELDS:
+            return self.map.fields.get_vertex_field(field)
+        return numpy.fromiter((getattr(vertex, field) for vertex in self.map.vertices), dtype=float,
+                              count=len(self.map.vertices))
+
+    def get_region_max(self, vertex_values):
+        """Returns the largest of the given vertex values among each cell's vertices."""
+        return numpy.maximum.reduceat(vertex_values[self.region_vertices], self.region_starts)
+
+    def get_table_state(self, name):
+        """Returns the state the table of the named layer is built from, the table is stale once it changes. The
+        terrain only depends on the rainfall fields while rainfall is rendered over it."""
+        if name is None:
+            fields = ('rainfall_last_year', 'rainfall_this_year') if self.settings.do_render_rainfall else ()
+        else:
+            fields = self.layers[name].fields
+        return (self.map.color_version, self.settings.do_render_rainfall,
+                tuple(self.map.field_versions[field] for field in fields))
+
+    def get_color_table(self):
+        """Returns the color table of the active layer, building it if the cached table is stale."""
+        name = self.settings.render_overlay
+        table_state = self.get_table_state(name)
+        if name not in self.tables or self.table_states[name] != table_state:
+            table = numpy.empty((len(self.map.cells) + 1, 3), dtype=numpy.uint8)
+            table[0] = self.settings.clr['ocean']
+            if name is None:
+                table[1:] = [each_cell.get_draw_color() for each_cell in self.map.cells]
+            else:
+                table[1:] = self.layers[name].get_colors(self.map, self)
+
+            self.tables[name] = table
+            self.table_states[name] = table_state
+            self.settings.db_print(f"Built the color table for the {name or 'terrain'} layer.", detail=4)
+
+        # Count a change whenever a different table, or a rebuilt one, becomes the active table
+        active_state = (name, self.table_states[name])
+        if active_state != self.active_state:
+            self.active_state = active_state
+            self.version += 1
+
+        return self.tables[name]
+
+    def cycle(self):
+        """Switches to the next layer, going back to the terrain after the last one."""
+        names = [None] + list(self.layers.keys())
+        self.settings.render_overlay = names[(names.index(self.settings.render_overlay) + 1) % len(names)]
+        self.settings.db_print(f"Showing the {self.settings.render_overlay or 'terrain'} layer.", detail=2)
+
+
+def get_rainfall(k_map, overlays):
+    """Returns the rainfall of last year, or of this year for cells that have not had a full year yet."""
+    last_year = overlays.get_cell_field('rainfall_last_year')
+    return numpy.where(last_year == 0, overlays.get_cell_field('rainfall_this_year'), last_year)
+
+
+def get_default_layers(settings):
+    """Returns the overlay layers the map view offers."""
+    cold_to_hot = ((0.0, (48, 64, 200)), (0.5, (240, 240, 240)), (1.0, (200, 40, 32)))
+    dry_to_wet = ((0.0, (240, 232, 200)), (1.0, (24, 64, 200)))
+    max_flow = settings.wtr_river_flow_as_width * settings.wtr_max_river_render_width
+
+    return [OverlayLayer('temperature', lambda k_map, overlays: overlays.get_cell_field('temperature'),
+                         ('temperature',), settings.temps_lowest, settings.temps_equatorial, cold_to_hot),
+            OverlayLayer('pressure', lambda k_map, overlays: overlays.get_cell_field('pressure'),
+                         ('pressure',), -1.0, 1.0, cold_to_hot),
+            OverlayLayer('humidity', lambda k_map, overlays: overlays.get_cell_field('humidity'),
+                         ('humidity',), 0.0, 1.0, dry_to_wet),
+            OverlayLayer('rainfall', get_rainfall, ('rainfall_last_year', 'rainfall_this_year'),
+                         0.0, 1000.0, dry_to_wet, show_ocean=False),
+            OverlayLayer('watertable', lambda k_map, overlays: overlays.get_cell_field('watertable'),
+                         ('watertable',), 0.0, 1000.0, dry_to_wet, show_ocean=False),
+            OverlayLayer('flow', lambda k_map, overlays:
+                         overlays.get_region_max(overlays.get_vertex_field('water_flow_rate')),
+                         ('water_flow_rate',), 0.0, max_flow, dry_to_wet, show_ocean=False)]
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import pickle
+import random
+from collections import OrderedDict
+
+import numpy.random
+
+# Bump this whenever a stage's code changes in a way that should invalidate the outputs already cached on disk
+PIPELINE_VERSION = 7
+
+
+class Stage:
+    """A single named step of map generation. Run performs the step on the map, capture returns its result as plain
+    picklable data and restore applies a captured result to a map in place of running the step again.
+    Stages with cache set to False always run, which suits steps that are cheap or that only build objects.
+
+    Settings_read lists the names of the settings the step depends on, a name ending in an underscore stands for every
+    setting that starts with it."""
+    def __init__(self, name, run, capture=None, restore=None, depends_on=(), settings_read=(), cache=True):
+        self.name = name
+        self.run = run
+        self.capture = capture
+        self.restore = restore
+        self.depends_on = depends_on
+        self.settings_read = settings_read
+        self.cache = cache and capture is not None and restore is not None
+
+    def get_key(self, settings, dependency_keys):
+        """Returns a hash of everything this stage's output depends on."""
+        values = []
+        for each_name in self.settings_read:
+            if each_name.endswith('_'):
+                for setting_name in sorted(vars(settings)):
+                    if setting_name.startswith(each_name):
+                        values.append((setting_name, repr(getattr(settings, setting_name))))
+            else:
+                values.append((each_name, repr(getattr(settings, each_name))))
+
+        key_source = repr((PIPELINE_VERSION, self.name, values, dependency_keys))
+        return hashlib.sha1(key_source.encode()).hexdigest()
+
+
+class Pipeline:
+    """A dependency graph of generation stages. Each stage is keyed by its inputs, so when a setting changes only the
+    stages that read it and the stages downstream of them are run again, the rest are restored from the cache."""
+    def __init__(self, cache=None):
+        self.stages = OrderedDict()
+        self.cache = cache
+        self.keys = {}
+
+    def add(self, stage):
+        """Adds a stage to the pipeline, its dependencies must already have been added."""
+        for each_name in stage.depends_on:
+            if each_name not in self.stages:
+                raise ValueError(f"Stage '{stage.name}' depends on '{each_name}', which is not in the pipeline.")
+        self.stages[stage.name] = stage
+
+    def run(self, k_map):
+        """Runs each stage on the map in order, restoring the output of any stage whose key is already cached.
+        Returns a list of the names of the stages that actually ran."""
+        dbprint = k_map.settings.db_print
+        ran = []
+        self.keys.clear()
+
+        for each_stage in self.stages.values():
+            dependency_keys = [self.keys[each_name] for each_name in each_stage.depends_on]
+            key = each_stage.get_key(k_map.settings, dependency_keys)
+            self.keys[each_stage.name] = key
+
+            output = None
+            if each_stage.cache and self.cache is not None:
+                output = self.cache.get(key)
+
+            if output is not None:
+                dbprint(f"Restoring stage '{each_stage.name}' from the cache...", detail=2)
+                each_stage.restore(k_map, output)
+            else:
+                # Seed from the key, so a stage's output never depends on whether the stages before it were cached
+                seed = int(key[:8], 16)
+                numpy.random.seed(seed)
+                random.seed(seed)
+
+                each_stage.run(k_map)
+                ran.append(each_stage.name)
+                if each_stage.cache and self.cache is not None:
+                    self.cache.put(key, each_stage.capture(k_map))
+
+        return ran
+
+
+class StageCache:
+    """Stores stage outputs by key, in memory and optionally on disk. Both stores are bounded in bytes and evict their
+    least recently used entries first."""
+    def __init__(self, max_memory_bytes, directory=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()   # Key : pickled output, ordered from least to most recently used
+        self.memory_bytes = 0
+
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        """Returns the output stored under key, or None if it has not been cached."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return pickle.loads(self.memory[key])
+
+        if self.directory is not None:
+            path = self.get_path(key)
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    data = file.read()
+                # Touch the file so the disk eviction sees it as recently used
+                os.utime(path)
+                self.put_in_memory(key, data)
+                return pickle.loads(data)
+
+        return None
+
+    def get_path(self, key):
+        """Returns the path of the file that stores the given key on disk."""
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def put(self, key, output):
+        """Stores the output under key in memory and on disk, evicting old entries to stay within bounds."""
+        data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+        self.put_in_memory(key, data)
+
+        if self.directory is not None and len(data) <= self.max_disk_bytes:
+            with open(self.get_path(key), 'wb') as file:
+                file.write(data)
+            self.evict_disk()
+
+    def put_in_memory(self, key, data):
+        """Stores pickled data in the memory cache, evicting the least recently used entries to make room."""
+        if len(data) > self.max_memory_bytes:
+            return
+
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+
+        while self.memory_bytes > self.max_memory_bytes:
+            old_key, old_data = self.memory.popitem(last=False)
+            self.memory_bytes -= len(old_data)
+
+    def evict_disk(self):
+        """Deletes the least recently used files from the disk cache until it fits within max_disk_bytes."""
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.pkl'):
+                path = os.path.join(self.directory, file_name)
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+
+        total_bytes = sum(entry[1] for entry in entries)
+        for modified, size, path in sorted(entries):
+            if total_bytes <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
+
+    def clear(self):
+        """Empties the memory cache, files on disk are left for eviction to clean up."""
+        self.memory.clear()
+        self.memory_bytes = 0
@@ -0,0 +1,93 @@
+import copy
+import sys
+
+import numpy
+
+from fields import CELL_FIELDS, VERTEX_FIELDS
+from khaos_map import KhaosMap
+from settings import Settings
+
+
+def get_field_drift(reference, values):
+    """Returns the RMS and largest absolute difference between two arrays of a field, and the RMS difference
+    relative to the RMS of the reference."""
+    reference = numpy.asarray(reference, dtype=float)
+    difference = numpy.asarray(values, dtype=float) - reference
+    rms = float(numpy.sqrt(numpy.mean(difference ** 2)))
+    scale = float(numpy.sqrt(numpy.mean(reference ** 2)))
+    return {'rms': rms, 'max': float(numpy.max(numpy.abs(difference))), 'relative': rms / scale if scale else 0.0}
+
+
+def get_map_drift(reference_map, compact_map):
+    """Returns a dictionary of field name : drift of every stored field of the compact map against the reference."""
+    drift = {}
+    for name in CELL_FIELDS:
+        drift[f"cell {name}"] = get_field_drift(reference_map.fields.get_cell_field(name),
+                                                compact_map.fields.get_cell_field(name))
+    for name in VERTEX_FIELDS:
+        drift[f"vertex {name}"] = get_field_drift(reference_map.fields.get_vertex_field(name),
+                                                  compact_map.fields.get_vertex_field(name))
+    return drift
+
+
+def copy_map_state(source_map, target_map):
+    """Gives the target map the terrain and the simulated state of the source map, scheduler counters included, so the
+    two carry on from the same point whatever precision or cache state each was built with. Both maps must have been
+    built from the same voronoi diagram."""
+    for target_cell, source_cell in zip(target_map.cells, source_map.cells):
+        target_cell.wind_deflection = copy.copy(source_cell.wind_deflection)
+    target_map.set_simulation_state(copy.deepcopy(source_map.get_simulation_state()))
+
+
+def measure_drift(years=1, settings=None):
+    """Simulates the same map in float64 and in float32 side by side for a number of years, measuring how far the
+    float32 fields have drifted from the float64 ones at the end of each year. The float32 map is given the state of
+    the float64 map before the first tick, see copy_map_state, so the drift is only that of the precision. Returns
+    the memory report of each map and a list of the drift of each year, see get_map_drift."""
+    if settings is None:
+        settings = Settings()
+
+    maps = {}
+    for precision in ('float64', 'float32'):
+        map_settings = copy.copy(settings)
+        map_settings.field_precision = precision
+        maps[precision] = KhaosMap(map_settings)
+    copy_map_state(maps['float64'], maps['float32'])
+
+    drift = []
+    for year in range(years):
+        for tick in range(settings.season_ticks_per_year):
+            for each_map in maps.values():
+                each_map.update_atmosphere()
+        drift.append(get_map_drift(maps['float64'], maps['float32']))
+        settings.db_print(f"Measured the drift of year {year + 1} of {years}.", detail=2)
+
+    memory = {precision: each_map.fields.get_memory_report() for precision, each_map in maps.items()}
+    return memory, drift
+
+
+def write_drift_report(memory, drift, cell_count):
+    """Returns the results of measure_drift as printable lines, with the memory scaled to 100k cells."""
+    lines = ["Memory per 100k cells:"]
+    for precision, report in memory.items():
+        parts = ', '.join(f"{name} {size * 100000 / cell_count / 2 ** 20:.1f}MB" for name, size in report.items())
+        lines.append(f"  {precision}: {parts}")
+
+    lines.append("Drift of float32 against float64 (RMS, largest, RMS relative to the field):")
+    for year, year_drift in enumerate(drift):
+        lines.append(f"  Year {year + 1}")
+        for name, field_drift in year_drift.items():
+            lines.append(f"    {name:<26}{field_drift['rms']:>12.4g}{field_drift['max']:>12.4g}"
+                         f"{field_drift['relative']:>12.3%}")
+    return lines
+
+
+if __name__ == "__main__":
+    # Usage: python precision.py [years] [total_cells]
+    drift_settings = Settings()
+    drift_years = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    if len(sys.argv) > 2:
+        drift_settings.total_cells = int(sys.argv[2])
+
+    drift_memory, year_drifts = measure_drift(drift_years, drift_settings)
+    print('\n'.join(write_drift_report(drift_memory, year_drifts, drift_settings.total_cells)))
@@ -0,0 +1,54 @@
+import pygame
+
+from render import Renderable
+
+
+class LabelMap(Renderable):
+    """Draws the map as a single image instead of one polygon per cell. The visible cells are rasterized into an image
+    of cell labels whenever the view changes, and each label is then turned into a color with one lookup into a
+    table of cell colors from Overlays. Changing the colors of the map or the overlay only swaps the table, and drawing
+    a frame does not depend on the number of cells at all.
+
+    Label 0 is the area outside of every cell, cell n of the map has the label n + 1."""
+    def __init__(self, k_map, viewport, overlays):
+        super().__init__()
+
+        self.map = k_map
+        self.viewport = viewport
+        self.overlays = overlays
+        self.settings = k_map.settings
+
+        # Labels are drawn as mapped colors on a 32 bit surface, so each pixel holds its cell's label as an integer
+        self.label_surface = pygame.Surface(self.settings.screen_size, 0, 32)
+        self.labels = None
+        self.label_version = None
+
+        self.table_version = None
+
+        self.image = pygame.Surface(self.settings.screen_size)
+        self.is_image_stale = True
+
+    def find_labels(self):
+        """Rasterizes the visible cells into the label image, using the polygons projected by the viewport."""
+        self.label_surface.fill(0)
+        for each_cell in self.viewport.visible_cells:
+            pygame.draw.polygon(self.label_surface, self.viewport.cell_numbers[each_cell] + 1, each_cell.polygon, 0)
+
+        self.labels = pygame.surfarray.array2d(self.label_surface)
+        self.label_version = self.viewport.version
+        self.is_image_stale = True
+
+    def update(self, renderer):
+        """Draws the map image, looking up the colors of the labels again only if the labels or the table changed."""
+        if self.label_version != self.viewport.version:
+            self.find_labels()
+        color_table = self.overlays.get_color_table()
+        if self.table_version != self.overlays.version:
+            self.table_version = self.overlays.version
+            self.is_image_stale = True
+
+        if self.is_image_stale:
+            pygame.surfarray.blit_array(self.image, color_table[self.labels])
+            self.is_image_stale = False
+
+        renderer.screen.blit(self.image, (0, 0))
@@ -1,6 +1,3 @@
-import pygame.draw
-from scipy import ndimage
-
 class RenderQ:
     """This class contains and manages a list of Renderable objects, including their calls to .update(),
     simplifying the rendering pipline."""
@@ -28,6 +25,7 @@ class RenderQ:
 
         # Apply AA
         if self.AA:
+            import pygame.transform
             aa = pygame.transform.smoothscale(self.screen, self.settings.window_size)
             self.aa_screen.blit(aa, (0, 0))
 
@@ -47,6 +45,11 @@ class RenderQ:
             else:
                 self.queue.append(renderable)
 
+    def set_queue(self, renderables):
+        """Replaces the whole queue with the given renderables, in order. Used when the view changes, as calling add
+        for each renderable would check the queue every time."""
+        self.queue = list(renderables)
+
     def remove(self, renderable):
         """Removes the given object from the queue. Will return True or False depending on whether the object was
         found in the first place."""
@@ -60,6 +63,9 @@ class RenderQ:
 class Renderable:
     """The Superclass for my renderable objects, which allows me to call TypeErrors if I try to add the wrong
     object to a RenderQ. All Renderable sub-classes will have individually defined .update() functions."""
+    # Empty, so that the map's Cells and Vertices can leave out the per-object __dict__
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -78,6 +84,7 @@ class RenderBox(Renderable):
         self.outline_width = 0
 
     def update(self, renderer):
+        import pygame.draw
         pygame.draw.rect(renderer.screen, self.color, self.rect, self.outline_width)
 
     def is_point_in(self, point):
@@ -0,0 +1,101 @@
+import numpy
+
+from fields import VERTEX_FIELDS
+
+
+class RidgeEngine:
+    """Raises forking mountain ridges over the vertex arrays of a map's FieldStore. A ridge starts at a peak and
+    climbs outward, each step raising the tallest neighbor it has not yet visited toward the altitude of the vertex it
+    came from, and forking into the two tallest at settings.mtn_fork_chance. A ridge stops once it has spent
+    settings.mtn_max_node_chain nodes or run out of unvisited neighbors.
+
+    All of the ridges grow together in one frontier, a step of every ridge at a time. Each ridge keeps its visited
+    vertices in a set of vertex numbers, so every step costs the degree of its vertex and a whole ridge costs its
+    length. Within a ridge the steps are taken in the same order as a breadth first walk from its peak, ridges that
+    cross see each other's altitudes a step at a time."""
+    def __init__(self, k_map):
+        self.map = k_map
+        self.settings = k_map.settings
+
+        starts, indices = k_map.fields.adjacency['vertex_neighbors'][:2]
+        self.starts = starts
+        self.indices = indices
+        self.neighbors = [indices[starts[vertex]:starts[vertex + 1]].tolist() for vertex in range(len(starts) - 1)]
+
+    def find_peaks(self):
+        """Returns a boolean array over the vertices, True where no neighbor is higher than the vertex, and sets
+        is_peak on every vertex to match."""
+        altitudes = self.map.fields.get_vertex_field('altitude')
+        starts = self.starts[:-1]   # alias
+
+        # The highest neighbor of each vertex, vertices without neighbors have nothing above them
+        highest = numpy.full(len(altitudes), -numpy.inf)
+        has_neighbors = self.starts[1:] > starts
+        if has_neighbors.any():
+            highest[has_neighbors] = numpy.maximum.reduceat(altitudes[self.indices], starts[has_neighbors])
+        peaks = altitudes >= highest
+
+        for each_vertex, is_peak in zip(self.map.vertices, peaks.tolist()):
+            each_vertex.is_peak = is_peak
+        return peaks
+
+    def grow(self, number_of_ridges):
+        """Raises number_of_ridges ridges from peaks chosen at random, returning the list of the vertex numbers of
+        each ridge in the order they were raised."""
+        stg = self.settings  # alias
+        peaks = numpy.flatnonzero(self.find_peaks())
+        if len(peaks) == 0 or number_of_ridges <= 0:
+            return []
+
+        # The altitudes are worked on as a list of floats and written back once the ridges are done
+        row = VERTEX_FIELDS.index('altitude')
+        altitudes = self.map.fields.vertex_array[row].tolist()
+        neighbors = self.neighbors  # alias
+        weight = stg.mtn_peak_weight
+        neighbor_weight = abs(stg.mtn_peak_weight - 1.0)
+
+        # Each ridge starts at a random peak, raised to the maximum less a factor unless it is already higher
+        ridge_peaks = peaks[numpy.random.randint(len(peaks), size=number_of_ridges)].tolist()
+        peak_altitudes = (1.0 - numpy.random.random(number_of_ridges) * stg.mtn_peak_reduction_factor).tolist()
+        for peak, peak_altitude in zip(ridge_peaks, peak_altitudes):
+            if altitudes[peak] < peak_altitude:
+                altitudes[peak] = peak_altitude
+
+        ridges = [[peak] for peak in ridge_peaks]
+        visited = [{peak} for peak in ridge_peaks]
+        spent = [0] * number_of_ridges
+        frontier = list(enumerate(ridge_peaks))   # (ridge, vertex) of every step to take, ridge by ridge in order
+
+        while frontier:
+            forks = (numpy.random.random(len(frontier)) < stg.mtn_fork_chance).tolist()
+            next_frontier = []
+
+            for (ridge, vertex), is_fork in zip(frontier, forks):
+                # A ridge takes its last step once it has gone past its nodes
+                if spent[ridge] > stg.mtn_max_node_chain:
+                    continue
+                ridge_visited = visited[ridge]  # alias
+
+                for branch in range(2 if is_fork else 1):
+                    tallest = None
+                    tallest_altitude = -0.1
+                    for each_neighbor in neighbors[vertex]:
+                        if each_neighbor not in ridge_visited and altitudes[each_neighbor] > tallest_altitude:
+                            tallest = each_neighbor
+                            tallest_altitude = altitudes[each_neighbor]
+
+                    # Average the tallest neighbor toward the altitude of this vertex, and step to it next
+                    if tallest is not None:
+                        altitudes[tallest] = altitudes[vertex] * weight + tallest_altitude * neighbor_weight
+                        ridge_visited.add(tallest)
+                        ridges[ridge].append(tallest)
+                        next_frontier.append((ridge, tallest))
+
+                spent[ridge] += 2 if is_fork else 1
+
+            frontier = next_frontier
+
+        self.map.fields.vertex_array[row] = altitudes
+        self.settings.db_print(f"Raised {number_of_ridges} ridges of {sum(len(ridge) for ridge in ridges)} vertices "
+                               f"from {len(peaks)} peaks.", detail=3)
+        return ridges
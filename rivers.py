@@ -0,0 +1,168 @@
+import numpy
+
+from render import Renderable
+
+
+class River:
+    """A single polyline of the river network, a run of vertices that flow into one another with the same width and
+    stream order. A river ends at a confluence, at the sea, or wherever its width or order changes."""
+    def __init__(self, vertices, width, order):
+        self.vertices = vertices
+        self.width = width
+        self.order = order
+
+        xs = [vertex.x for vertex in vertices]
+        ys = [vertex.y for vertex in vertices]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+
+class RiverNetwork(Renderable):
+    """The drainage network of the map, found by following each land vertex to its lowest_neighbor. The network is
+    rebuilt when the terrain or the season changes rather than every frame, and records for every draining vertex
+    the Strahler order and the accumulation (the number of vertices that drain through it, itself included) of the
+    stream leaving it. Rivers that are wide enough to render are chained into polylines, whose projected points are
+    kept until the view changes."""
+    def __init__(self, k_map):
+        super().__init__()
+
+        self.map = k_map
+        self.settings = k_map.settings
+
+        self.downstream = {}    # Vertex : the vertex it drains into
+        self.upstream = {}      # Vertex : list of the vertices that drain into it
+        self.order = {}         # Vertex : Strahler order of the stream leaving the vertex
+        self.accumulation = {}  # Vertex : number of vertices that drain through the vertex
+        self.rivers = []
+        self.version = 0
+
+        self.projected = []   # Screen space points of each river, in the same order as self.rivers
+        self.projection_state = None
+
+        self.rebuild()
+
+    def rebuild(self):
+        """Finds the drainage graph, the stream orders and the river polylines from the current terrain and flow."""
+        sea_level = self.settings.wtr_sea_level
+        self.downstream.clear()
+        self.upstream.clear()
+        for each_vertex in self.map.vertices:
+            if each_vertex.lowest_neighbor and each_vertex.altitude > sea_level:
+                self.downstream[each_vertex] = each_vertex.lowest_neighbor
+                self.upstream.setdefault(each_vertex.lowest_neighbor, []).append(each_vertex)
+
+        self.find_orders()
+        self.find_rivers()
+        self.version += 1
+
+        self.settings.db_print(f"River network rebuilt, {len(self.rivers)} rivers drawn from "
+                               f"{len(self.downstream)} draining vertices.", detail=3)
+
+    def find_orders(self):
+        """Walks the drainage graph from its sources downstream, finding the Strahler order and accumulation of each
+        vertex once everything upstream of it is known. Vertices caught in flat loops, which have no source, keep
+        an order of 1."""
+        self.order.clear()
+        self.accumulation.clear()
+
+        remaining = {vertex: len(self.upstream.get(vertex, ())) for vertex in self.downstream}
+        ready = [vertex for vertex, count in remaining.items() if count == 0]
+        while ready:
+            each_vertex = ready.pop()
+
+            # A stream's order rises when two streams of the highest order upstream of it meet
+            upstream_orders = [self.order[vertex] for vertex in self.upstream.get(each_vertex, ())]
+            if not upstream_orders:
+                order = 1
+            else:
+                order = max(upstream_orders)
+                if upstream_orders.count(order) > 1:
+                    order += 1
+            self.order[each_vertex] = order
+            self.accumulation[each_vertex] = 1 + sum(self.accumulation[vertex]
+                                                     for vertex in self.upstream.get(each_vertex, ()))
+
+            next_vertex = self.downstream[each_vertex]
+            if next_vertex in remaining:
+                remaining[next_vertex] -= 1
+                if remaining[next_vertex] == 0:
+                    ready.append(next_vertex)
+
+        for each_vertex in self.downstream:
+            if each_vertex not in self.order:
+                self.order[each_vertex] = 1
+                self.accumulation[each_vertex] = 1
+
+    def find_rivers(self):
+        """Chains the renderable streams into polylines. A polyline continues through a vertex only if exactly one
+        renderable stream enters it and the stream leaving it has the same width and order."""
+        widths = {}
+        for each_vertex in self.downstream:
+            width = each_vertex.get_river_width(self.settings)
+            if width > 0:
+                widths[each_vertex] = width
+
+        def get_style(vertex):
+            return widths[vertex], self.order[vertex]
+
+        def continues(vertex):
+            drawn_upstream = [each for each in self.upstream.get(vertex, ()) if each in widths]
+            return len(drawn_upstream) == 1 and get_style(drawn_upstream[0]) == get_style(vertex)
+
+        self.rivers = []
+        chained = set()
+        for each_vertex in widths:
+            if continues(each_vertex):
+                continue
+
+            vertices = [each_vertex]
+            current = each_vertex
+            while True:
+                chained.add(current)
+                next_vertex = self.downstream[current]
+                vertices.append(next_vertex)
+                if next_vertex not in widths or not continues(next_vertex) or next_vertex in chained:
+                    break
+                current = next_vertex
+            self.rivers.append(River(vertices, *get_style(each_vertex)))
+
+        # Streams in loops have no start, draw each as its own segment
+        for each_vertex in widths:
+            if each_vertex not in chained:
+                self.rivers.append(River([each_vertex, self.downstream[each_vertex]], *get_style(each_vertex)))
+
+    def get_rivers_in(self, bbox):
+        """Returns the indices of the rivers whose bounding boxes overlap the bounding box."""
+        left, top, right, bottom = bbox
+        return [index for index, river in enumerate(self.rivers) if river.bbox[0] <= right and river.bbox[2] >= left
+                and river.bbox[1] <= bottom and river.bbox[3] >= top]
+
+    def project(self):
+        """Projects the points of every river to the screen in one batch."""
+        xs = numpy.array([vertex.x for river in self.rivers for vertex in river.vertices])
+        ys = numpy.array([vertex.y for river in self.rivers for vertex in river.vertices])
+        ss_xs, ss_ys = self.settings.project_to_screen(xs, ys)
+        points = list(zip(ss_xs.tolist(), ss_ys.tolist()))
+
+        self.projected = []
+        start = 0
+        for each_river in self.rivers:
+            self.projected.append(points[start:start + len(each_river.vertices)])
+            start += len(each_river.vertices)
+
+    def update(self, renderer):
+        """Draws the rivers on screen, projecting them again first if the view or the network has changed."""
+        import pygame.draw
+
+        if not self.settings.do_render_rivers:
+            return
+
+        projection_state = (self.version, self.settings.view_center, self.settings.view_zoom)
+        if projection_state != self.projection_state:
+            self.projection_state = projection_state
+            self.project()
+
+        left, top = self.settings.project_from_screen(0, 0)
+        right, bottom = self.settings.project_from_screen(*self.settings.screen_size)
+        for index in self.get_rivers_in((left, top, right, bottom)):
+            pygame.draw.lines(renderer.screen, self.settings.clr['river'], False, self.projected[index],
+                              self.rivers[index].width)
@@ -0,0 +1,189 @@
+import heapq
+import math
+
+import numpy
+
+from cells import Path
+
+
+class CostLayer:
+    """A single term of the cost of travelling along an edge of the cell graph. Get_costs returns an array with one
+    cost per edge of the planner, in the order of its adjacency, which is scaled by weight and added on top of the
+    edge's length as a share of it. Costs below zero are raised to zero, so no layer can make a step cheaper than its
+    length."""
+    def __init__(self, name, get_costs, weight=1.0):
+        self.name = name
+        self.get_costs = get_costs
+        self.weight = weight
+
+
+class RoutePlanner:
+    """Plans the cheapest routes between cells over the cell graph with A*. An edge costs its length times one plus
+    the weighted sum of the cost layers, which by default charge for the slope climbed, for entering the sea or a
+    river and for the biome entered. The lengths are the FieldStore adjacency weights, sqrt(|dx| + |dy|) as
+    cells.get_distance measures it. As every step costs at least its length, and the square root of a sum is never
+    more than the sum of the square roots, the same distance taken straight to the goal never overestimates the rest
+    of a route and A* returns the cheapest one.
+
+    The edge costs are built in one batch from the layers and rebuilt when the map's color_version changes, which
+    happens whenever the terrain, the sea level or the biomes do, or when hydrology changes the water flow the river
+    layer reads. Searches reuse the same scores and parents lists, marking the entries of each search with its own
+    number instead of clearing them, so a short route only costs the cells it visits. Find_routes answers a batch of routes, and routes that share a start share a single search."""
+    def __init__(self, k_map, layers=None):
+        self.map = k_map
+        self.settings = k_map.settings
+        self.layers = get_default_layers(self.settings) if layers is None else list(layers)
+
+        fields = k_map.fields  # alias
+        starts, indices, weights = fields.adjacency['cell_neighbors']
+        self.starts = starts
+        self.indices = indices
+        self.owners = numpy.repeat(numpy.arange(len(k_map.cells)), numpy.diff(starts))
+        self.lengths = weights.astype(float)
+
+        self.xs = fields.cell_points[:, 0].tolist()
+        self.ys = fields.cell_points[:, 1].tolist()
+        self.neighbors = [indices[starts[cell]:starts[cell + 1]].tolist() for cell in range(len(k_map.cells))]
+        self.costs = None          # The cost of each neighbor of each cell, in the same layout as self.neighbors
+        self.costs_state = None    # The color_version and water_flow_rate version the costs were built from
+
+        # Search state, an entry is only valid if its stamp is the number of the current search
+        self.scores = [0.0] * len(k_map.cells)
+        self.parents = [-1] * len(k_map.cells)
+        self.stamps = [0] * len(k_map.cells)
+        self.search_number = 0
+
+    def add_layer(self, layer):
+        """Adds a cost layer, the edge costs are rebuilt before the next route."""
+        self.layers.append(layer)
+        self.costs = None
+
+    def get_edge_costs(self):
+        """Returns an array of the cost of every edge, its length scaled up by the weighted cost layers."""
+        scale = numpy.ones(len(self.indices))
+        for each_layer in self.layers:
+            if each_layer.weight:
+                layer_costs = numpy.asarray(each_layer.get_costs(self.map, self), dtype=float)
+                scale += each_layer.weight * numpy.maximum(layer_costs, 0.0)
+        return self.lengths * scale
+
+    def refresh(self):
+        """Rebuilds the edge costs if the map has changed since they were built."""
+        costs_state = (self.map.color_version, self.map.field_versions['water_flow_rate'])
+        if self.costs is not None and self.costs_state == costs_state:
+            return
+
+        edge_costs = self.get_edge_costs()
+        self.costs = [edge_costs[self.starts[cell]:self.starts[cell + 1]].tolist() for cell in range(len(self.xs))]
+        self.costs_state = costs_state
+        self.settings.db_print(f"Built the route costs from {len(self.layers)} layers.", detail=4)
+
+    def search(self, start, goals):
+        """Searches outward from start until every goal has been reached, with the distance to the goal as the
+        heuristic when there is only one. Fills the scores and parents of the visited cells for this search."""
+        self.refresh()
+        self.search_number += 1
+        number = self.search_number  # alias
+        scores, parents, stamps = self.scores, self.parents, self.stamps  # alias
+        neighbors, costs, xs, ys = self.neighbors, self.costs, self.xs, self.ys  # alias
+        sqrt = math.sqrt  # alias
+
+        remaining = set(goals)
+        goal_x, goal_y = (xs[goals[0]], ys[goals[0]]) if len(remaining) == 1 else (None, None)
+
+        scores[start] = 0.0
+        parents[start] = -1
+        stamps[start] = number
+        heap = [(0.0, 0.0, start)]
+        while heap and remaining:
+            estimate, score, cell = heapq.heappop(heap)
+            if score > scores[cell]:
+                continue
+            remaining.discard(cell)
+
+            for neighbor, cost in zip(neighbors[cell], costs[cell]):
+                new_score = score + cost
+                if stamps[neighbor] != number or new_score < scores[neighbor]:
+                    scores[neighbor] = new_score
+                    parents[neighbor] = cell
+                    stamps[neighbor] = number
+                    if goal_x is None:
+                        heapq.heappush(heap, (new_score, new_score, neighbor))
+                    else:
+                        heapq.heappush(heap, (new_score + sqrt(abs(xs[neighbor] - goal_x) + abs(ys[neighbor] - goal_y)),
+                                              new_score, neighbor))
+
+    def get_found_route(self, goal):
+        """Returns the (cell numbers, cost) of the route to the goal found by the last search, or (None, inf) if the
+        goal could not be reached."""
+        if self.stamps[goal] != self.search_number:
+            return None, math.inf
+
+        route = [goal]
+        while self.parents[route[-1]] != -1:
+            route.append(self.parents[route[-1]])
+        route.reverse()
+        return route, self.scores[goal]
+
+    def find_route(self, start, goal):
+        """Returns the cheapest route from the start cell to the goal cell, both given by their numbers, as a list of
+        the cell numbers along it and its cost. Returns (None, inf) if the goal cannot be reached."""
+        self.search(start, [goal])
+        return self.get_found_route(goal)
+
+    def find_routes(self, pairs):
+        """Returns the cheapest route of each (start, goal) pair, see find_route, in the same order as pairs. Pairs
+        with the same start are answered by one search that runs until all of their goals are reached."""
+        goals_by_start = {}
+        for start, goal in pairs:
+            goals_by_start.setdefault(start, []).append(goal)
+
+        found = {}
+        for start, goals in goals_by_start.items():
+            self.search(start, goals)
+            for goal in goals:
+                found[(start, goal)] = self.get_found_route(goal)
+
+        return [found[pair] for pair in pairs]
+
+    def get_path(self, route):
+        """Returns a Path of the Cell objects along a route of cell numbers."""
+        path = Path(self.map.cells[route[0]])
+        for number in route[1:]:
+            path.add_next(self.map.cells[number])
+        return path
+
+
+def get_slope_costs(k_map, planner):
+    """Returns the rise over run of every edge."""
+    altitudes = k_map.fields.get_cell_field('altitude')
+    return numpy.abs(altitudes[planner.indices] - altitudes[planner.owners]) / numpy.maximum(planner.lengths, 1e-9)
+
+
+def get_sea_costs(k_map, planner):
+    """Returns 1 for every edge into a cell at or below sea level."""
+    altitudes = k_map.fields.get_cell_field('altitude')
+    return (altitudes[planner.indices] <= k_map.settings.wtr_sea_level).astype(float)
+
+
+def get_river_costs(k_map, planner):
+    """Returns 1 for every edge into a cell that a river runs through."""
+    is_river = k_map.fields.get_vertex_field('water_flow_rate') > k_map.settings.wtr_min_flow_to_render
+    return k_map.distances.get_cell_mask(is_river)[planner.indices].astype(float)
+
+
+def get_biome_costs(k_map, planner):
+    """Returns the sum of settings.route_biome_tag_costs over the biome tags of the cell at the end of every edge,
+    cells without a biome cost nothing."""
+    tag_costs = k_map.settings.route_biome_tag_costs  # alias
+    cell_costs = numpy.array([sum(tag_costs.get(tag, 0.0) for tag in cell.biome.biome_tags) if cell.biome else 0.0
+                              for cell in k_map.cells])
+    return cell_costs[planner.indices]
+
+
+def get_default_layers(settings):
+    """Returns the cost layers the route planner uses unless it is given its own."""
+    return [CostLayer('slope', get_slope_costs, settings.route_slope_weight),
+            CostLayer('sea', get_sea_costs, settings.route_sea_weight),
+            CostLayer('rivers', get_river_costs, settings.route_river_weight),
+            CostLayer('biome', get_biome_costs, 1.0)]
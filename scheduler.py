@@ -0,0 +1,65 @@
+class Scheduler:
+    """Runs each of the map's subsystems at its own rate. Rates are measured in atmosphere ticks, so a rate of 5 runs
+    the subsystem once every fifth tick. Each update is passed the number of ticks that have elapsed since it last
+    ran, letting slow subsystems account for the forcing that accumulated in between."""
+    def __init__(self):
+        self.tasks = []
+        self.ticks = 0
+
+    def add(self, label, rate, update):
+        """Adds a subsystem to the scheduler. Update is called as update(elapsed_ticks) whenever the subsystem is due.
+        Subsystems run in the order they were added."""
+        self.tasks.append(ScheduledTask(label, rate, update))
+
+    def get_task(self, label):
+        """Returns the task with the given label, or None if no such task has been added."""
+        for each_task in self.tasks:
+            if each_task.label == label:
+                return each_task
+        return None
+
+    def set_rate(self, label, rate):
+        """Changes the rate of the labeled subsystem, a rate of 0 or lower disables it."""
+        self.get_task(label).rate = rate
+
+    def get_state(self):
+        """Returns the tick count and the ticks waiting on each subsystem as plain data, see set_state."""
+        return {'ticks': self.ticks, 'elapsed': [(each_task.label, each_task.elapsed) for each_task in self.tasks]}
+
+    def set_state(self, state):
+        """Restores a state produced by get_state, so every subsystem next runs on the same tick it would have.
+        Subsystems that are not in the state start with no ticks waiting."""
+        self.ticks = state['ticks']
+        elapsed = dict(state['elapsed'])
+        for each_task in self.tasks:
+            each_task.elapsed = elapsed.get(each_task.label, 0)
+
+    def flush(self):
+        """Runs every subsystem that has ticks waiting on it, regardless of its rate."""
+        for each_task in self.tasks:
+            if each_task.elapsed > 0 and each_task.rate > 0:
+                each_task.run()
+
+    def tick(self):
+        """Advances the scheduler by a single tick, running every subsystem that is due."""
+        self.ticks += 1
+
+        for each_task in self.tasks:
+            each_task.elapsed += 1
+            if 0 < each_task.rate <= each_task.elapsed:
+                each_task.run()
+
+
+class ScheduledTask:
+    """A single subsystem on the Scheduler."""
+    def __init__(self, label, rate, update):
+        self.label = label
+        self.rate = rate
+        self.update = update
+        self.elapsed = 0
+
+    def run(self):
+        """Calls the update with the ticks elapsed since it last ran, then resets the count."""
+        elapsed = self.elapsed
+        self.elapsed = 0
+        self.update(elapsed)
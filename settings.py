@@ -1,7 +1,5 @@
 import math
 
-from pygame.math import Vector2
-import pygame
 import numpy.random
 import random
 
@@ -20,6 +18,46 @@ class Settings:
         self.debug_console = True
         self.debug_detail = 2       # All debug console calls with a LESSER debug detail will show. Range of (1-5)
 
+        # Field settings, 'float32' stores the simulated fields and the adjacency arrays at half the memory of
+        # 'float64', see precision.py for the drift this causes
+        self.field_precision = 'float64'
+
+        # Distance field settings
+        self.dist_cache_fields = 16  # The number of distance fields kept by the map's DistanceFields, see get_field
+
+        # Route settings, each weight scales its cost layer on top of the length of a step, see routes.py
+        self.route_slope_weight = 14.0  # The cost of climbing or descending, per unit of rise over run, with the run
+                                        # measured by the adjacency weights
+        self.route_sea_weight = 10.0    # The cost of a step into a cell at or below sea level
+        self.route_river_weight = 2.0   # The cost of a step into a cell with a river, for crossing it
+        self.route_biome_tag_costs = {'forested': 0.5, 'damp': 0.5, 'alpine': 1.0, 'frozen': 1.0}
+
+        # Settlement settings, see settlements.py
+        self.settl_min_spacing = 0.05  # The least distance between two settlements, in map units
+        self.settl_min_habitability = 0.2  # Cells less habitable than this are never settled
+        self.settl_ideal_temperature = 65.0  # The most habitable temperature
+        self.settl_temperature_range = 30.0  # How far from the ideal temperature habitability falls to about a third
+        self.settl_rainfall_half = 20.0  # The annual rainfall that scores half of the rainfall score
+        self.settl_river_reach = 0.175  # The distance from a river at which the river score falls to about a third,
+                                        # measured along the map's adjacency weights like every DistanceFields field
+        self.settl_coast_reach = 0.35  # The distance from the sea at which the coast score falls to about a third
+        self.settl_temperature_weight = 1.0  # The weight of each score in the habitability of a cell
+        self.settl_rainfall_weight = 1.0
+        self.settl_river_weight = 1.5
+        self.settl_coast_weight = 1.0
+        self.settl_biome_tag_scores = {'plain': 0.2, 'forested': 0.1, 'arid': -0.6, 'alpine': -0.6, 'frozen': -0.8,
+                                       'cold': -0.3, 'hot': -0.2, 'heavy rain': -0.1}
+        self.settl_capacity = 10000.0  # The population a perfectly habitable cell can support
+        self.settl_founding_share = 0.01  # The share of its capacity a new settlement starts with
+        self.settl_growth_rate = 0.1  # The share a settlement grows by each season while it is far below its capacity
+        self.settl_decline = 0.2  # The largest share of its population a settlement can lose in a season
+
+        # Generation cache settings
+        self.cache_enable = True    # Whether generation stages are cached, so unchanged stages are not run again
+        self.cache_dir = 'cache'    # The directory stage outputs are saved to, None keeps the cache in memory only
+        self.cache_memory_mb = 256  # The most memory the stage cache may use before evicting old outputs
+        self.cache_disk_mb = 1024   # The most disk space the stage cache may use before deleting old outputs
+
         # Pygame settings
         self.enableAA = True
         self.window_size = (1800, 1000)
@@ -37,24 +75,63 @@ class Settings:
         self.do_render_rainfall = False
         self.do_render_coastlines = True
 
+        # View settings, the view center is in map coordinates and a zoom of 1.0 fits the whole map to the screen
+        self.view_center = (0.0, 0.0)
+        self.view_zoom = 1.0
+        self.view_zoom_step = 1.25  # The multiplier applied to the zoom for each zoom input
+        self.view_zoom_max = 64.0  # The closest the view can zoom in
+        self.view_pan_step = 0.1  # The distance panned for each pan input, as a portion of the visible width
+
+        # Raster settings, the label map draws the cells as one image with a color looked up for each pixel from the
+        # terrain or from an overlay layer
+        self.raster_enable = True
+        self.render_overlay = None  # The name of the overlay layer drawn over the cells, None draws the terrain
+
+        # Export settings, exported images cover the same area as the unzoomed view at any resolution
+        self.export_path = 'khaos_map.png'
+        self.export_size = (8192, 4551)  # The width and height in pixels of an exported image
+        self.export_tile_size = 512  # The width and height in pixels of the tiles exports are rendered in
+        self.export_workers = 0  # The number of processes rendering tiles, 0 uses one per core
+        self.export_grid_dir = 'grids'  # The directory gridded data layers are exported to
+        self.export_grid_size = (4096, 2276)  # The width and height of exported data grids
+        self.export_grid_rows = 64  # The number of grid rows sampled and written at a time
+
+        # Shared memory settings, a published map copies its fields to a shared memory block other processes can read
+        self.shm_enable = False
+        self.shm_name = None  # The name of the shared memory block, None lets the system pick one
+        self.shm_publish_rate = 1  # The number of atmosphere ticks between each published snapshot
+
+        # Level of detail settings, used when the cells on screen are too small to be worth drawing one at a time
+        self.lod_enable = True
+        self.lod_cell_pixels = 48  # Below this average area in pixels per visible cell, the LOD tiles are drawn
+        self.lod_tile_size = 512  # The width and height in pixels of a single LOD tile
+        self.lod_max_tiles = 128  # The number of rendered tiles kept in memory, the least recently used are dropped
+        self.lod_max_level = 8  # The deepest level of the pyramid, each level doubles the resolution of the last
+
         # Color settings
         self.clr = {'black': (8, 8, 8),
                     'ocean': (128, 128, 224),
                     'river': (32, 32, 96)}
 
-        # Text settings
-        pygame.font.init()
+        # Text settings, the fonts are loaded the first time they are used, see get_font
         self.font_head_size = 30
         self.font_body_size = 18
         if self.enableAA:
             self.font_head_size *= 2
             self.font_body_size *= 2
-        self.font_head = pygame.font.Font('fonts/sylfaen.ttf', self.font_head_size)
-        self.font_body = pygame.font.Font('fonts/reemkufi.ttf', self.font_body_size)
+        self.font_head_file = 'fonts/sylfaen.ttf'
+        self.font_body_file = 'fonts/reemkufi.ttf'
+        self.fonts = {}
 
         # Voronoi generation settings
         self.total_cells = 500
         self.relax_passes = 5
+        self.point_sampler = 'uniform'  # 'uniform' scatters the generator points, 'poisson' spaces them out evenly, so
+                                        # zero or one relax pass is enough
+        self.point_sampler_attempts = 30  # The candidates the 'poisson' sampler tries around a point before giving up
+        self.refine_coarse_share = 0.2  # The cells of the coarse map used by gen_coarse_to_fine, as a share of
+                                        # total_cells, must be below 1
+        self.refine_settle_ticks = 50  # The ticks a refined map simulates after being warm started from the coarse map
 
         # Terrain generation settings
         self.tect_plates_min = 10    # The minimum number of tectonic plates used in altitude generation
@@ -75,8 +152,15 @@ class Settings:
         self.atmo_tropics_extent = 0.18  # The +/- Y value where the tropics extend to from the "equator" (y = 0)
         self.atmo_arctic_extent = 0.2  # The Y value where the arctic zones extend to from the map's edges (far_y)
         self.atmo_iterations_per_frame = 2  # The number of times per frame to run the atmospheric calculations
+        self.atmo_track_residuals = True  # Whether the map measures how much the atmosphere changes every tick
+        self.atmo_steady_tol = 0.01  # The residual between matching seasons of consecutive years that counts as steady
+        self.atmo_steady_max_ticks = 4000  # The most ticks that run_until_steady will simulate before giving up
+        self.atmo_freeze_converged = False  # Whether converged regions stop simulating and replay their last year
+        self.atmo_freeze_tol = 0.005  # The seasonal residual a single cell must fall under before it can be frozen
+        self.atmo_engine = 'objects'  # 'objects' updates the cells one at a time, 'arrays' steps them all at once
+        self.atmo_workers = 1  # The number of processes the arrays engine divides the map between, 0 uses one per core
 
-        self.wind_streams_vector = Vector2(0.11, 0)  # The vector of the jetstreams added to wind vectors
+        self.wind_streams_vector = (0.11, 0.0)  # The (x, y) of the jetstreams added to wind vectors
         self.wind_deflection_weight = 0.8  # The weight given to the effect of a deflection modifier
         self.wind_take_strength = 0.22  # The percentage of a cell's wind that is lost to take_wind at wind_multi 1
         self.wind_critical_angle = 1.7  # Maximum angle that wind will
@@ -84,6 +168,7 @@ class Settings:
         self.wind_hard_cap = 1.0  # Hard cap for wind speed
         self.wind_resistance = 0.015  # Resistance offered by the soft cap and by air friction
         self.wind_presim = 0        # Number of wind ticks to presimulate in worldgen
+        self.wind_presim_until_steady = False  # Presimulate until the climate settles, instead of for wind_presim ticks
 
         self.temps_equatorial = 95.0    # The target temperature for the equator (in F, because I am a dumb American)
         self.temps_freezing = 32.0   # A number used by the atmosphere renderer to determine the cold gradient
@@ -106,6 +191,7 @@ class Settings:
         self.season_ticks_modifier = 0.0  # A Modifier calculated internally by the function .find_season_multi
 
         self.wtr_sea_level = 0.20  # The sea level of the terrain, all lower points will be underwater
+        self.wtr_sea_level_step = 0.01  # The change in sea level for each press of the sea level keys in the window
         self.wtr_rainfall_mod = 0.37  # A multiplier on per-tick rainfall, only affects precipitation, not humidity
         self.wtr_baro_evap_rate = 0.001  # The size of a parcel of sea water evaporation pressure
         self.wtr_humid_evap_rate = 0.04  # The size of a parcel of sea water evaporation humidity
@@ -119,6 +205,25 @@ class Settings:
         self.erode_enable = True  # Whether erosion is calculated at all or not
         self.erode_mod = 1.0  # The multiplier applied to erosion rates
 
+        # Ocean settings, rates are per atmosphere tick
+        self.ocean_enable = True  # Whether the ocean currents are stepped and exchange heat with the air
+        self.ocean_wind_drag = 0.01  # The share of the surface wind added to the current of an ocean cell
+        self.ocean_friction = 0.05  # The share of its current an ocean cell loses to friction
+        self.ocean_coriolis = 0.04  # The angle in radians currents turn by at the top and bottom edges of the map
+        self.ocean_viscosity = 0.1  # The rate currents even out toward the average of their ocean neighbors
+        self.ocean_max_current = 0.5  # The cap on the speed of a current
+        self.ocean_heat_transport = 0.5  # The share of the difference in sea temperature a current carries downstream
+        self.ocean_max_pull = 0.5  # The most an ocean cell's sea temperature can move toward its upstream neighbors
+        self.ocean_air_exchange = 0.01  # The rate the sea temperature moves toward the temperature of the air above
+        self.ocean_heat_feedback = 0.02  # The rate the air over the sea moves toward the sea temperature
+        self.ocean_coastal_feedback = 0.01  # The rate coastal land moves toward the temperature of the sea beside it
+
+        # Scheduler settings, rates are the number of atmosphere ticks between each run of a subsystem
+        self.sched_hydrology_rate = 5  # Water accumulates in the vertices between runs and flows in a single step
+        self.sched_season_rate = 1  # How often the season and year counters are checked for a turnover
+        self.sched_erosion_rate = 50  # Erosion, at the default of 1/4 of season_ticks_per_year runs once a season
+        self.sched_ocean_rate = 10  # The oceans change slowly, so their currents are stepped over several ticks at once
+
         # Biome generation settings
         self.biome_humid_high = 0.8  # Average humidity required for high humidity biomes to form
         self.biome_humid_low = 0.2  # Average humidity required for normal humidity biomes to form
@@ -178,6 +283,26 @@ class Settings:
             self.wtr_river_flow_as_width /= 2
             self.wtr_max_river_render_width *= 2
 
+    @property
+    def font_head(self):
+        """The font of headings."""
+        return self.get_font('head')
+
+    @property
+    def font_body(self):
+        """The font of body text."""
+        return self.get_font('body')
+
+    def get_font(self, kind):
+        """Returns the 'head' or 'body' font, loading it the first time it is asked for. Maps made without a window
+        never ask, so they never start pygame's font module or read the font files."""
+        if kind not in self.fonts:
+            import pygame.font
+            pygame.font.init()
+            self.fonts[kind] = pygame.font.Font(getattr(self, f'font_{kind}_file'),
+                                                getattr(self, f'font_{kind}_size'))
+        return self.fonts[kind]
+
     def db_print(self, string, detail=0):
         """A debugging function that allows selective printing of debug console text based on a
         level of detail set per message. Helps cut down on console clutter/vomit."""
@@ -188,8 +313,8 @@ class Settings:
         """Takes the percentage of this year's ticks that have been completed already and sets season_ticks_modifier"""
         self.season_ticks_modifier = math.sin(year_as_percent / (math.pi / 20)) * self.season_incline
 
-    def project_to_screen(self, x, y):
-        """Takes an x, y between -1.0 and 1.0, and projects them into the coordinates based on the screen size."""
+    def get_screen_scale(self):
+        """Returns the number of screen pixels per unit of map distance on the x and y axes at the current zoom."""
         # Find the width of a pixel on the screen, expressed as a ratio of 1, divide in half because 0,0 is centered
         ss_x = self.screen_size[0] / 2
         ss_y = self.screen_size[1] / 2
@@ -198,9 +323,16 @@ class Settings:
         ss_x = (ss_x * 3) / (self.map.far_x + 2)
         ss_y = (ss_y * 3) / (self.map.far_y + 2)
 
-        # Find the relative position by multiplying the pixel ratio by the position
-        ss_x *= x
-        ss_y *= y
+        return ss_x * self.view_zoom, ss_y * self.view_zoom
+
+    def project_to_screen(self, x, y):
+        """Takes an x, y between -1.0 and 1.0, and projects them into the coordinates based on the screen size.
+        The x and y may also be numpy arrays, which projects a whole batch of points at once."""
+        scale_x, scale_y = self.get_screen_scale()
+
+        # Find the relative position by multiplying the pixel ratio by the position relative to the view's center
+        ss_x = scale_x * (x - self.view_center[0])
+        ss_y = scale_y * (y - self.view_center[1])
 
         # Add 1/2 the screen width to adjust for the 0,0 of the screen being offset of the map's 0,0 center
         ss_x += self.screen_size[0] / 2
@@ -208,3 +340,12 @@ class Settings:
 
         # Return the result
         return ss_x, ss_y
+
+    def project_from_screen(self, ss_x, ss_y):
+        """The inverse of project_to_screen, takes screen coordinates and returns the map coordinates under them."""
+        scale_x, scale_y = self.get_screen_scale()
+
+        x = (ss_x - self.screen_size[0] / 2) / scale_x + self.view_center[0]
+        y = (ss_y - self.screen_size[1] / 2) / scale_y + self.view_center[1]
+
+        return x, y
@@ -0,0 +1,123 @@
+import numpy
+
+from spatial import GridIndex
+
+
+class SettlementEngine:
+    """Scores how habitable the land is and places settlements on it, then grows their populations season by season.
+
+    Habitability is found for every cell at once from the cell fields and the map's distance fields. A cell scores
+    for a mild temperature, for its rainfall and for being near a river or the coast, as a weighted average of the
+    four, which is then scaled by the tags of the cell's biome once there are biomes. Cells in the sea score nothing.
+
+    Settlements are placed by drawing land cells at random, weighted by their habitability, and keeping each one that
+    is at least settl_min_spacing from every settlement kept before it, which a GridIndex of the kept settlements
+    answers from the buckets around the cell. The settlements are kept as arrays in the order they were placed, the
+    number of each settlement's cell, its population and the population its cell can support."""
+    def __init__(self, k_map):
+        self.map = k_map
+        self.settings = k_map.settings
+
+        self.cells = numpy.zeros(0, dtype=k_map.fields.index_dtype)
+        self.populations = numpy.zeros(0)
+        self.capacities = numpy.zeros(0)
+
+        self.biome_scores = None          # The biome factor of every cell, rebuilt when the map's color_version changes
+        self.biome_scores_version = None
+
+    def get_biome_scores(self):
+        """Returns the biome factor of every cell, one plus the sum of settl_biome_tag_scores over its biome's tags,
+        never below zero. Cells without a biome have a factor of one."""
+        if self.biome_scores is None or self.biome_scores_version != self.map.color_version:
+            tag_scores = self.settings.settl_biome_tag_scores  # alias
+            scores = [1.0 + sum(tag_scores.get(tag, 0.0) for tag in cell.biome.biome_tags) if cell.biome else 1.0
+                      for cell in self.map.cells]
+            self.biome_scores = numpy.maximum(numpy.array(scores), 0.0)
+            self.biome_scores_version = self.map.color_version
+        return self.biome_scores
+
+    def get_habitability(self):
+        """Returns the habitability of every cell between 0 and 1, in the order of k_map.cells."""
+        stg = self.settings  # alias
+        fields = self.map.fields  # alias
+
+        temperature = fields.get_cell_field('temperature')
+        temperature_score = numpy.exp(-((temperature - stg.settl_ideal_temperature) / stg.settl_temperature_range) ** 2)
+        rainfall = numpy.maximum(fields.get_cell_field('rainfall_last_year'),
+                                 fields.get_cell_field('rainfall_this_year'))
+        rainfall_score = rainfall / (rainfall + stg.settl_rainfall_half)
+        river_score = numpy.exp(-self.map.distances.get_distance_to_rivers() / stg.settl_river_reach)
+        coast_score = numpy.exp(-self.map.distances.get_distance_to_sea() / stg.settl_coast_reach)
+
+        weights = (stg.settl_temperature_weight, stg.settl_rainfall_weight, stg.settl_river_weight,
+                   stg.settl_coast_weight)
+        scores = (temperature_score, rainfall_score, river_score, coast_score)
+        habitability = sum(weight * score for weight, score in zip(weights, scores)) / max(sum(weights), 1e-9)
+        habitability *= self.get_biome_scores()
+        habitability[fields.get_cell_field('altitude') <= stg.wtr_sea_level] = 0.0
+        return numpy.minimum(habitability, 1.0)
+
+    def place(self, count, min_spacing=None):
+        """Places up to count new settlements, each at least min_spacing (settl_min_spacing by default) from every
+        other, and returns the numbers of their cells. Fewer are placed if the habitable land runs out of room."""
+        stg = self.settings  # alias
+        min_spacing = stg.settl_min_spacing if min_spacing is None else min_spacing
+        habitability = self.get_habitability()
+        points = self.map.fields.cell_points  # alias
+
+        # Weighted sampling without replacement, each cell drawn with a key of a random number to the power of one
+        # over its habitability, so the most habitable cells tend to come first
+        candidates = numpy.flatnonzero(habitability > stg.settl_min_habitability)
+        keys = numpy.log(numpy.random.random(len(candidates))) / habitability[candidates]
+        candidates = candidates[numpy.argsort(-keys)].tolist()
+
+        # The buckets are as wide as the spacing, so the settlements near a cell are in the buckets around it
+        divisions = min(int(2.0 / max(min_spacing, 1e-9)), int(len(self.map.cells) ** 0.5))
+        index = GridIndex((-1.0, -1.0, 1.0, 1.0), divisions)
+        xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+        for cell in self.cells.tolist():
+            index.insert(cell, (xs[cell], ys[cell], xs[cell], ys[cell]))
+
+        placed = []
+        spacing_squared = min_spacing ** 2
+        for cell in candidates:
+            if len(placed) >= count:
+                break
+            x, y = xs[cell], ys[cell]
+            nearby = index.query((x - min_spacing, y - min_spacing, x + min_spacing, y + min_spacing))
+            if any((xs[other] - x) ** 2 + (ys[other] - y) ** 2 < spacing_squared for other in nearby):
+                continue
+            index.insert(cell, (x, y, x, y))
+            placed.append(cell)
+
+        placed = numpy.array(placed, dtype=self.cells.dtype)
+        capacities = habitability[placed] * stg.settl_capacity
+        self.cells = numpy.concatenate((self.cells, placed))
+        self.capacities = numpy.concatenate((self.capacities, capacities))
+        self.populations = numpy.concatenate((self.populations, capacities * stg.settl_founding_share))
+        self.settings.db_print(f"Placed {len(placed)} of {count} settlements from {len(candidates)} habitable cells.",
+                               detail=3)
+        return placed
+
+    def grow(self):
+        """Grows the population of every settlement by a season, toward the population its cell can support now. A
+        settlement above that, for example after the sea has risen over it, shrinks toward it instead."""
+        if len(self.cells) == 0:
+            return
+        stg = self.settings  # alias
+        self.capacities = self.get_habitability()[self.cells] * stg.settl_capacity
+
+        # Logistic growth, shrinking at no more than settl_decline of the population a season
+        crowding = self.populations / numpy.maximum(self.capacities, 1e-9)
+        growth = stg.settl_growth_rate * self.populations * (1.0 - crowding)
+        self.populations += numpy.maximum(growth, -stg.settl_decline * self.populations)
+
+    def get_settlement(self, number):
+        """Returns the cell, population and capacity of a settlement, by the order it was placed in."""
+        return self.map.cells[self.cells[number]], float(self.populations[number]), float(self.capacities[number])
+
+    def clear(self):
+        """Removes every settlement."""
+        self.cells = self.cells[:0]
+        self.populations = self.populations[:0]
+        self.capacities = self.capacities[:0]
@@ -0,0 +1,168 @@
+import atexit
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+from fields import CELL_FIELDS, VERTEX_FIELDS
+
+# The header is a row of int64 words at the start of the block, SEQUENCE is odd while a snapshot is being written
+HEADER_MAGIC = 0x4b484f53   # 'KHOS'
+HEADER_LAYOUT = 1
+MAGIC, LAYOUT, SEQUENCE, TICK, CELLS, VERTICES, CELL_FIELD_COUNT, VERTEX_FIELD_COUNT = range(8)
+HEADER_WORDS = 8
+
+# The names of the blocks published by this process
+published_names = set()
+
+
+def get_block_layout(cell_count, vertex_count):
+    """Returns the (offset, shape) of each array in a shared block, and the size of the block in bytes. The header is
+    followed by the cell fields, the vertex fields, then the cell and vertex points, all in float64."""
+    shapes = {'cell_fields': (len(CELL_FIELDS), cell_count),
+              'vertex_fields': (len(VERTEX_FIELDS), vertex_count),
+              'cell_points': (cell_count, 2),
+              'vertex_points': (vertex_count, 2)}
+
+    layout = {}
+    offset = HEADER_WORDS * 8
+    for name, shape in shapes.items():
+        layout[name] = (offset, shape)
+        offset += shape[0] * shape[1] * 8
+    return layout, offset
+
+
+def get_block_arrays(buffer, layout):
+    """Returns the header and a dictionary of name : array of a shared block, each a view of its buffer."""
+    header = numpy.ndarray((HEADER_WORDS,), dtype=numpy.int64, buffer=buffer)
+    arrays = {name: numpy.ndarray(shape, dtype=float, buffer=buffer, offset=offset)
+              for name, (offset, shape) in layout.items()}
+    return header, arrays
+
+
+class SharedState:
+    """Publishes a map's cell and vertex fields to a named shared memory block, so other processes on the machine can
+    read them with SharedStateReader without any serialization. The live fields stay in the map's FieldStore and are
+    copied into the block by publish, which the scheduler calls every settings.shm_publish_rate ticks.
+
+    The header carries the tick of the snapshot and a sequence counter that works as a seqlock: it is odd while a
+    snapshot is being copied in and even once the copy is whole, so a reader that sees the same even sequence before and
+    after its own copy knows it has a consistent snapshot. The copy is a few contiguous array copies, so the window in
+    which readers have to retry is short and the simulation never waits on them."""
+    def __init__(self, k_map, name=None):
+        self.map = k_map
+        self.settings = k_map.settings
+        fields = k_map.fields  # alias
+
+        self.layout, size = get_block_layout(len(k_map.cells), len(k_map.vertices))
+        self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.block.name
+        published_names.add(self.name)
+        self.header, self.arrays = get_block_arrays(self.block.buf, self.layout)
+
+        self.header[:] = (HEADER_MAGIC, HEADER_LAYOUT, 0, 0, len(k_map.cells), len(k_map.vertices),
+                          len(CELL_FIELDS), len(VERTEX_FIELDS))
+        self.arrays['cell_points'][:] = fields.cell_points
+        self.arrays['vertex_points'][:] = fields.vertex_points
+        self.publish()
+
+        # The block outlives the process unless it is unlinked, so make sure it is on the way out
+        atexit.register(self.close)
+        self.settings.db_print(f"Publishing the map's fields to the shared memory block '{self.name}'.", detail=2)
+
+    def publish(self):
+        """Copies the current fields into the shared block as a new snapshot."""
+        if self.block is None:
+            return
+
+        header = self.header  # alias
+        header[SEQUENCE] += 1
+        self.arrays['cell_fields'][:] = self.map.fields.cell_array
+        self.arrays['vertex_fields'][:] = self.map.fields.vertex_array
+        header[TICK] = self.map.scheduler.ticks
+        header[SEQUENCE] += 1
+
+    def close(self):
+        """Removes the shared block, readers that have it open keep their mapping until they close it."""
+        if self.block is None:
+            return
+
+        # The views into the buffer have to go before it can be closed
+        self.header, self.arrays = None, None
+        self.block.close()
+        self.block.unlink()
+        self.block = None
+        published_names.discard(self.name)
+
+
+class SharedStateReader:
+    """Maps the shared block of a running map read-only. The arrays are live views of the block, get_snapshot returns
+    consistent copies of them."""
+    def __init__(self, name):
+        self.block = shared_memory.SharedMemory(name=name)
+        # Attaching registers the block with this process's resource tracker, which would remove it when we exit, unless
+        # the block was published by this process and is already registered
+        if self.block.name not in published_names:
+            resource_tracker.unregister(self.block._name, 'shared_memory')
+
+        header = numpy.ndarray((HEADER_WORDS,), dtype=numpy.int64, buffer=self.block.buf)
+        if header[MAGIC] != HEADER_MAGIC or header[LAYOUT] != HEADER_LAYOUT:
+            self.block.close()
+            raise ValueError(f"The shared memory block '{name}' does not hold a published map.")
+        if header[CELL_FIELD_COUNT] != len(CELL_FIELDS) or header[VERTEX_FIELD_COUNT] != len(VERTEX_FIELDS):
+            self.block.close()
+            raise ValueError(f"The shared memory block '{name}' was published with different fields.")
+
+        self.layout, size = get_block_layout(int(header[CELLS]), int(header[VERTICES]))
+        self.header, self.arrays = get_block_arrays(self.block.buf, self.layout)
+        for each_array in self.arrays.values():
+            each_array.flags.writeable = False
+        self.header.flags.writeable = False
+
+    def get_tick(self):
+        """Returns the tick of the latest published snapshot."""
+        return int(self.header[TICK])
+
+    def get_snapshot(self, timeout=1.0):
+        """Returns a consistent copy of the latest snapshot as a dictionary holding its tick and a dictionary of field
+        name : array for the cells and for the vertices. Raises TimeoutError if no consistent copy could be made."""
+        give_up = time.monotonic() + timeout
+        while True:
+            sequence = int(self.header[SEQUENCE])
+            if sequence % 2 == 0:
+                tick = int(self.header[TICK])
+                cell_fields = self.arrays['cell_fields'].copy()
+                vertex_fields = self.arrays['vertex_fields'].copy()
+                if int(self.header[SEQUENCE]) == sequence:
+                    return {'tick': tick,
+                            'cells': dict(zip(CELL_FIELDS, cell_fields)),
+                            'vertices': dict(zip(VERTEX_FIELDS, vertex_fields))}
+
+            if time.monotonic() > give_up:
+                raise TimeoutError("The map was publishing for the whole timeout, no consistent snapshot was read.")
+            time.sleep(0)
+
+    def close(self):
+        """Releases this process's mapping of the block."""
+        self.header, self.arrays = None, None
+        self.block.close()
+
+
+if __name__ == "__main__":
+    # Usage: python shared_state.py name, prints a summary of each new snapshot of the published map
+    reader = SharedStateReader(sys.argv[1])
+    last_tick = None
+    try:
+        while True:
+            snapshot = reader.get_snapshot()
+            if snapshot['tick'] != last_tick:
+                last_tick = snapshot['tick']
+                cells = snapshot['cells']
+                print(f"Tick {last_tick}: mean temperature {cells['temperature'].mean():.3f}, "
+                      f"mean pressure {cells['pressure'].mean():.3f}, mean humidity {cells['humidity'].mean():.3f}")
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
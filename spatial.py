@@ -0,0 +1,50 @@
+import math
+
+
+class GridIndex:
+    """A spatial index that buckets items by their bounding boxes on a uniform grid, so the items near a point or
+    overlapping a rectangle can be found without checking every item. Bounding boxes are (min_x, min_y, max_x, max_y),
+    anything that falls outside of the grid's bounds is clamped into its edge buckets."""
+    def __init__(self, bounds, divisions):
+        self.min_x, self.min_y, self.max_x, self.max_y = bounds
+        self.divisions = max(1, divisions)
+        self.bucket_width = max(self.max_x - self.min_x, 1e-9) / self.divisions
+        self.bucket_height = max(self.max_y - self.min_y, 1e-9) / self.divisions
+        self.buckets = {}   # (column, row) : list of items
+
+    def get_bucket_range(self, bbox):
+        """Returns the first and last columns and rows of the buckets covered by the bounding box."""
+        last = self.divisions - 1
+        first_column = min(max(math.floor((bbox[0] - self.min_x) / self.bucket_width), 0), last)
+        first_row = min(max(math.floor((bbox[1] - self.min_y) / self.bucket_height), 0), last)
+        last_column = min(max(math.floor((bbox[2] - self.min_x) / self.bucket_width), 0), last)
+        last_row = min(max(math.floor((bbox[3] - self.min_y) / self.bucket_height), 0), last)
+        return first_column, first_row, last_column, last_row
+
+    def insert(self, item, bbox):
+        """Adds an item to every bucket its bounding box covers."""
+        first_column, first_row, last_column, last_row = self.get_bucket_range(bbox)
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                self.buckets.setdefault((column, row), []).append(item)
+
+    def query(self, bbox):
+        """Returns the set of items whose buckets overlap the bounding box. Items near the edges of the box may not
+        actually overlap it, so callers that need an exact answer should check the candidates themselves."""
+        found = set()
+        first_column, first_row, last_column, last_row = self.get_bucket_range(bbox)
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                found.update(self.buckets.get((column, row), ()))
+        return found
+
+    def query_point(self, x, y):
+        """Returns the items in the bucket under the point."""
+        return self.query((x, y, x, y))
+
+
+def get_bounding_box(points):
+    """Returns the bounding box of an iterable of objects with .x and .y set up."""
+    xs = [point.x for point in points]
+    ys = [point.y for point in points]
+    return min(xs), min(ys), max(xs), max(ys)
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import time
+
+# The statements timed by the benchmark, each run in a fresh interpreter so nothing is imported beforehand
+STARTUP_STATEMENTS = {'interpreter': 'pass',
+                      'numpy': 'import numpy',
+                      'settings': 'import settings',
+                      'khaos_map': 'import khaos_map',
+                      'Settings()': 'from settings import Settings; Settings()',
+                      'atmosphere': 'import atmosphere',
+                      'shared_state': 'import shared_state',
+                      'window': 'import window'}
+
+
+def get_startup_time(statement, runs=5):
+    """Returns the best wall time in seconds of starting a fresh interpreter in this directory and running the
+    statement. The best of several runs is the one least disturbed by the rest of the machine."""
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=os.path.dirname(os.path.abspath(__file__)),
+                       check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def get_loaded_modules(statement):
+    """Returns the set of the names of the modules loaded after running the statement in a fresh interpreter."""
+    result = subprocess.run([sys.executable, '-c', f"{statement}; import sys; print(' '.join(sys.modules))"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True,
+                            text=True)
+    # Pygame greets on stdout when it is imported, the module names are on the last line
+    return set(result.stdout.splitlines()[-1].split())
+
+
+if __name__ == "__main__":
+    # Usage: python startup_benchmark.py [runs]
+    benchmark_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"Best startup time of {benchmark_runs} runs, including the interpreter:")
+    for name, each_statement in STARTUP_STATEMENTS.items():
+        print(f"  {name:<16}{get_startup_time(each_statement, benchmark_runs) * 1000:>8.0f}ms")
+
+    map_modules = get_loaded_modules('import khaos_map')
+    print("Loaded by importing khaos_map:")
+    for package in ('pygame', 'scipy.spatial', 'scipy.interpolate', 'scipy.ndimage'):
+        print(f"  {package:<20}{'yes' if package in map_modules else 'no'}")
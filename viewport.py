@@ -0,0 +1,154 @@
+import math
+
+import numpy
+
+from spatial import GridIndex, get_bounding_box
+
+
+class Viewport:
+    """Manages the pan and zoom of the map view. Cells are indexed by their bounding boxes, so when the view changes
+    only the cells and vertices that intersect the screen are found and projected, all in one batch."""
+    def __init__(self, k_map):
+        self.map = k_map
+        self.settings = k_map.settings
+
+        # Index the cells by their bounding boxes, the index stores each cell's position in k_map.cells
+        self.cell_boxes = [get_bounding_box(cell.region) for cell in k_map.cells]
+        bounds = (min(box[0] for box in self.cell_boxes), min(box[1] for box in self.cell_boxes),
+                  max(box[2] for box in self.cell_boxes), max(box[3] for box in self.cell_boxes))
+        self.cell_index = GridIndex(bounds, int(math.sqrt(len(k_map.cells))))
+        for number, box in enumerate(self.cell_boxes):
+            self.cell_index.insert(number, box)
+
+        self.cell_numbers = {cell: index for index, cell in enumerate(k_map.cells)}
+
+        # Keep the coordinates of every vertex in arrays so they can be projected in batches
+        self.vertex_numbers = {vertex: index for index, vertex in enumerate(k_map.vertices)}
+        self.vertex_xs = numpy.array([vertex.x for vertex in k_map.vertices])
+        self.vertex_ys = numpy.array([vertex.y for vertex in k_map.vertices])
+
+        self.visible_cells = []
+        self.visible_numbers = numpy.zeros(0, dtype=int)   # The numbers of the visible cells, in the same order
+        self.visible_ss = numpy.zeros((2, 0))             # The screen space centers of the visible cells
+        self.visible_vertices = []
+        self.version = 0   # Counts view changes, so cached screen geometry knows when it is stale
+        self.is_dirty = True
+        self.is_lod = False   # True when the cells are too small on screen and are drawn from the LOD pyramid
+
+    def get_visible_bbox(self):
+        """Returns the bounding box of the map coordinates currently on screen."""
+        left, top = self.settings.project_from_screen(0, 0)
+        right, bottom = self.settings.project_from_screen(self.settings.screen_size[0], self.settings.screen_size[1])
+        return left, top, right, bottom
+
+    def pan(self, x_steps, y_steps):
+        """Pans the view by a number of steps on each axis, each step is a portion of the visible width."""
+        left, top, right, bottom = self.get_visible_bbox()
+        step = (right - left) * self.settings.view_pan_step
+
+        center_x, center_y = self.settings.view_center
+        self.settings.view_center = (center_x + x_steps * step, center_y + y_steps * step)
+        self.is_dirty = True
+
+    def zoom(self, steps, screen_point=None):
+        """Zooms the view in by a number of steps, or out for negative steps. If a screen point is given, the map
+        under that point stays in place, otherwise the view zooms about its center."""
+        new_zoom = self.settings.view_zoom * self.settings.view_zoom_step ** steps
+        new_zoom = min(max(new_zoom, 1.0), self.settings.view_zoom_max)
+
+        if screen_point is None:
+            self.settings.view_zoom = new_zoom
+        else:
+            anchor_x, anchor_y = self.settings.project_from_screen(*screen_point)
+            self.settings.view_zoom = new_zoom
+            moved_x, moved_y = self.settings.project_from_screen(*screen_point)
+            center_x, center_y = self.settings.view_center
+            self.settings.view_center = (center_x + anchor_x - moved_x, center_y + anchor_y - moved_y)
+
+        self.is_dirty = True
+
+    def reset(self):
+        """Returns the view to the whole map."""
+        self.settings.view_center = (0.0, 0.0)
+        self.settings.view_zoom = 1.0
+        self.is_dirty = True
+
+    def project_cells(self, cells):
+        """Projects the polygons of the given cells, along with their vertices and the vertices' neighbors, which
+        the vertices draw lines to. Returns the set of vertices that make up the polygons."""
+        drawn = set()
+        for each_cell in cells:
+            drawn.update(each_cell.region)
+        projected = set(drawn)
+        for each_vertex in drawn:
+            projected.update(each_vertex.neighbors)
+
+        # Project all of the vertices at once
+        numbers = numpy.fromiter((self.vertex_numbers[vertex] for vertex in projected), dtype=int,
+                                 count=len(projected))
+        ss_xs, ss_ys = self.settings.project_to_screen(self.vertex_xs[numbers], self.vertex_ys[numbers])
+        for number, ss_x, ss_y in zip(numbers.tolist(), ss_xs.tolist(), ss_ys.tolist()):
+            each_vertex = self.map.vertices[number]
+            each_vertex.ss_x = ss_x
+            each_vertex.ss_y = ss_y
+
+        # Cells reuse the projected vertices for their polygons
+        for each_cell in cells:
+            each_cell.polygon = [(vertex.ss_x, vertex.ss_y) for vertex in each_cell.region]
+
+        return drawn
+
+    def query_point(self, screen_point):
+        """Returns the cells that could lie under a screen point, with their polygons projected."""
+        x, y = self.settings.project_from_screen(*screen_point)
+        cells = [self.map.cells[number] for number in sorted(self.cell_index.query_point(x, y))]
+
+        # Cells drawn from the LOD pyramid do not have up to date polygons
+        if self.is_lod:
+            self.project_cells(cells)
+        return cells
+
+    def update(self):
+        """If the view has changed, finds the visible cells and vertices and projects them to the screen.
+        Returns True if the view changed."""
+        if not self.is_dirty:
+            return False
+        self.is_dirty = False
+        self.version += 1
+
+        # Keep the map's order, so the draw order does not shift as the view moves
+        left, top, right, bottom = self.get_visible_bbox()
+        visible_cells = []
+        for number in sorted(self.cell_index.query((left, top, right, bottom))):
+            box = self.cell_boxes[number]
+            if box[0] <= right and box[2] >= left and box[1] <= bottom and box[3] >= top:
+                visible_cells.append(self.map.cells[number])
+
+        # Project the cell centers all at once
+        cell_xs = numpy.array([cell.x for cell in visible_cells])
+        cell_ys = numpy.array([cell.y for cell in visible_cells])
+        ss_xs, ss_ys = self.settings.project_to_screen(cell_xs, cell_ys)
+        for each_cell, ss_x, ss_y in zip(visible_cells, ss_xs.tolist(), ss_ys.tolist()):
+            each_cell.ss_x = ss_x
+            each_cell.ss_y = ss_y
+
+        # When the visible cells are too small on screen to be worth drawing one by one, the LOD pyramid draws the
+        # map instead and the polygons are not projected
+        screen_pixels = self.settings.screen_size[0] * self.settings.screen_size[1]
+        self.is_lod = self.settings.lod_enable and len(visible_cells) * self.settings.lod_cell_pixels > screen_pixels
+
+        if self.is_lod:
+            drawn = set()
+            if self.map.focus_cell is not None:
+                self.project_cells([self.map.focus_cell])
+        else:
+            drawn = self.project_cells(visible_cells)
+
+        self.visible_cells = visible_cells
+        self.visible_numbers = numpy.fromiter((self.cell_numbers[cell] for cell in visible_cells), dtype=int,
+                                              count=len(visible_cells))
+        self.visible_ss = numpy.array((ss_xs, ss_ys)).reshape(2, len(visible_cells))
+        self.visible_vertices = sorted(drawn, key=self.vertex_numbers.get)
+
+        self.settings.db_print(f"View updated, {len(self.visible_cells)} cells visible.", detail=4)
+        return True
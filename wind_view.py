@@ -0,0 +1,49 @@
+import numpy
+
+from render import Renderable
+
+
+class WindView(Renderable):
+    """Draws the atmosphere over the map, a line along the wind of every visible cell colored by its temperature and
+    a dot at its center shaded by its pressure. The colors and the ends of the lines are found for all of the visible
+    cells at once from the map's fields and the screen centers the viewport projected, so drawing a frame only hands
+    the finished coordinates and colors to pygame."""
+    def __init__(self, k_map, viewport):
+        super().__init__()
+
+        self.map = k_map
+        self.viewport = viewport
+        self.settings = k_map.settings
+
+    def get_lines(self):
+        """Returns the colors, starts and ends of the wind lines and the colors of the pressure dots of the visible
+        cells, each as a list of tuples in the order of viewport.visible_cells."""
+        stg = self.settings  # alias
+        fields = self.map.fields  # alias
+        numbers = self.viewport.visible_numbers  # alias
+
+        # Temperature between freezing and equatorial, as a fraction that runs the line from blue to red
+        temperature = fields.get_cell_field('temperature')[numbers]
+        temp_as_percent = numpy.clip((temperature - stg.temps_freezing) /
+                                     abs(stg.temps_equatorial - stg.temps_freezing), 0.0, 1.0)
+        line_colors = numpy.array((200 * temp_as_percent,
+                                   128 - numpy.abs(128 - 14 ** (1 + temp_as_percent)),
+                                   255 - 200 * temp_as_percent)).T
+
+        starts = self.viewport.visible_ss
+        winds = numpy.array((fields.get_cell_field('wind_x')[numbers], fields.get_cell_field('wind_y')[numbers]))
+        ends = starts + winds * (numpy.array(stg.screen_size)[:, None] / 35)
+
+        pressure_colors = numpy.repeat(32 + 111 * (fields.get_cell_field('pressure')[numbers] + 1), 3).reshape(-1, 3)
+
+        return ([tuple(color) for color in line_colors.tolist()], list(zip(*starts.tolist())),
+                list(zip(*ends.tolist())), [tuple(color) for color in pressure_colors.tolist()])
+
+    def update(self, renderer):
+        """Draws the wind lines and pressure dots of the visible cells."""
+        import pygame.draw
+
+        line_colors, starts, ends, pressure_colors = self.get_lines()
+        for line_color, start, end, pressure_color in zip(line_colors, starts, ends, pressure_colors):
+            pygame.draw.line(renderer.screen, line_color, start, end, 1)
+            pygame.draw.circle(renderer.screen, pressure_color, start, 3)
@@ -1,6 +1,11 @@
 from khaos_map import KhaosMap
+from lod import LodPyramid
 import render
 from my_pygame_functions import is_point_in_polygon, TextBox
+from overlays import Overlays
+from raster import LabelMap
+from viewport import Viewport
+from wind_view import WindView
 
 import pygame
 import sys
@@ -30,13 +35,15 @@ class PyGameWindow:
 
         self.vertexQ = render.RenderQ(self.draw_screen, self.settings, 'vertex')
 
-        # Add the elements from the map to the RenderQs
-        for each_cell in self.map.cells:
-            self.cellQ.add(each_cell)
-            self.atmosphereQ.add(each_cell)
-
-        for each_vertex in self.map.vertices:
-            self.vertexQ.add(each_vertex)
+        # The viewport fills the map RenderQs with only the cells and vertices that are on screen
+        self.viewport = Viewport(self.map)
+        self.controls.viewport = self.viewport
+        self.overlays = Overlays(self.map)
+        self.controls.overlays = self.overlays
+        self.lod = LodPyramid(self.map, self.viewport, self.overlays)
+        self.label_map = LabelMap(self.map, self.viewport, self.overlays)
+        self.wind_view = WindView(self.map, self.viewport)
+        self.update_view()
 
         # Create the gui, including the GUI RenderQ
         self.guiQ, self.controls.buttons = self.build_gui()
@@ -67,6 +74,7 @@ class PyGameWindow:
                     for each_cell in self.map.cells:
                         each_cell.find_biome()
                         each_cell.find_color()
+                    self.map.color_version += 1
 
             # Update wind
             for iteration in range(0, self.settings.atmo_iterations_per_frame):
@@ -75,6 +83,12 @@ class PyGameWindow:
             # Update the map's text box
             self.map.update_textbox()
 
+            # Cull the map to the view if it has moved
+            self.update_view()
+
+            # Clear the screen, so nothing is left behind past the edge of the map as the view moves
+            self.draw_screen.fill(self.settings.clr['ocean'])
+
             # Update the renderQs
             if self.settings.enableAA:
                 self.masterQ.update()
@@ -84,6 +98,21 @@ class PyGameWindow:
             # Flip the screen
             pygame.display.flip()
 
+    def update_view(self):
+        """Updates the viewport, and if the view has changed refills the map RenderQs with what is now visible."""
+        if self.viewport.update():
+            # Small cells are drawn from the LOD pyramid, which has the rivers and coastlines baked in
+            if self.viewport.is_lod:
+                self.cellQ.set_queue([self.lod])
+                self.vertexQ.set_queue([])
+            else:
+                if self.settings.raster_enable:
+                    self.cellQ.set_queue([self.label_map])
+                else:
+                    self.cellQ.set_queue(self.viewport.visible_cells)
+                self.vertexQ.set_queue(self.viewport.visible_vertices + [self.map.coastlines, self.map.rivers])
+            self.atmosphereQ.set_queue([self.wind_view])
+
     def build_gui(self):
         """Creates all the gui objects and puts them in a shared RenderQ."""
         guiQ = render.RenderQ(self.draw_screen, self.settings, 'gui')
@@ -147,15 +176,31 @@ class KeyStrokes:
         self.controls = {'exit': [pygame.K_ESCAPE],
                          'confirm': [pygame.K_SPACE, pygame.K_RETURN],
                          'erosion': [pygame.K_e],
-                         'biomes': [pygame.K_b]}
+                         'biomes': [pygame.K_b],
+                         'sea_up': [pygame.K_PAGEUP],
+                         'sea_down': [pygame.K_PAGEDOWN],
+                         'pan_left': [pygame.K_LEFT],
+                         'pan_right': [pygame.K_RIGHT],
+                         'pan_up': [pygame.K_UP],
+                         'pan_down': [pygame.K_DOWN],
+                         'zoom_in': [pygame.K_EQUALS, pygame.K_KP_PLUS],
+                         'zoom_out': [pygame.K_MINUS, pygame.K_KP_MINUS],
+                         'view_reset': [pygame.K_HOME],
+                         'overlay': [pygame.K_o],
+                         'export': [pygame.K_p],
+                         'export_grids': [pygame.K_g]}
 
         self.ctrl_bools = {'exit': False,
                            'confirm': False,
                            'erosion': False,
-                           'biomes': False}
+                           'biomes': False,
+                           'sea_up': False,
+                           'sea_down': False}
 
         self.last_click = None
         self.buttons = None
+        self.viewport = None
+        self.overlays = None
 
     def update(self):
         for event in pygame.event.get():
@@ -172,6 +217,35 @@ class KeyStrokes:
                     self.ctrl_bools['erosion'] = True
                 elif event.key in self.controls['biomes']:
                     self.ctrl_bools['biomes'] = True
+                elif event.key in self.controls['sea_up']:
+                    self.ctrl_bools['sea_up'] = True
+                    self.change_sea_level(self.settings.wtr_sea_level_step)
+                elif event.key in self.controls['sea_down']:
+                    self.ctrl_bools['sea_down'] = True
+                    self.change_sea_level(-self.settings.wtr_sea_level_step)
+                elif event.key in self.controls['pan_left']:
+                    self.viewport.pan(-1, 0)
+                elif event.key in self.controls['pan_right']:
+                    self.viewport.pan(1, 0)
+                elif event.key in self.controls['pan_up']:
+                    self.viewport.pan(0, -1)
+                elif event.key in self.controls['pan_down']:
+                    self.viewport.pan(0, 1)
+                elif event.key in self.controls['zoom_in']:
+                    self.viewport.zoom(1)
+                elif event.key in self.controls['zoom_out']:
+                    self.viewport.zoom(-1)
+                elif event.key in self.controls['view_reset']:
+                    self.viewport.reset()
+                elif event.key in self.controls['overlay']:
+                    self.overlays.cycle()
+                # The exporters are only imported when used, grids in particular pulls in scipy.interpolate
+                elif event.key in self.controls['export']:
+                    from export import export_image
+                    export_image(self.settings.map, self.settings.export_path)
+                elif event.key in self.controls['export_grids']:
+                    from grids import export_grids
+                    export_grids(self.settings.map, self.settings.export_grid_dir)
 
             elif event.type == pygame.KEYUP:
                 if event.key in self.controls['exit']:
@@ -183,10 +257,27 @@ class KeyStrokes:
                     self.toggle_erosion()
                 elif event.key in self.controls['biomes']:
                     self.ctrl_bools['biomes'] = False
+                elif event.key in self.controls['sea_up']:
+                    self.ctrl_bools['sea_up'] = False
+                elif event.key in self.controls['sea_down']:
+                    self.ctrl_bools['sea_down'] = False
 
-            elif event.type == pygame.MOUSEBUTTONUP:
+            elif event.type == pygame.MOUSEBUTTONUP and event.button in (1, 2, 3):
                 self.last_click = event.pos
 
+            # Zoom about the mouse with the mouse wheel
+            elif event.type == pygame.MOUSEWHEEL:
+                mouse_pos = pygame.mouse.get_pos()
+                if self.settings.enableAA:
+                    mouse_pos = (mouse_pos[0] * 2, mouse_pos[1] * 2)
+                if mouse_pos[0] < self.settings.screen_size[0]:
+                    self.viewport.zoom(event.y, mouse_pos)
+
+    def change_sea_level(self, change):
+        """Called when a sea level key is pressed, slides the sea level up or down, clamped between 0 and 1."""
+        new_sea_level = min(max(self.settings.wtr_sea_level + change, 0.0), 1.0)
+        self.settings.map.set_sea_level(new_sea_level)
+
     def toggle_erosion(self):
         """Called when the erosion key is pressed, toggles erosion on and off."""
         self.settings.erode_enable = not self.settings.erode_enable
@@ -221,9 +312,9 @@ class KeyStrokes:
                 # Set last click to None again
                 self.last_click = None
 
-            # If the click is not on the gui, look for a cell
+            # If the click is not on the gui, look for a cell among those near the click
             else:
-                for each_cell in k_map.cells:
+                for each_cell in self.viewport.query_point(self.last_click):
                     if is_point_in_polygon(self.last_click, each_cell.polygon):
                         # When you find the polygon, empty out the last_click and set the focus cell
                         self.last_click = None